@@ -0,0 +1,138 @@
+__author__ = "Andrea Rubbi"
+""" approx_RF estimates Robinson Foulds distances from MinHash sketches of the
+	split sets of the trees, for sets too large for an exact all-pairs computation.
+	Every split gets the global id of bitset_RF and every tree a signature of
+	signature_length minima of random hash functions over its split ids: the
+	fraction of equal entries of two signatures estimates the Jaccard index J of
+	their split sets and, as the number of splits of each tree is known exactly,
+	RF(i, j) = (|Si| + |Sj|)(1 - J) / (1 + J). The error decreases as
+	1/sqrt(signature_length), and so does the speed of the comparisons."""
+
+import numpy as np
+
+try:
+    from .bitset_RF import file_split_incidence, rf_from_incidence
+    from .condensed import CondensedDistanceMatrix, row_start
+except ImportError:
+    from bitset_RF import file_split_incidence, rf_from_incidence
+    from condensed import CondensedDistanceMatrix, row_start
+
+try:
+    from ..tree_io.matrix_io import save_matrix
+except ImportError:
+    from tree_io.matrix_io import save_matrix
+
+# default number of hash functions per signature
+SIGNATURE_LENGTH = 128
+
+# number of trees sampled to measure the error against exact RF
+ERROR_SAMPLE = 200
+
+# Mersenne prime modulus of the hash functions (a * split + b) mod PRIME
+PRIME = (1 << 31) - 1
+
+
+def minhash_signatures(incidence, signature_length=SIGNATURE_LENGTH, seed=0):
+    """Computes the MinHash signatures of the split sets of the trees
+
+    Args:
+        incidence (scipy.sparse.csr_matrix): tree x split incidence matrix (see bitset_RF)
+        signature_length (int, optional): number of hash functions. Defaults to 128.
+        seed (int, optional): seed of the hash functions. Defaults to 0.
+
+    Returns:
+        signatures (np.array): n_trees x signature_length minima; trees without splits get PRIME
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, PRIME, size=signature_length, dtype=np.uint64)
+    b = rng.integers(0, PRIME, size=signature_length, dtype=np.uint64)
+    splits = np.asarray(incidence.indices, dtype=np.uint64)
+    starts, sizes = incidence.indptr[:-1], np.diff(incidence.indptr)
+
+    signatures = np.full((incidence.shape[0], signature_length), PRIME, dtype=np.uint32)
+    if len(splits) == 0:
+        return signatures
+    filled = sizes > 0
+    for k in range(signature_length):
+        hashes = (a[k] * splits + b[k]) % PRIME
+        # reduceat takes the minimum of every row, empty rows are left at PRIME
+        signatures[filled, k] = np.minimum.reduceat(hashes, starts[filled])
+    return signatures
+
+
+def estimate_rf(signatures, n_splits):
+    """Estimates RF distances between all the pairs of trees from their signatures
+
+    Args:
+        signatures (np.array): n_trees x signature_length MinHash signatures
+        n_splits (np.array): number of splits of every tree
+
+    Returns:
+        distance_matrix (CondensedDistanceMatrix): estimated RF distances, as float32
+    """
+    n_trees = signatures.shape[0]
+    n_splits = np.asarray(n_splits, dtype=np.float64)
+
+    def rows():
+        for i in range(n_trees):
+            jaccard = np.count_nonzero(signatures[i + 1 :] == signatures[i], axis=1)
+            jaccard = jaccard / signatures.shape[1]
+            yield (n_splits[i] + n_splits[i + 1 :]) * (1 - jaccard) / (1 + jaccard)
+
+    return CondensedDistanceMatrix.from_rows(rows(), n_trees, dtype=np.float32)
+
+
+def sample_error(incidence, distance_matrix, sample_size=ERROR_SAMPLE, seed=0):
+    """Measures the error of the estimates against exact RF on a sample of trees
+
+    Args:
+        incidence (scipy.sparse.csr_matrix): tree x split incidence matrix
+        distance_matrix (CondensedDistanceMatrix): estimated RF distances
+        sample_size (int, optional): number of sampled trees. Defaults to 200.
+        seed (int, optional): seed of the sample. Defaults to 0.
+
+    Returns:
+        error (dict): mean and max absolute error and mean exact RF of the sampled pairs
+    """
+    n_trees = incidence.shape[0]
+    sample = np.sort(
+        np.random.default_rng(seed).choice(
+            n_trees, size=min(sample_size, n_trees), replace=False
+        )
+    )
+    exact = np.asarray(rf_from_incidence(incidence[sample], condensed=True).condensed)
+    i, j = (sample[k] for k in np.triu_indices(len(sample), k=1))
+    estimated = np.asarray(distance_matrix.condensed)[row_start(i, n_trees) + j - i - 1]
+    if len(exact) == 0:
+        return {"mean": 0.0, "max": 0.0, "exact_mean": 0.0}
+    error = np.abs(estimated - exact)
+    return {"mean": error.mean(), "max": error.max(), "exact_mean": exact.mean()}
+
+
+def calculate_distance_matrix(
+    file, n_trees, output_file, signature_length=SIGNATURE_LENGTH, seed=0
+):
+    """Estimates the RF distance matrix with MinHash signatures and reports
+    its error against exact RF on a sample of trees
+
+    Args:
+        file (str): file containing the newick trees
+        n_trees (int): number of trees (or lines) in file
+        output_file (str): output file for distance matrix
+        signature_length (int, optional): number of hash functions: longer signatures
+            give smaller errors and slower comparisons. Defaults to 128.
+        seed (int, optional): seed of the hash functions and of the error sample. Defaults to 0.
+
+    Returns:
+        distance_matrix (CondensedDistanceMatrix): estimated distance matrix
+    """
+    incidence, taxa = file_split_incidence(file, n_trees)
+    signatures = minhash_signatures(incidence, signature_length, seed)
+    distance_matrix = estimate_rf(signatures, np.diff(incidence.indptr))
+
+    error = sample_error(incidence, distance_matrix, seed=seed)
+    print(
+        f"approx_RF: signature length {signature_length}, absolute error vs exact RF on {min(ERROR_SAMPLE, n_trees)} sampled trees: mean {error['mean']:.2f}, max {error['max']:.2f} (mean RF {error['exact_mean']:.2f})"
+    )
+    save_matrix(distance_matrix, output_file)
+    return distance_matrix
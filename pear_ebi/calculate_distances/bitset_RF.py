@@ -0,0 +1,248 @@
+__author__ = "Andrea Rubbi"
+""" bitset_RF computes all-pairs Robinson Foulds distances without comparing
+	trees one pair at a time. Each tree is reduced to its set of non-trivial splits,
+	encoded as canonical bitsets over a shared index of taxa. Every distinct split
+	gets a global id and the set of trees becomes a sparse tree x split incidence
+	matrix A, so that the number of splits shared by trees i and j is (A·Aᵀ)ij and
+	RF(i, j) = |Si| + |Sj| - 2·(A·Aᵀ)ij."""
+
+import numpy as np
+from scipy import sparse
+
+try:
+    from .condensed import CondensedDistanceMatrix, compact_dtype
+    from .maple_RF import readNewick
+except ImportError:
+    from condensed import CondensedDistanceMatrix, compact_dtype
+    from maple_RF import readNewick
+
+try:
+    from ..tree_io import cache
+    from ..tree_io.matrix_io import save_matrix
+    from ..tree_io.reader import iter_trees
+except ImportError:
+    from tree_io import cache
+    from tree_io.matrix_io import save_matrix
+    from tree_io.reader import iter_trees
+
+
+def tree_splits(tree, taxa, rooted=False, minimumBLen=0.000006):
+    """Computes the non-trivial splits of a tree as canonical bitsets
+
+    Args:
+        tree (maple_RF.Tree): tree returned by maple_RF.readNewick
+        taxa (dict): taxon name -> bit index; new taxa are added to it
+        rooted (bool, optional): set to True if the tree is rooted. Defaults to False.
+        minimumBLen (float, optional): branches not longer than this are collapsed,
+            as in maple_RF.RobinsonFouldsWithDay1985. Defaults to 0.000006.
+
+    Returns:
+        splits (dict): canonical bitset (int) -> branch length
+    """
+    # non-recursive postorder traversal collecting the leaf bitset of every node
+    masks = dict()
+    stack = [(tree, False)]
+    while stack:
+        node, visited = stack.pop()
+        if len(node.children) == 0:
+            name = node.name.replace("?", "_").replace("&", "_")
+            if name not in taxa:
+                taxa[name] = len(taxa)
+            masks[node] = 1 << taxa[name]
+        elif visited:
+            mask = 0
+            for child in node.children:
+                mask |= masks[child]
+            masks[node] = mask
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children)
+
+    full = masks[tree]
+    n_leaves = bin(full).count("1")
+    splits = dict()
+    for node, mask in masks.items():
+        if node is tree or len(node.children) == 0:
+            continue
+        if not rooted and mask & 1:
+            mask = full ^ mask
+        size = bin(mask).count("1")
+        # a rooted cluster of all leaves but one is informative, an unrooted split is not
+        if size < 2 or size > n_leaves - (1 if rooted else 2):
+            continue
+        # the two branches below an unrooted bifurcating root are the same split
+        splits[mask] = splits.get(mask, 0.0) + node.dist
+
+    return {mask: length for mask, length in splits.items() if length > minimumBLen}
+
+
+def split_incidence(trees, rooted=False, minimumBLen=0.000006, return_splits=False):
+    """Encodes a list of newick trees as a sparse tree x split incidence matrix
+
+    Args:
+        trees (iterable): trees in newick format, e.g. streamed by tree_io.reader.iter_trees
+        rooted (bool, optional): set to True if trees are rooted. Defaults to False.
+        minimumBLen (float, optional): minimum branch length. Defaults to 0.000006.
+        return_splits (bool, optional): also return the bitset of every split. Defaults to False.
+
+    Returns:
+        incidence (scipy.sparse.csr_matrix): A[i, s] = 1 if tree i contains split s
+        taxa (dict): taxon name -> bit index
+        splits (list): bitset (int) of split s, only if return_splits is True
+    """
+    taxa, split_ids = dict(), dict()
+    indptr, indices = [0], list()
+    for tree in trees:
+        for mask in tree_splits(
+            readNewick(tree)[0], taxa, rooted=rooted, minimumBLen=minimumBLen
+        ):
+            indices.append(split_ids.setdefault(mask, len(split_ids)))
+        indptr.append(len(indices))
+
+    incidence = sparse.csr_matrix(
+        (
+            np.ones(len(indices), dtype=np.int32),
+            np.array(indices, dtype=np.int64),
+            np.array(indptr, dtype=np.int64),
+        ),
+        shape=(len(indptr) - 1, len(split_ids)),
+    )
+    if return_splits:
+        return incidence, taxa, list(split_ids)
+    return incidence, taxa
+
+
+def pack_splits(splits, n_taxa):
+    """Packs split bitsets into the rows of a uint8 matrix
+
+    Args:
+        splits (list): bitsets (int)
+        n_taxa (int): number of taxa (bits)
+
+    Returns:
+        packed (np.array): row s holds the little-endian bytes of split s
+    """
+    n_bytes = max(1, (n_taxa + 7) // 8)
+    packed = b"".join(split.to_bytes(n_bytes, "little") for split in splits)
+    return np.frombuffer(packed, dtype=np.uint8).reshape(len(splits), n_bytes)
+
+
+def unpack_splits(packed):
+    """Inverse of pack_splits
+
+    Args:
+        packed (np.array): uint8 matrix returned by pack_splits
+
+    Returns:
+        splits (list): bitsets (int)
+    """
+    return [int.from_bytes(row.tobytes(), "little") for row in packed]
+
+
+def file_split_incidence(
+    file, n_trees, rooted=False, minimumBLen=0.000006, use_cache=True
+):
+    """Computes the split incidence matrix of a tree file, streaming through it.
+    The encoding (incidence matrix, taxa and packed splits) is stored in the
+    on-disk cache (see tree_io.cache), so that later calls on the same file skip parsing.
+
+    Args:
+        file (str): file containing the newick trees
+        n_trees (int): number of trees (or lines) in file
+        rooted (bool, optional): set to True if trees are rooted. Defaults to False.
+        minimumBLen (float, optional): minimum branch length. Defaults to 0.000006.
+        use_cache (bool, optional): read from and write to the cache. Defaults to True.
+
+    Returns:
+        incidence (scipy.sparse.csr_matrix): A[i, s] = 1 if tree i contains split s
+        taxa (dict): taxon name -> bit index
+    """
+    options = {"n_trees": n_trees, "rooted": rooted, "minimumBLen": minimumBLen}
+    key = cache.cache_key(file, "splits", **options) if use_cache else None
+    arrays = cache.load(key) if use_cache else None
+    if arrays is not None:
+        incidence = sparse.csr_matrix(
+            (
+                np.ones(len(arrays["indices"]), dtype=np.int32),
+                np.array(arrays["indices"]),
+                np.array(arrays["indptr"]),
+            ),
+            shape=(len(arrays["indptr"]) - 1, len(arrays["splits"])),
+        )
+        return incidence, {str(name): bit for bit, name in enumerate(arrays["taxa"])}
+
+    # trees are streamed: only their splits are kept in memory
+    trees = (tree for _, tree in zip(range(n_trees), iter_trees(file)))
+    incidence, taxa, splits = split_incidence(
+        trees, rooted=rooted, minimumBLen=minimumBLen, return_splits=True
+    )
+    if use_cache:
+        cache.store(
+            key,
+            {
+                "indptr": incidence.indptr,
+                "indices": incidence.indices,
+                "taxa": np.array(list(taxa)),
+                "splits": pack_splits(splits, len(taxa)),
+            },
+        )
+    return incidence, taxa
+
+
+def rf_from_incidence(incidence, block_size=None, condensed=False):
+    """Computes the RF distance matrix from a split incidence matrix,
+    one block of rows at a time
+
+    Args:
+        incidence (scipy.sparse.csr_matrix): tree x split incidence matrix
+        block_size (int, optional): rows per block; by default blocks hold ~1e7 entries.
+        condensed (bool, optional): return a CondensedDistanceMatrix with the smallest
+            integer dtype holding the distances. Defaults to False.
+
+    Returns:
+        distance_matrix (np.array or CondensedDistanceMatrix): symmetric RF distance matrix
+    """
+    n_trees = incidence.shape[0]
+    if block_size is None:
+        block_size = max(1, int(1e7) // max(n_trees, 1))
+    sizes = np.asarray(incidence.sum(axis=1)).ravel()
+    incidence_T = incidence.T.tocsc()
+
+    def blocks():
+        for start in range(0, n_trees, block_size):
+            stop = min(start + block_size, n_trees)
+            shared = (incidence[start:stop] @ incidence_T[:, start:]).toarray()
+            yield start, stop, sizes[start:stop, None] + sizes[None, start:] - 2 * shared
+
+    if condensed:
+        # RF(i, j) <= |Si| + |Sj|
+        dtype = compact_dtype(2 * sizes.max(initial=0))
+        rows = (
+            block[i - start, i - start + 1 :]
+            for start, stop, block in blocks()
+            for i in range(start, stop)
+        )
+        return CondensedDistanceMatrix.from_rows(rows, n_trees, dtype=dtype)
+
+    distance_matrix = np.zeros((n_trees, n_trees))
+    for start, stop, block in blocks():
+        distance_matrix[start:stop, start:] = block
+    distance_matrix = np.triu(distance_matrix, 1)
+    return distance_matrix + distance_matrix.transpose()
+
+
+def calculate_distance_matrix(file, n_trees, output_file):
+    """Computes unweighted Robinson Foulds distances with split bitsets and sparse matrix products
+
+    Args:
+        file (str): file containing the newick trees
+        n_trees (int): number of trees (or lines) in file
+        output_file (str): output file for distance matrix
+
+    Returns:
+        distance_matrix (CondensedDistanceMatrix): distance matrix
+    """
+    incidence, taxa = file_split_incidence(file, n_trees)
+    distance_matrix = rf_from_incidence(incidence, condensed=True)
+    save_matrix(distance_matrix, output_file)
+    return distance_matrix
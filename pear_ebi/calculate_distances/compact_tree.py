@@ -0,0 +1,637 @@
+__author__ = "Andrea Rubbi"
+""" compact_tree stores phylogenetic trees as flat numpy arrays instead of one
+	Python object per node. Nodes are numbered in preorder, so that the subtree of
+	node v is the range [v, end[v]) of the arrays, and every tree holds:
+	parent, first_child and next_sibling indexes, branch lengths and the taxon id
+	of its leaves (-1 for internal nodes). Taxon ids refer to a list of names shared
+	by all the trees of a CompactTreeSet, whose arrays are concatenated so that
+	the whole set can be placed in shared memory and used by other processes without pickling.
+	prepareTreeComparison and RobinsonFouldsWithDay1985 have array variants below,
+	giving the same results as the ones in maple_RF: as there, every internal branch
+	longer than minimumBLen is counted, including unary nodes and the cluster of
+	n-1 leaves below an unrooted (leaf, subtree) root."""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+try:
+    from .maple_RF import parseNewick
+except ImportError:
+    from maple_RF import parseNewick
+
+try:
+    from ..tree_io import cache, reader
+except ImportError:
+    from tree_io import cache, reader
+
+# arrays describing every node, with their dtype
+NODE_ARRAYS = {
+    "parent": np.int32,
+    "first_child": np.int32,
+    "next_sibling": np.int32,
+    "end": np.int32,
+    "leaf": np.int32,
+    "dist": np.float64,
+}
+
+
+class CompactTree(object):
+    def __init__(self, parent, first_child, next_sibling, end, leaf, dist, taxa):
+        self.parent = parent
+        self.first_child = first_child
+        self.next_sibling = next_sibling
+        self.end = end
+        self.leaf = leaf
+        self.dist = dist
+        self.taxa = taxa
+
+    def __len__(self):
+        return len(self.parent)
+
+    def __repr__(self):
+        return f"CompactTree({len(self)} nodes, {int((self.leaf >= 0).sum())} leaves)"
+
+    def children(self, node):
+        """Returns the children of node
+
+        Args:
+            node (int): node index
+
+        Returns:
+            children (list): indexes of the children of node
+        """
+        children = list()
+        child = self.first_child[node]
+        while child != -1:
+            children.append(int(child))
+            child = self.next_sibling[child]
+        return children
+
+
+def compact_from_newick(nwString, taxa, defaultBLen=0.000033, normalizeInputBLen=1.0):
+    """Builds the node arrays of a tree directly from its newick string
+
+    Args:
+        nwString (str): tree in newick format
+        taxa (dict): taxon name -> taxon id; new taxa are added to it
+        defaultBLen (float, optional): default branch length. Defaults to 0.000033.
+        normalizeInputBLen (float, optional): value used to normalize branch lenghts. Defaults to 1.0.
+
+    Returns:
+        arrays (dict): node arrays, see NODE_ARRAYS
+    """
+    parents, names, dists, ends = parseNewick(
+        nwString, defaultBLen=defaultBLen, normalizeInputBLen=normalizeInputBLen
+    )
+    parent = np.array(parents, dtype=np.int32)
+    end = np.array(ends, dtype=np.int32)
+    n_nodes = len(parent)
+    index = np.arange(n_nodes, dtype=np.int32)
+
+    # in preorder, the first child of v is v+1 and the next sibling of v starts where its subtree ends
+    first_child = np.full(n_nodes, -1, dtype=np.int32)
+    has_children = np.zeros(n_nodes, dtype=bool)
+    has_children[:-1] = parent[1:] == index[:-1]
+    first_child[has_children] = index[has_children] + 1
+    next_sibling = np.full(n_nodes, -1, dtype=np.int32)
+    has_sibling = end < n_nodes
+    has_sibling[0] = False
+    has_sibling[has_sibling] = parent[end[has_sibling]] == parent[has_sibling]
+    next_sibling[has_sibling] = end[has_sibling]
+
+    leaf = np.full(n_nodes, -1, dtype=np.int32)
+    for node in np.flatnonzero(~has_children):
+        name = names[node].replace("?", "_").replace("&", "_")
+        leaf[node] = taxa.setdefault(name, len(taxa))
+
+    return {
+        "parent": parent,
+        "first_child": first_child,
+        "next_sibling": next_sibling,
+        "end": end,
+        "leaf": leaf,
+        "dist": np.array(dists, dtype=np.float64),
+    }
+
+
+def readNewickCompact(tree_list, taxa=None, defaultBLen=0.000033, normalizeInputBLen=1.0):
+    """From a list of strings defining phylogenetic trees in newick format,
+    returns a list of CompactTree instances, as maple_RF.readNewick
+
+    Args:
+        tree_list (list): list of trees in newick format.
+        taxa (dict, optional): taxon name -> taxon id shared by the trees to be compared. Defaults to None.
+        defaultBLen (float, optional): default branch length. Defaults to 0.000033.
+        normalizeInputBLen (float, optional): value used to normalize branch lenghts. Defaults to 1.0.
+
+    Returns:
+        trees: list of CompactTree instances
+    """
+    taxa = dict() if taxa is None else taxa
+    tree_list = [tree_list] if isinstance(tree_list, str) else tree_list
+    return [
+        CompactTree(
+            **compact_from_newick(tree, taxa, defaultBLen, normalizeInputBLen), taxa=taxa
+        )
+        for tree in tree_list
+    ]
+
+
+def compact_from_tree(tree, taxa):
+    """Converts a maple_RF.Tree into arrays describing its nodes in preorder
+
+    Args:
+        tree (maple_RF.Tree): tree returned by maple_RF.readNewick
+        taxa (dict): taxon name -> taxon id; new taxa are added to it
+
+    Returns:
+        arrays (dict): node arrays, see NODE_ARRAYS
+    """
+    nodes, parents = list(), list()
+    stack = [(tree, -1)]
+    while stack:
+        node, parent = stack.pop()
+        parents.append(parent)
+        nodes.append(node)
+        index = len(nodes) - 1
+        stack.extend((child, index) for child in reversed(node.children))
+
+    n_nodes = len(nodes)
+    parent = np.array(parents, dtype=np.int32)
+    first_child = np.full(n_nodes, -1, dtype=np.int32)
+    next_sibling = np.full(n_nodes, -1, dtype=np.int32)
+    leaf = np.full(n_nodes, -1, dtype=np.int32)
+    dist = np.array([node.dist for node in nodes], dtype=np.float64)
+    last_child = dict()
+    for index in range(1, n_nodes):
+        p = parents[index]
+        if p in last_child:
+            next_sibling[last_child[p]] = index
+        else:
+            first_child[p] = index
+        last_child[p] = index
+    for index, node in enumerate(nodes):
+        if len(node.children) == 0:
+            name = node.name.replace("?", "_").replace("&", "_")
+            leaf[index] = taxa.setdefault(name, len(taxa))
+
+    return {
+        "parent": parent,
+        "first_child": first_child,
+        "next_sibling": next_sibling,
+        "end": subtree_ends(parent),
+        "leaf": leaf,
+        "dist": dist,
+    }
+
+
+def subtree_ends(parent):
+    """Computes the (exclusive) end of the subtree of every node from the parent array
+
+    Args:
+        parent (np.array): parent of every node, nodes in preorder
+
+    Returns:
+        end (np.array): subtree of node v is [v, end[v])
+    """
+    size = np.ones(len(parent), dtype=np.int32)
+    for node in range(len(parent) - 1, 0, -1):
+        size[parent[node]] += size[node]
+    return np.arange(len(parent), dtype=np.int32) + size
+
+
+class CompactTreeSet(object):
+    def __init__(self, arrays, offsets, taxa):
+        """Set of trees stored as concatenated node arrays
+
+        arrays: dict of concatenated node arrays (see NODE_ARRAYS), with indexes local to each tree
+        offsets: tree i spans the nodes offsets[i]:offsets[i+1]
+        taxa: list of taxon names shared by all the trees
+        """
+        self.arrays = arrays
+        self.offsets = offsets
+        self.taxa = taxa
+        self._shm = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return CompactTree(
+            **{name: self.arrays[name][start:stop] for name in NODE_ARRAYS},
+            taxa=self.taxa,
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return f"CompactTreeSet({len(self)} trees, {len(self.taxa)} taxa)"
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values()) + self.offsets.nbytes
+
+    @classmethod
+    def from_trees(cls, trees):
+        """Builds a CompactTreeSet from maple_RF.Tree instances
+
+        Args:
+            trees (list): list of maple_RF.Tree
+
+        Returns:
+            CompactTreeSet: compact set of trees
+        """
+        taxa = dict()
+        return cls.from_node_arrays(
+            [compact_from_tree(tree, taxa) for tree in trees], taxa
+        )
+
+    @classmethod
+    def from_newick(cls, tree_list):
+        """Builds a CompactTreeSet from a list of trees in newick format
+
+        Args:
+            tree_list (list): list of trees in newick format
+
+        Returns:
+            CompactTreeSet: compact set of trees
+        """
+        taxa = dict()
+        tree_list = [tree_list] if isinstance(tree_list, str) else tree_list
+        return cls.from_node_arrays(
+            [compact_from_newick(tree, taxa) for tree in tree_list], taxa
+        )
+
+    @classmethod
+    def from_cache(cls, file, defaultBLen=0.000033, normalizeInputBLen=1.0):
+        """Loads the CompactTreeSet of a tree file from the on-disk cache, without parsing
+
+        Args:
+            file (str): file containing one tree in newick format per line
+            defaultBLen (float, optional): length of branches without one. Defaults to 0.000033.
+            normalizeInputBLen (float, optional): factor applied to branch lengths. Defaults to 1.0.
+
+        Returns:
+            CompactTreeSet: memory mapped compact set of trees, None if file is not cached
+        """
+        options = {"defaultBLen": defaultBLen, "normalizeInputBLen": normalizeInputBLen}
+        arrays = cache.load(cache.cache_key(file, "compact", **options))
+        if arrays is None:
+            return None
+        offsets, taxa = arrays.pop("offsets"), arrays.pop("taxa")
+        return cls(arrays, offsets, [str(name) for name in taxa])
+
+    @classmethod
+    def from_file(
+        cls, file, defaultBLen=0.000033, normalizeInputBLen=1.0, use_cache=True
+    ):
+        """Builds the CompactTreeSet of a tree file, streaming through it.
+        The arrays are stored in the on-disk cache (see tree_io.cache),
+        so that later calls on the same file load them without parsing.
+
+        Args:
+            file (str): file containing one tree in newick format per line
+            defaultBLen (float, optional): length of branches without one. Defaults to 0.000033.
+            normalizeInputBLen (float, optional): factor applied to branch lengths. Defaults to 1.0.
+            use_cache (bool, optional): read from and write to the cache. Defaults to True.
+
+        Returns:
+            CompactTreeSet: compact set of trees, memory mapped from the cache on a hit
+        """
+        options = {"defaultBLen": defaultBLen, "normalizeInputBLen": normalizeInputBLen}
+        if use_cache:
+            tree_set = cls.from_cache(file, **options)
+            if tree_set is not None:
+                return tree_set
+
+        taxa = dict()
+        tree_set = cls.from_node_arrays(
+            [
+                compact_from_newick(tree, taxa, **options)
+                for tree in reader.iter_trees(file)
+            ],
+            taxa,
+        )
+        if use_cache:
+            cache.store(
+                cache.cache_key(file, "compact", **options),
+                dict(
+                    tree_set.arrays,
+                    offsets=tree_set.offsets,
+                    taxa=np.array(tree_set.taxa),
+                ),
+            )
+        return tree_set
+
+    @classmethod
+    def from_node_arrays(cls, node_arrays, taxa):
+        """Concatenates the node arrays of several trees
+
+        Args:
+            node_arrays (list): list of dicts of node arrays, one per tree
+            taxa (dict): taxon name -> taxon id
+
+        Returns:
+            CompactTreeSet: compact set of trees
+        """
+        sizes = [len(arrays["parent"]) for arrays in node_arrays]
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        arrays = {
+            name: (
+                np.concatenate([arrays[name] for arrays in node_arrays]).astype(dtype)
+                if node_arrays
+                else np.zeros(0, dtype=dtype)
+            )
+            for name, dtype in NODE_ARRAYS.items()
+        }
+        names = [None] * len(taxa)
+        for name, taxon in taxa.items():
+            names[taxon] = name
+        return cls(arrays, offsets, names)
+
+    # ─── SHARED MEMORY ─────────────────────────────────────────────────────
+    def share(self):
+        """Copies the arrays of the set into a shared memory block.
+        The returned descriptor is small and can be passed to other processes,
+        which access the trees with CompactTreeSet.attach(descriptor).
+
+        Returns:
+            descriptor (dict): name of the shared block, layout of the arrays and taxa
+        """
+        layout, size = dict(), 0
+        for name, array in list(self.arrays.items()) + [("offsets", self.offsets)]:
+            layout[name] = (size, len(array), np.dtype(array.dtype).str)
+            size += array.nbytes
+        self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for name, array in list(self.arrays.items()) + [("offsets", self.offsets)]:
+            start, length, dtype = layout[name]
+            np.ndarray(length, dtype=dtype, buffer=self._shm.buf, offset=start)[:] = array
+        return {"name": self._shm.name, "layout": layout, "taxa": self.taxa}
+
+    @classmethod
+    def attach(cls, descriptor):
+        """Accesses a CompactTreeSet shared by another process with share()
+
+        Args:
+            descriptor (dict): descriptor returned by share()
+
+        Returns:
+            CompactTreeSet: compact set of trees backed by shared memory
+        """
+        shm = shared_memory.SharedMemory(name=descriptor["name"])
+        views = {
+            name: np.ndarray(length, dtype=dtype, buffer=shm.buf, offset=start)
+            for name, (start, length, dtype) in descriptor["layout"].items()
+        }
+        offsets = views.pop("offsets")
+        tree_set = cls(views, offsets, descriptor["taxa"])
+        tree_set._shm = shm
+        return tree_set
+
+    def release(self, unlink=False):
+        """Releases the shared memory block backing the set
+
+        Args:
+            unlink (bool, optional): also destroy the block (owner process only). Defaults to False.
+        """
+        if self._shm is not None:
+            self.arrays = {name: np.array(array) for name, array in self.arrays.items()}
+            self.offsets = np.array(self.offsets)
+            self._shm.close()
+            if unlink:
+                self._shm.unlink()
+            self._shm = None
+
+
+# ─── DAY'S ALGORITHM ON COMPACT TREES ─────────────────────────────────────────
+def _range_reduce(values, starts, ends, ufunc):
+    """Reduces values over the ranges [starts, ends) with a sparse table
+
+    Args:
+        values (np.array): values to reduce
+        starts (np.array): start of each range
+        ends (np.array): exclusive end of each range (ends > starts)
+        ufunc (np.ufunc): np.minimum or np.maximum
+
+    Returns:
+        reduced (np.array): reduction of every range
+    """
+    lengths = ends - starts
+    if len(lengths) == 0:
+        return np.zeros(0, dtype=values.dtype)
+    levels = [values]
+    while (1 << len(levels)) <= lengths.max():
+        previous, half = levels[-1], 1 << (len(levels) - 1)
+        levels.append(ufunc(previous[:-half], previous[half:]))
+    k = np.floor(np.log2(lengths)).astype(np.int64)
+    reduced = np.empty(len(starts), dtype=values.dtype)
+    for level in np.unique(k):
+        mask = k == level
+        table = levels[level]
+        reduced[mask] = ufunc(table[starts[mask]], table[ends[mask] - (1 << level)])
+    return reduced
+
+
+def _branches(tree, rooted):
+    """Selects the internal branches of a compact tree and their lengths.
+    Below an unrooted bifurcating root, the two branches are merged on the second child.
+
+    Args:
+        tree (CompactTree): compact tree
+        rooted (bool): True if the tree is rooted
+
+    Returns:
+        nodes (np.array): nodes below the selected branches
+        lengths (np.array): lengths of the selected branches
+    """
+    internal = tree.first_child >= 0
+    internal[0] = False
+    lengths = tree.dist.copy()
+    root_children = tree.children(0)
+    if not rooted and len(root_children) == 2:
+        internal[root_children[0]] = False
+        lengths[root_children[1]] += tree.dist[root_children[0]]
+    nodes = np.flatnonzero(internal)
+    return nodes, lengths[nodes]
+
+
+def _day_table(L, R, last_child, flipped, leafCount):
+    """Fills Day's cluster table as maple_RF.prepareTreeComparison does, slot by slot.
+    Every cluster goes in slot R, or in slot L if its node is the last child and
+    the slot is empty; flipped clusters always go in slot L. Degenerate trees
+    (e.g. with unary nodes) may overwrite slots, and those clusters are then
+    not found, exactly as in maple_RF.
+
+    Args:
+        L (np.array): first leaf of the clusters, in postorder
+        R (np.array): last leaf of the clusters, in postorder
+        last_child (np.array): True if the node of the cluster is the last child of its parent
+        flipped (np.array): True if the cluster has been flipped to exclude leaf 0
+        leafCount (int): number of leaves
+
+    Returns:
+        nodeTable (np.array): leafCount x 2 table of clusters
+    """
+    nodeTable = np.zeros((leafCount, 2), dtype=np.int64)
+    for l, r, last, flip in zip(L.tolist(), R.tolist(), last_child, flipped):
+        if l >= leafCount:
+            # the flipped cluster of all the leaves has no slot
+            continue
+        if flip or (last and nodeTable[l, 0] == 0 and nodeTable[l, 1] == 0):
+            slot = l
+        else:
+            slot = r
+        nodeTable[slot] = l, r
+    # the root cluster is written last
+    nodeTable[leafCount - 1] = 0, leafCount - 1
+    return nodeTable
+
+
+def prepareTreeComparisonCompact(t1, rooted=False, minimumBLen=0.000006):
+    """Prepares a compact tree for comparison, as maple_RF.prepareTreeComparison.
+    Clusters are stored as sorted keys L * leafCount + R, so that branch lengths
+    are looked up in a vectorized way, next to Day's table of clusters.
+
+    Args:
+        t1 (CompactTree): input tree
+        rooted (bool, optional): set to True if t1 is rooted, default to False
+        minimumBLen (float, optional): minimum value for branch length, default to 6E-6
+
+    Returns:
+        tree metrics (tuple of values) (leafNumbers, leafDists, leafCount, numBranches, nodeTable, clusterKeys, clusterLengths, sumBranchLengths): tree metrics for the comparison.
+    """
+    is_leaf = t1.first_child < 0
+    leaves = np.flatnonzero(is_leaf)
+    leafCount = len(leaves)
+    # leaf numbers follow the preorder, so the leaves under every node are [L, R]
+    leaves_before = np.concatenate(([0], np.cumsum(is_leaf)))
+    leafNumbers = np.full(len(t1.taxa), -1, dtype=np.int64)
+    leafNumbers[t1.leaf[leaves]] = np.arange(leafCount)
+    leafDists = t1.dist[leaves]
+
+    internal = (~is_leaf).copy()
+    internal[0] = False
+    sumBranchLengths = t1.dist[internal].sum()
+
+    nodes, lengths = _branches(t1, rooted)
+    keep = lengths > minimumBLen
+    nodes, lengths = nodes[keep], lengths[keep]
+    L = leaves_before[nodes]
+    R = leaves_before[t1.end[nodes]] - 1
+    last_child = t1.next_sibling[nodes] < 0
+    # if unrooted, trees are re-rooted at leaf 0 and clusters containing it are flipped
+    flip = np.zeros(len(nodes), dtype=bool) if rooted else L == 0
+    L, R = np.where(flip, R + 1, L), np.where(flip, leafCount - 1, R)
+    postorder = np.lexsort((-nodes, t1.end[nodes]))
+    L, R, lengths = L[postorder], R[postorder], lengths[postorder]
+    nodeTable = _day_table(L, R, last_child[postorder], flip[postorder], leafCount)
+
+    keys = L.astype(np.int64) * leafCount + R
+    # a repeated cluster keeps the length written last in postorder, as in maple_RF
+    order = np.argsort(keys, kind="stable")
+    keys, lengths = keys[order], lengths[order]
+    last = np.append(keys[1:] != keys[:-1], True)
+
+    return (
+        leafNumbers,
+        leafDists,
+        leafCount,
+        len(nodes),
+        nodeTable,
+        keys[last],
+        lengths[last],
+        sumBranchLengths,
+    )
+
+
+def RobinsonFouldsWithDay1985Compact(t2, t1, rooted=False, minimumBLen=0.000006):
+    """Computes Robison Foulds distances between compact trees, as maple_RF.RobinsonFouldsWithDay1985.
+
+    Args:
+        t2 (CompactTree): compact tree to be compared to t1
+        t1 (tuple): t1 after preprocessing using prepareTreeComparisonCompact()
+        rooted (bool, optional): True if t2 is rooted. Defaults to False.
+        minimumBLen (float, optional): minimum branch length. Defaults to 0.000006.
+
+    Returns:
+        comparison parameters (tuple) (numDiffs, float(numDiffs) / (normalization), leafCount, foundBranches, missedBranches, (numBranches - foundBranches), RFL, KF): results of comparison, among which the RF distance (numDiffs).
+    """
+    (
+        leafNumbers,
+        leafDists,
+        leafCount,
+        numBranches,
+        nodeTable,
+        clusterKeys,
+        clusterLengths,
+        sumBranchLengths,
+    ) = t1
+
+    is_leaf = t2.first_child < 0
+    leaves = np.flatnonzero(is_leaf)
+    taxa = t2.leaf[leaves]
+    numbers = leafNumbers[np.minimum(taxa, len(leafNumbers) - 1)]
+    if (numbers < 0).any() or (taxa >= len(leafNumbers)).any():
+        print("Leaves not in reference tree - aborting RF distance")
+        return None, None, None, None, None, None, None, None
+    if len(np.unique(numbers)) < leafCount:
+        print(
+            f"There are leaves in the reference that have not been found in this new tree - leafCount {str(leafCount)} visitedLeaves {str(len(numbers))}"
+        )
+        return None, None, None, None, None, None, None, None
+    KF = np.abs(leafDists[numbers] - t2.dist[leaves]).sum()
+
+    nodes, lengths = _branches(t2, rooted)
+    lengths_mask = lengths > minimumBLen
+    nodes, lengths = nodes[lengths_mask], lengths[lengths_mask]
+
+    # leaf numbers of t2 in preorder; ranges reduce to the [L, R] of every node
+    low = np.full(len(t2.parent), leafCount, dtype=np.int64)
+    high = np.full(len(t2.parent), -1, dtype=np.int64)
+    low[leaves], high[leaves] = numbers, numbers
+    leaves_before = np.concatenate(([0], np.cumsum(is_leaf)))
+    L = _range_reduce(low, nodes, t2.end[nodes], np.minimum)
+    R = _range_reduce(high, nodes, t2.end[nodes], np.maximum)
+    nDesc = leaves_before[t2.end[nodes]] - leaves_before[nodes]
+
+    contiguous = (R + 1 - L) == nDesc
+    if not rooted:
+        flip = L == 0
+        L, R = np.where(flip, R + 1, L), np.where(flip, leafCount - 1, R)
+    # clusters are found in Day's table at slot L or R
+    slot_L, slot_R = np.minimum(L, leafCount - 1), R
+    found = contiguous & (
+        ((nodeTable[slot_L, 0] == L) & (nodeTable[slot_L, 1] == R))
+        | ((nodeTable[slot_R, 0] == L) & (nodeTable[slot_R, 1] == R))
+    )
+    keys = L * leafCount + R
+    positions = np.minimum(
+        np.searchsorted(clusterKeys, keys), max(len(clusterKeys) - 1, 0)
+    )
+
+    foundBranches = int(found.sum())
+    missedBranches = len(keys) - foundBranches
+    trueDists = clusterLengths[positions[found]]
+    KF += np.abs(trueDists - lengths[found]).sum()
+    RFL = sumBranchLengths - trueDists.sum() + lengths[~found].sum() + KF
+
+    numDiffs = (numBranches - foundBranches) + missedBranches
+    if rooted:
+        normalization = numBranches + leafCount - 2
+    else:
+        normalization = numBranches + leafCount - 3
+    return (
+        numDiffs,
+        float(numDiffs) / (normalization),
+        leafCount,
+        foundBranches,
+        missedBranches,
+        (numBranches - foundBranches),
+        float(RFL),
+        float(KF),
+    )
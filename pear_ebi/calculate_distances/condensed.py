@@ -0,0 +1,173 @@
+__author__ = "Andrea Rubbi"
+""" condensed stores symmetric distance matrices as their upper triangle only,
+	in the layout of scipy.spatial.distance.pdist: the distance between trees
+	i < j is at position n*i - i*(i+1)/2 + j - i - 1 of a 1D array. The dtype is
+	chosen from the values: the smallest unsigned integer type holding them for
+	integer distances (e.g. RF), float32 otherwise (e.g. weighted RF). Consumers
+	needing the square matrix obtain it on demand, e.g. with np.asarray."""
+
+import numpy as np
+from scipy.spatial.distance import squareform
+
+# unsigned integer types tried, from the smallest
+INTEGER_DTYPES = (np.uint8, np.uint16, np.uint32)
+
+
+def compact_dtype(values):
+    """Chooses the smallest dtype storing values without (significant) loss
+
+    Args:
+        values (np.array): distances
+
+    Returns:
+        dtype (np.dtype): unsigned integer type for non-negative integers, float32 otherwise
+    """
+    values = np.asarray(values)
+    if values.size == 0:
+        return np.dtype(np.uint8)
+    if np.issubdtype(values.dtype, np.unsignedinteger) or (
+        values.min() >= 0 and np.array_equal(values, np.floor(values))
+    ):
+        for dtype in INTEGER_DTYPES:
+            if values.max() <= np.iinfo(dtype).max:
+                return np.dtype(dtype)
+        return np.dtype(np.float64)
+    return np.dtype(np.float32)
+
+
+def condensed_size(n_trees):
+    return n_trees * (n_trees - 1) // 2
+
+
+def row_start(i, n_trees):
+    """Position of the distance (i, i+1) in the condensed array"""
+    return n_trees * i - i * (i + 1) // 2
+
+
+class CondensedDistanceMatrix(object):
+    def __init__(self, condensed, n_trees=None):
+        """Symmetric distance matrix stored as its condensed upper triangle
+
+        condensed: 1D array in pdist layout (np.memmap arrays are kept mapped)
+        n_trees: number of trees, inferred from the length of condensed if not given
+        """
+        if n_trees is None:
+            n_trees = (
+                int(round((1 + np.sqrt(1 + 8 * len(condensed))) / 2))
+                if len(condensed)
+                else 1
+            )
+        if condensed_size(n_trees) != len(condensed):
+            raise ValueError(
+                f"A condensed matrix of {n_trees} trees has {condensed_size(n_trees)} entries, not {len(condensed)}"
+            )
+        self.condensed = condensed
+        self.n_trees = n_trees
+
+    def __repr__(self):
+        return f"CondensedDistanceMatrix({self.n_trees} trees, {self.dtype})"
+
+    def __len__(self):
+        return self.n_trees
+
+    @property
+    def shape(self):
+        return (self.n_trees, self.n_trees)
+
+    @property
+    def dtype(self):
+        return self.condensed.dtype
+
+    @property
+    def nbytes(self):
+        return self.condensed.nbytes
+
+    # ─── CONSTRUCTION ──────────────────────────────────────────────────────
+    @classmethod
+    def from_rows(cls, rows, n_trees, dtype=np.float64):
+        """Builds the matrix from the rows of its upper triangle
+
+        Args:
+            rows (iterable): row i holds the distances (i, i+1:), for i in range(n_trees)
+            n_trees (int): number of trees
+            dtype (np.dtype, optional): dtype of the stored distances. Defaults to np.float64.
+
+        Returns:
+            CondensedDistanceMatrix: condensed matrix
+        """
+        condensed = np.empty(condensed_size(n_trees), dtype=dtype)
+        for i, row in enumerate(rows):
+            condensed[row_start(i, n_trees) : row_start(i + 1, n_trees)] = row
+        return cls(condensed, n_trees)
+
+    @classmethod
+    def from_matrix(cls, distance_matrix, dtype=None):
+        """Condenses a square (symmetric or upper triangular) distance matrix;
+        condensed matrices are returned as they are
+
+        Args:
+            distance_matrix (np.array or CondensedDistanceMatrix): distance matrix
+            dtype (np.dtype, optional): dtype of the stored distances. Defaults to compact_dtype.
+
+        Returns:
+            CondensedDistanceMatrix: condensed matrix
+        """
+        if isinstance(distance_matrix, cls):
+            return distance_matrix
+        distance_matrix = np.asarray(distance_matrix)
+        n_trees = distance_matrix.shape[0]
+        matrix = cls.from_rows(
+            (distance_matrix[i, i + 1 :] for i in range(n_trees)),
+            n_trees,
+            dtype=distance_matrix.dtype,
+        )
+        return matrix.astype(
+            dtype if dtype is not None else compact_dtype(matrix.condensed)
+        )
+
+    def astype(self, dtype):
+        if np.dtype(dtype) == self.dtype:
+            return self
+        return CondensedDistanceMatrix(self.condensed.astype(dtype), self.n_trees)
+
+    # ─── ACCESS ────────────────────────────────────────────────────────────
+    def row(self, i):
+        """Returns the distances between tree i and all the trees
+
+        Args:
+            i (int): index of the tree
+
+        Returns:
+            row (np.array): row i of the square matrix
+        """
+        n = self.n_trees
+        row = np.zeros(n, dtype=self.dtype)
+        # column i of the upper triangle: (j, i) for j < i
+        above = np.arange(i)
+        row[:i] = self.condensed[row_start(above, n) + i - above - 1]
+        row[i + 1 :] = self.condensed[row_start(i, n) : row_start(i + 1, n)]
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            i, j = key
+            if i == j:
+                return self.dtype.type(0)
+            i, j = min(i, j), max(i, j)
+            return self.condensed[row_start(i, self.n_trees) + j - i - 1]
+        return self.row(key)
+
+    def square(self, dtype=None):
+        """Builds the square matrix
+
+        Args:
+            dtype (np.dtype, optional): dtype of the square matrix. Defaults to the stored dtype.
+
+        Returns:
+            distance_matrix (np.array): symmetric n_trees x n_trees matrix
+        """
+        square = squareform(np.asarray(self.condensed), force="tomatrix", checks=False)
+        return square if dtype is None else square.astype(dtype, copy=False)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.square(dtype)
@@ -0,0 +1,164 @@
+__author__ = "Andrea Rubbi"
+""" dedup removes repeated topologies from a set of trees before computing its
+	distance matrix. Bootstrap replicates and MCMC samples often repeat the same
+	topology many times: every tree is reduced to a hashable signature (its sorted
+	split ids, see bitset_RF), distances are computed among unique topologies only
+	and the full matrix is recovered through the index map tree -> topology.
+	Only topological distances can be deduplicated: weighted ones (e.g. RFL, KF,
+	weighted RF) depend on branch lengths and are always computed on the whole set.
+	Signatures ignore trivial splits, which Day's algorithm counts in trees with
+	unary nodes or an unrooted (leaf, subtree) root: on such trees deduplicated
+	smart_RF distances may differ from the ones of the whole set."""
+
+import os
+
+import numpy as np
+
+try:
+    from . import bitset_RF
+    from .condensed import CondensedDistanceMatrix
+except ImportError:
+    import bitset_RF
+    from condensed import CondensedDistanceMatrix
+
+try:
+    from ..tree_io.matrix_io import save_matrix
+    from ..tree_io.reader import iter_trees
+    from ..tree_io.scratch import scratch_dir
+except ImportError:
+    from tree_io.matrix_io import save_matrix
+    from tree_io.reader import iter_trees
+    from tree_io.scratch import scratch_dir
+
+# signature options (rooted, minimumBLen) of the topological methods of tree_set:
+# smart_RF collapses short branches as Day's algorithm does, the others keep every branch
+TOPOLOGY_OPTIONS = {
+    "hashrf_RF": (False, float("-inf")),
+    "smart_RF": (False, 0.000006),
+    "tqdist_quartet": (False, float("-inf")),
+    "tqdist_triplet": (True, float("-inf")),
+}
+
+# smart_RF metrics depending only on the topology
+TOPOLOGY_METRICS = ("RF", "nRF")
+
+# methods deduplicated only on request: HashRF parses and hashes the trees in C++,
+# smart_RF parses them in its worker pool, both faster than the single core pass
+# finding the unique topologies
+OPT_IN_METHODS = ("hashrf_RF", "smart_RF")
+
+
+def use_deduplication(method, deduplicate=None):
+    """Decides whether the distances of method are computed among unique topologies
+
+    Args:
+        method (str): name of the distance method of tree_set
+        deduplicate (bool, optional): explicit choice; None deduplicates every topological
+            method but those in OPT_IN_METHODS. Defaults to None.
+
+    Returns:
+        bool: True if the topologies are to be deduplicated
+    """
+    if method not in TOPOLOGY_OPTIONS:
+        return False
+    return method not in OPT_IN_METHODS if deduplicate is None else deduplicate
+
+
+def unique_topologies(file, n_trees, rooted=False, minimumBLen=0.000006):
+    """Groups the trees of file by topology
+
+    Args:
+        file (str): file containing the newick trees
+        n_trees (int): number of trees (or lines) in file
+        rooted (bool, optional): set to True if trees are rooted. Defaults to False.
+        minimumBLen (float, optional): branches not longer than this are collapsed. Defaults to 0.000006.
+
+    Returns:
+        unique (np.array): index of the first tree of every topology
+        inverse (np.array): topology of every tree, i.e. unique[inverse[i]] has the topology of tree i
+    """
+    incidence, taxa = bitset_RF.file_split_incidence(
+        file, n_trees, rooted=rooted, minimumBLen=minimumBLen
+    )
+    signatures, unique = dict(), list()
+    inverse = np.empty(incidence.shape[0], dtype=np.int64)
+    for i in range(incidence.shape[0]):
+        splits = incidence.indices[incidence.indptr[i] : incidence.indptr[i + 1]]
+        inverse[i] = signatures.setdefault(np.sort(splits).tobytes(), len(signatures))
+        if inverse[i] == len(unique):
+            unique.append(i)
+    return np.array(unique, dtype=np.int64), inverse
+
+
+def expand(distance_matrix, inverse):
+    """Expands the distance matrix of the unique topologies to all the trees
+
+    Args:
+        distance_matrix (np.array or CondensedDistanceMatrix): distance matrix among unique topologies
+        inverse (np.array): topology of every tree
+
+    Returns:
+        distance_matrix (CondensedDistanceMatrix): distance matrix among all the trees
+    """
+    unique = CondensedDistanceMatrix.from_matrix(distance_matrix)
+    square = unique.square()
+    return CondensedDistanceMatrix.from_rows(
+        (square[inverse[i], inverse[i + 1 :]] for i in range(len(inverse))),
+        len(inverse),
+        dtype=unique.dtype,
+    )
+
+
+def calculate_distance_matrix(
+    function, file, n_trees, output_file, rooted=False, minimumBLen=0.000006, **kwargs
+):
+    """Computes a topological distance matrix on the unique topologies of file only
+
+    Args:
+        function (callable): distance method with signature (file, n_trees, output_file, **kwargs)
+        file (str): file containing the newick trees
+        n_trees (int): number of trees (or lines) in file
+        output_file (str): output file for distance matrix
+        rooted (bool, optional): set to True if trees are rooted. Defaults to False.
+        minimumBLen (float, optional): branches not longer than this are collapsed. Defaults to 0.000006.
+        **kwargs: passed to function (e.g. metrics)
+
+    Returns:
+        distance_matrix (np.array): distance matrix, or dictionary metric -> distance matrix
+            if function returns one (metrics other than the first are written to output_file
+            suffixed with the metric name)
+        inverse (np.array): topology of every tree, i.e. index map to the unique topologies
+    """
+    unique, inverse = unique_topologies(file, n_trees, rooted, minimumBLen)
+    print(
+        f"Deduplication: {len(unique)} unique topologies in {n_trees} trees (ratio {n_trees / max(len(unique), 1):.1f}x)"
+    )
+    if len(unique) == n_trees:
+        return function(file, n_trees, output_file, **kwargs), inverse
+
+    with scratch_dir("pear_dedup_") as scratch:
+        unique_file = os.path.join(scratch, "unique_trees")
+        selected = set(unique.tolist())
+        with open(unique_file, "w") as f:
+            for i, tree in enumerate(iter_trees(file)):
+                if i in selected:
+                    f.write(tree + "\n")
+            f.close()
+        distances = function(
+            unique_file, len(unique), os.path.join(scratch, "distances.npy"), **kwargs
+        )
+
+    root, ext = os.path.splitext(output_file)
+    if isinstance(distances, dict):
+        distance_matrices = dict()
+        for k, (metric, matrix) in enumerate(distances.items()):
+            distance_matrices[metric] = expand(matrix, inverse)
+            save_matrix(
+                distance_matrices[metric],
+                output_file if k == 0 else f"{root}_{metric}{ext}",
+            )
+        return distance_matrices, inverse
+
+    distance_matrix = expand(distances, inverse)
+    save_matrix(distance_matrix, output_file)
+    return distance_matrix, inverse
@@ -1,9 +1,29 @@
 import os
 import subprocess
 import sys
+import tempfile
 
 import numpy as np
-import pandas as pd
+
+try:
+    from .condensed import (
+        CondensedDistanceMatrix,
+        compact_dtype,
+        condensed_size,
+        row_start,
+    )
+except ImportError:
+    from condensed import (
+        CondensedDistanceMatrix,
+        compact_dtype,
+        condensed_size,
+        row_start,
+    )
+
+try:
+    from ..tree_io.matrix_io import save_matrix
+except ImportError:
+    from tree_io.matrix_io import save_matrix
 
 # Set the value Display variable
 os.environ.setdefault("DISPLAY", ":0.0")
@@ -42,53 +62,104 @@ def bash_command(cmd):
 # ──────────────────────────────────────────────────────────────────────────────
 
 
-def hashrf(file, n_trees, output_file):
-    """Computes unweighted Robison Foulds distances
+# path of the HashRF binary
+HASHRF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "HashRF", "hashrf")
+
+# end of the line HashRF prints before the distance matrix
+MATRIX_HEADER = "(matrix format):"
+
+
+def parse_matrix(lines, n_trees):
+    """Parses the distance matrix printed by HashRF row by row,
+    storing the upper triangle of every row in a preallocated condensed array
+
+    Args:
+        lines (iterable): lines printed by HashRF, e.g. its stdout
+        n_trees (int): number of trees
+
+    Raises:
+        ValueError: a row of the matrix does not hold n_trees distances
+
+    Returns:
+        distance_matrix (CondensedDistanceMatrix): parsed distance matrix,
+            None if fewer than n_trees rows were printed
+        messages (list): lines printed before the matrix (kept to report failures)
+    """
+    condensed = np.empty(condensed_size(n_trees), dtype=np.float64)
+    row, messages = None, list()
+    for line in lines:
+        if row is None:
+            if line.rstrip().endswith(MATRIX_HEADER):
+                row = 0
+            else:
+                messages.append(line)
+        elif row < n_trees and line.strip():
+            values = np.fromstring(line, dtype=np.float64, sep=" ")
+            if len(values) != n_trees:
+                raise ValueError(f"row {row} has {len(values)} distances")
+            condensed[row_start(row, n_trees) : row_start(row + 1, n_trees)] = values[
+                row + 1 :
+            ]
+            row += 1
+    if row != n_trees:
+        return None, messages
+    distance_matrix = CondensedDistanceMatrix(condensed, n_trees)
+    return distance_matrix.astype(compact_dtype(condensed)), messages
+
+
+def run_hashrf(file, n_trees, output_file=None, weighted=False):
+    """Runs HashRF and parses the matrix it prints to stdout (see parse_matrix);
+    stderr goes to a temporary file, so that long warnings never block HashRF
 
     Args:
         file (str): name of input file with phylogenetic trees in newick format
         n_trees (int): number of trees in file
-        output_file (str): name of output file that will contain the distance matrix
+        output_file (str, optional): name of output file that will contain the distance matrix;
+            nothing is written if None. Defaults to None.
+        weighted (bool, optional): compute weighted RF distances. Defaults to False.
 
     Returns:
-        distance_matrix (pandas.DataFrame): computed distance matrix
+        distance_matrix (CondensedDistanceMatrix): computed distance matrix
     """
-    try:
-        path = os.path.dirname(os.path.abspath(__file__))
-    except:
-        path = "."
-    cmd = "{path}hashrf {file} {n_trees} -p matrix -o {output} 1> /dev/null 2> ./hashrf_err.txt".format(
-        path=os.path.join(path, "HashRF", ""),
-        file=file,
-        n_trees=n_trees,
-        output=output_file,
-        verbose=1,
-    ).replace(
-        "\\", "/"
-    )
+    cmd = [HASHRF, file, str(n_trees), "-p", "matrix"] + (["-w"] if weighted else [])
+    with tempfile.TemporaryFile(mode="w+") as errors:
+        try:
+            process = subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=errors, text=True
+            )
+        except OSError as err:
+            sys.exit(f"hashrf failed! {err}")
+        with process:
+            try:
+                distance_matrix, messages = parse_matrix(process.stdout, n_trees)
+            except ValueError as err:
+                distance_matrix, messages = None, [f"{err}\n"]
+        errors.seek(0)
+        err = errors.read()
+
+    if len(err) > 0:
+        sys.exit(err)
+    # NB: HashRF exits with status 1 on success, the matrix is checked instead
+    if distance_matrix is None:
+        sys.exit("".join(messages[-5:]) + "hashrf failed!")
+
+    if output_file is not None:
+        save_matrix(distance_matrix, output_file)
+    return distance_matrix
 
-    # Runs command
-    bash_command(cmd)
 
-    with open("hashrf_err.txt", "r") as err_mess:
-        err = err_mess.read()
-        err_mess.close()
-        bash_command("rm hashrf_err.txt")
-        if len(err) > 0:
-            sys.exit(err)
+def hashrf(file, n_trees, output_file):
+    """Computes unweighted Robison Foulds distances
 
-    # Reads output file and creates numpy array
-    # which is used to create a pandas dataframe
-    try:
-        with open(output_file, "r") as out:
-            distance_matrix = pd.read_csv(out, index_col=None, header=None, sep=" ")
-            out.close()
+    Args:
+        file (str): name of input file with phylogenetic trees in newick format
+        n_trees (int): number of trees in file
+        output_file (str): name of output file that will contain the distance matrix
 
-        distance_matrix.drop(distance_matrix.columns[-1], axis=1, inplace=True)
-        distance_matrix.to_csv(output_file, header=False, index=False)
-        return distance_matrix.values
-    except:
-        sys.exit("hashrf failed!")
+    Returns:
+        distance_matrix (CondensedDistanceMatrix): computed distance matrix
+    """
+    return run_hashrf(file, n_trees, output_file)
 
 
 # HashRF calculating weighted RF distances
@@ -101,39 +172,6 @@ def hashrf_weighted(file, n_trees, output_file):
         output_file (str): name of output file that will contain the distance matrix
 
     Returns:
-        distance_matrix (pandas.DataFrame): computed distance matrix
+        distance_matrix (CondensedDistanceMatrix): computed distance matrix
     """
-    try:
-        path = os.path.dirname(__file__)
-    except:
-        path = "."
-    cmd = "{path}/HashRF/hashrf {file} {n_trees} -p matrix -o {output} -w 1> /dev/null 2> ./hashrf_err.txt".format(
-        path=path, file=file, n_trees=n_trees, output=output_file, verbose=1
-    )
-
-    # Runs command
-    bash_command(cmd)
-
-    with open("hashrf_err.txt", "r") as err_mess:
-        err = err_mess.read()
-        err_mess.close()
-        bash_command("rm hashrf_err.txt")
-        if len(err) > 0:
-            sys.exit(err)
-
-    bash_command(
-        f"tr -s \" \" < {output_file} | sed 's/^[ \t]*//' > ./tmp_file && cat ./tmp_file > {output_file} && rm ./tmp_file"
-    )  # removes double spaces in file and spaces at the beginning of lines
-
-    # Reads output file and creates numpy array
-    # which is rused to create a pandas dataframe
-    try:
-        with open(output_file, "r") as out:
-            distance_matrix = pd.read_csv(out, index_col=None, header=None, sep=" ")
-            out.close()
-
-        distance_matrix.drop(distance_matrix.columns[-1], axis=1, inplace=True)
-        distance_matrix.to_csv(output_file, header=False, index=False)
-        return distance_matrix.values
-    except:
-        sys.exit("hashrf failed!")
+    return run_hashrf(file, n_trees, output_file, weighted=True)
@@ -0,0 +1,143 @@
+__author__ = "Andrea Rubbi"
+""" knn finds the k nearest trees of every tree under RF without computing the
+	distance matrix. Candidate neighbours come from locality sensitive hashing of
+	the MinHash signatures of approx_RF: signatures are cut into bands and trees
+	with the same band fall in the same bucket, i.e. likely share most of their
+	splits. RF distances to the candidates are then computed exactly from the split
+	incidence matrix (see bitset_RF); trees with fewer than k candidates are
+	compared with all the trees. The result is a sparse graph of n·k distances."""
+
+import numpy as np
+from scipy import sparse
+
+try:
+    from .approx_RF import SIGNATURE_LENGTH, minhash_signatures
+except ImportError:
+    from approx_RF import SIGNATURE_LENGTH, minhash_signatures
+
+# default number of bands the signatures are cut into
+BANDS = 32
+
+# candidate pairs verified at once
+BATCH_SIZE = 1 << 16
+
+
+def lsh_candidates(signatures, bands=BANDS, window=10):
+    """Finds pairs of trees falling in the same bucket for at least one band
+
+    Args:
+        signatures (np.array): n_trees x signature_length MinHash signatures
+        bands (int, optional): number of bands. Defaults to 32.
+        window (int, optional): maximum number of candidates taken per tree and band:
+            large buckets (e.g. of repeated topologies) are not expanded to all
+            their pairs. Defaults to 10.
+
+    Returns:
+        pairs (np.array): unique candidate pairs (i, j), i < j, encoded as i * n_trees + j
+    """
+    n_trees, length = signatures.shape
+    rows = max(length // bands, 1)
+    pairs = np.zeros(0, dtype=np.int64)
+    for start in range(0, rows * (length // rows), rows):
+        band = np.ascontiguousarray(signatures[:, start : start + rows])
+        _, bucket = np.unique(
+            band.view(np.dtype((np.void, band.dtype.itemsize * rows))).ravel(),
+            return_inverse=True,
+        )
+        bucket = bucket.ravel()
+        # trees sorted by bucket: each is paired with the next ones of its bucket
+        order = np.argsort(bucket, kind="stable")
+        sizes = np.bincount(bucket)
+        first = np.concatenate([[0], np.cumsum(sizes)[:-1]])[bucket[order]]
+        position = np.arange(n_trees) - first
+        size = sizes[bucket[order]]
+        band_pairs = list()
+        for offset in range(1, min(window, sizes.max() - 1) + 1):
+            valid = size > offset
+            i = order[valid]
+            j = order[first[valid] + (position[valid] + offset) % size[valid]]
+            band_pairs.append(np.minimum(i, j) * n_trees + np.maximum(i, j))
+        if band_pairs:
+            pairs = np.union1d(pairs, np.concatenate(band_pairs))
+    return pairs
+
+
+def pair_distances(incidence, i, j):
+    """Computes the exact RF distances of pairs of trees from their splits
+
+    Args:
+        incidence (scipy.sparse.csr_matrix): tree x split incidence matrix
+        i (np.array): first tree of every pair
+        j (np.array): second tree of every pair
+
+    Returns:
+        distances (np.array): RF(i, j) for every pair
+    """
+    n_splits = np.diff(incidence.indptr)
+    distances = np.empty(len(i), dtype=np.float64)
+    for start in range(0, len(i), BATCH_SIZE):
+        a, b = i[start : start + BATCH_SIZE], j[start : start + BATCH_SIZE]
+        shared = np.asarray(incidence[a].multiply(incidence[b]).sum(axis=1)).ravel()
+        distances[start : start + BATCH_SIZE] = n_splits[a] + n_splits[b] - 2 * shared
+    return distances
+
+
+def knn_graph(incidence, k=10, signature_length=SIGNATURE_LENGTH, bands=BANDS, seed=0):
+    """Builds the sparse graph of the k nearest trees of every tree under RF
+
+    Args:
+        incidence (scipy.sparse.csr_matrix): tree x split incidence matrix (see bitset_RF)
+        k (int, optional): number of neighbours. Defaults to 10.
+        signature_length (int, optional): length of the MinHash signatures. Defaults to 128.
+        bands (int, optional): number of LSH bands: more bands find more candidates. Defaults to 32.
+        seed (int, optional): seed of the hash functions. Defaults to 0.
+
+    Returns:
+        graph (scipy.sparse.csr_matrix): graph[i, j] = RF(i, j) for the k nearest trees j of i,
+            rows sorted by distance; zero distances (e.g. repeated topologies) are stored explicitly
+    """
+    n_trees = incidence.shape[0]
+    k = min(k, n_trees - 1)
+    if k < 1:
+        return sparse.csr_matrix((n_trees, n_trees), dtype=np.float64)
+    signatures = minhash_signatures(incidence, signature_length, seed)
+    pairs = lsh_candidates(signatures, bands, window=k)
+    i, j = pairs // n_trees, pairs % n_trees
+    distances = pair_distances(incidence, i, j)
+
+    # every pair is a candidate for both its trees: keep the k closest of each tree
+    source, target = np.concatenate([i, j]), np.concatenate([j, i])
+    distances = np.concatenate([distances, distances])
+    order = np.lexsort((distances, source))
+    source, target, distances = source[order], target[order], distances[order]
+    counts = np.bincount(source, minlength=n_trees)
+    rank = np.arange(len(source)) - np.concatenate([[0], np.cumsum(counts)[:-1]])[source]
+    keep = rank < k
+    source, target, distances = source[keep], target[keep], distances[keep]
+
+    # trees with too few candidates are compared with all the trees
+    missing = np.flatnonzero(counts < k)
+    if len(missing):
+        n_splits = np.diff(incidence.indptr)
+        keep = ~np.isin(source, missing)
+        source, target, distances = [source[keep]], [target[keep]], [distances[keep]]
+        for start in range(0, len(missing), 64):
+            rows = missing[start : start + 64]
+            shared = (incidence[rows] @ incidence.T).toarray()
+            rf = n_splits[rows, None] + n_splits[None, :] - 2 * shared.astype(np.float64)
+            rf[np.arange(len(rows)), rows] = np.inf
+            nearest = np.argpartition(rf, k - 1, axis=1)[:, :k]
+            source.append(np.repeat(rows, k))
+            target.append(nearest.ravel())
+            distances.append(np.take_along_axis(rf, nearest, axis=1).ravel())
+        source, target = np.concatenate(source), np.concatenate(target)
+        distances = np.concatenate(distances)
+
+    # rows sorted by distance, as expected by sklearn for precomputed neighbours;
+    # zero distances (repeated topologies) are kept as explicit entries
+    order = np.lexsort((distances, source))
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(source, minlength=n_trees))])
+    return sparse.csr_matrix(
+        (distances[order].astype(np.float64), target[order], indptr),
+        shape=(n_trees, n_trees),
+    )
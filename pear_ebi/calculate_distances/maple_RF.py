@@ -10,18 +10,39 @@ __credits__ = {
 
 import multiprocessing as mp
 import os
-import pickle
-import shutil
-import subprocess
+import re
 import sys
 import time
 import warnings
+from multiprocessing import shared_memory
 
 import numpy as np
 import pandas as pd
 import rich
 from rich.console import Console
 
+try:
+    from .condensed import (
+        CondensedDistanceMatrix,
+        compact_dtype,
+        condensed_size,
+        row_start,
+    )
+except ImportError:
+    from condensed import (
+        CondensedDistanceMatrix,
+        compact_dtype,
+        condensed_size,
+        row_start,
+    )
+
+try:
+    from ..tree_io.matrix_io import save_matrix
+    from ..tree_io.reader import iter_trees
+except ImportError:
+    from tree_io.matrix_io import save_matrix
+    from tree_io.reader import iter_trees
+
 
 class Tree(object):
     def __init__(self, name="", children=None, dist=0.000033):
@@ -51,6 +72,70 @@ class Tree(object):
         self.children.append(node)
 
 
+# tokens of a newick string: comments, quoted labels, delimiters and unquoted labels or branch lengths
+NEWICK_TOKENS = re.compile(r"\[[^\]]*\]|'(?:[^']|'')*'|[(),;:]|[^(),;:\[']+")
+
+
+def parseNewick(nwString, defaultBLen=0.000033, normalizeInputBLen=1.0):
+    """Tokenizes a newick string with a regular expression and returns its nodes in preorder.
+    Comments [...] are skipped, quoted labels are unquoted and missing branch lengths
+    are set to defaultBLen.
+
+    Args:
+            nwString (str): tree in newick format.
+            defaultBLen (float, optional): default branch length. Defaults to 0.000033.
+            normalizeInputBLen (float, optional): value used to normalize branch lenghts. Defaults to 1.0.
+
+    Returns:
+            nodes (tuple) (parents, names, dists, ends): parent index, name, branch length
+            and (exclusive) end of the subtree of every node; node 0 is the root.
+    """
+    parents, names, dists, ends = [-1], [""], [defaultBLen], [0]
+    node = 0
+    isLength = finished = False
+    for token in NEWICK_TOKENS.findall(nwString):
+        if token == "(" or token == ",":
+            if token == ",":
+                ends[node] = len(parents)
+                node = parents[node]
+            parents.append(node)
+            names.append("")
+            dists.append(defaultBLen)
+            ends.append(0)
+            node = len(parents) - 1
+        elif token == ")":
+            ends[node] = len(parents)
+            node = parents[node]
+        elif token == ":":
+            isLength = True
+            continue
+        elif token == ";":
+            ends[node] = len(parents)
+            finished = True
+            break
+        elif token[0] == "[":
+            continue
+        elif isLength:
+            distStr = token.strip()
+            if distStr == "":
+                continue
+            dist = float(distStr) * normalizeInputBLen
+            if dist < 0.0:
+                warnings.warn(
+                    f"Warning: negative branch length in the input tree: {distStr} ; converting it to positive."
+                )
+                dist = abs(dist)
+            dists[node] = dist
+        elif token[0] == "'":
+            names[node] = token[1:-1].replace("''", "'")
+        else:
+            names[node] += token.strip()
+        isLength = False
+
+    assert finished, "Error, final character ';' not found in newick tree."
+    return parents, names, dists, ends
+
+
 # function to read input newick string
 def readNewick(tree_list, defaultBLen=0.000033, normalizeInputBLen=1.0):
     """From a list of strings defining phylogenetic trees
@@ -70,80 +155,14 @@ def readNewick(tree_list, defaultBLen=0.000033, normalizeInputBLen=1.0):
 
     tree_list = [tree_list] if type(tree_list) != type(list()) else tree_list
     for tree in tree_list:
-        nwString = tree.replace("\n", "")
-        branchLengthsIn = ":" in nwString
-        index = 0
-        node = Tree()
-        name = distStr = ""
-        finished = False
-        while index < len(nwString):
-            # start:bipartition
-            if nwString[index] == "(":
-                newNode = Tree()
-                newNode.minorSequences = list()
-                node.add_child(newNode)
-                newNode.up = node
-                node = newNode
-                index += 1
-            # end:tree
-            elif nwString[index] == ";":
-                trees.append(node)
-                finished = True
-                break
-            # start
-            elif nwString[index] == "[":
-                # end
-                while nwString[index] != "]":
-                    index += 1
-                index += 1
-            # delimiter:branch_length
-            elif nwString[index] == ":":
-                index += 1
-                while (
-                    nwString[index] != ","
-                    and nwString[index] != ")"
-                    and nwString[index] != ";"
-                ):
-                    distStr += nwString[index]
-                    index += 1
-            # delimiter:nodes
-            elif nwString[index] == ",":
-                if name != "":
-                    node.name, name = name, ""
-                if distStr != "":
-                    node.dist = float(distStr) * normalizeInputBLen
-                    if node.dist < 0.0:
-                        warnings.warn(
-                            f"Warning: negative branch length in the input tree: {str(distStr)} ; converting it to positive."
-                        )
-                        node.dist = abs(node.dist)
-                    distStr = ""
-                else:
-                    node.dist = defaultBLen
-
-                newNode = Tree()
-                newNode.minorSequences = list()
-                node = node.up
-                node.add_child(newNode)
-                newNode.up = node
-                node = newNode
-                index += 1
-            # end:bipartition
-            elif nwString[index] == ")":
-                if name != "":
-                    node.name, name = name, ""
-                if distStr != "":
-                    node.dist = float(distStr) * normalizeInputBLen
-                    distStr = ""
-                else:
-                    node.dist = defaultBLen
-                node = node.up
-                index += 1
-            else:
-                name += nwString[index]
-                index += 1
-
-        assert finished, "Error, final character ';' not found in newick tree."
+        parents, names, dists, ends = parseNewick(
+            tree, defaultBLen=defaultBLen, normalizeInputBLen=normalizeInputBLen
+        )
+        nodes = [Tree(name=name, dist=dist) for name, dist in zip(names, dists)]
+        for node, parent in zip(nodes[1:], parents[1:]):
+            nodes[parent].children.append(node)
+            node.up = nodes[parent]
+        trees.append(nodes[0])
 
     return trees
 
@@ -339,7 +358,7 @@ def RobinsonFouldsWithDay1985(t2, t1, rooted=False, minimumBLen=0.000006):
         minimumBLen (float, optional): minimum branch length. Defaults to 0.000006.
 
     Returns:
-        comparison parameters (tuple) (numDiffs, float(numDiffs) / (normalization), leafCount, foundBranches, missedBranches, (numBranches - foundBranches), RFL): results of comparison, among which the RF distance (numDiffs).
+        comparison parameters (tuple) (numDiffs, float(numDiffs) / (normalization), leafCount, foundBranches, missedBranches, (numBranches - foundBranches), RFL, KF): results of comparison, among which the RF distance (numDiffs).
     """
     (
         leafNameDict,
@@ -373,7 +392,7 @@ def RobinsonFouldsWithDay1985(t2, t1, rooted=False, minimumBLen=0.000006):
                     leafNum = leafNameDict[node.name]
                 else:
                     print(node.name + " not in reference tree - aborting RF distance")
-                    return None, None, None, None, None, None
+                    return None, None, None, None, None, None, None, None
                 lastL = leafNum
                 lastR = leafNum
                 lastDesc = 1
@@ -471,7 +490,7 @@ def RobinsonFouldsWithDay1985(t2, t1, rooted=False, minimumBLen=0.000006):
         print(
             f"There are leaves in the reference that have not been found in this new tree - leafCount {str(leafCount)} visitedLeaves {str(visitedLeaves)}"
         )
-        return None, None, None, None, None, None
+        return None, None, None, None, None, None, None, None
     # first value is number of differences, second value is max number of differences just in case one wants the normalized values;
     # the other values are there just in case one wants more detail.
     numDiffs = (numBranches - foundBranches) + missedBranches
@@ -488,93 +507,352 @@ def RobinsonFouldsWithDay1985(t2, t1, rooted=False, minimumBLen=0.000006):
         missedBranches,
         (numBranches - foundBranches),
         RFL,
+        KF,
     )
 
 
-def calculate_distance_matrix(file, n_trees, output_file):
-    """Computes the whole pipeline that calculates the pairwise distances in a collection of trees
+# position of each distance metric in the tuple returned by RobinsonFouldsWithDay1985:
+# RF (number of differences), nRF (normalized RF), RFL (branch-length-aware RF), KF (Kuhner-Felsenstein)
+METRICS = {"RF": 0, "nRF": 1, "RFL": 6, "KF": 7}
+
+
+def _metric_positions(metrics):
+    """Checks the requested metrics and returns their positions in the comparison tuple
 
     Args:
-        file (str): file containing the newick trees
-        n_trees (int): number of trees (or lines) in file
-        output_file (str): output file for distance matrix
+        metrics (str or list): metric or list of metrics among RF, nRF, RFL and KF
 
     Returns:
-        distance_matrix (np.array): distance matrix
+        positions (list): positions in the tuple returned by RobinsonFouldsWithDay1985
     """
-    console = Console()
-    global func_pool
+    metrics = [metrics] if isinstance(metrics, str) else list(metrics)
+    for metric in metrics:
+        if metric not in METRICS:
+            raise ValueError(
+                f"Unknown metric {metric} - available metrics: {', '.join(METRICS)}"
+            )
+    return [METRICS[metric] for metric in metrics]
+
+
+def single_core_distances(trees, n_trees, rooted=False, metrics="RF"):
+    """Computes the upper triangle of the distance matrix on a single core.
+    Every tree is parsed only once and prepared for comparison only once,
+    when its row is reached; the parsed trees are then reused by all the rows.
+
+    Args:
+        trees (list): list of trees in newick format
+        n_trees (int): number of trees
+        rooted (bool, optional): set to True if trees are rooted. Defaults to False.
+        metrics (str or list, optional): metric or list of metrics among RF, nRF, RFL and KF. Defaults to "RF".
 
-    def func_pool(i):
-        return subprocess.check_output(
-            ["pypy3", f"{current}/RF_pypy.py", str(i)], universal_newlines=True
+    Returns:
+        distance_matrix (np.array): upper triangular distance matrix,
+            stacked along the first axis if a list of metrics is given
+    """
+    positions = _metric_positions(metrics)
+    parsed_trees = readNewick(trees)
+    distance_matrix = np.zeros((len(positions), n_trees, n_trees))
+    for i, tree1 in enumerate(parsed_trees):
+        tree1_prep = prepareTreeComparison(tree1, rooted=rooted)
+        distances = list()
+        for tree in parsed_trees[i + 1 :]:
+            res = RobinsonFouldsWithDay1985(tree, tree1_prep, rooted=rooted)
+            distances.append([res[p] for p in positions])
+        if distances:
+            distance_matrix[:, i, i + 1 :] = np.transpose(distances)
+    return distance_matrix[0] if isinstance(metrics, str) else distance_matrix
+
+
+def distances_to_references(trees, references, rooted=False, metrics="RF"):
+    """Computes the distances between every tree and a few reference trees.
+    References are prepared for comparison once, and trees are parsed one at a time
+    while streaming through them, so that time is linear in the number of trees.
+
+    Args:
+        trees (iterable): trees in newick format, e.g. streamed by tree_io.reader.iter_trees
+        references (list): reference trees in newick format
+        rooted (bool, optional): set to True if trees are rooted. Defaults to False.
+        metrics (str or list, optional): metric or list of metrics among RF, nRF, RFL and KF. Defaults to "RF".
+
+    Returns:
+        distances (np.array): n_trees x n_references distances,
+            stacked along the first axis if a list of metrics is given
+    """
+    positions = _metric_positions(metrics)
+    references_prep = [
+        prepareTreeComparison(reference, rooted=rooted)
+        for reference in readNewick(references)
+    ]
+    distances = list()
+    for tree in trees:
+        tree = readNewick(tree)[0]
+        distances.append(
+            [
+                [res[p] for p in positions]
+                for res in (
+                    RobinsonFouldsWithDay1985(tree, reference_prep, rooted=rooted)
+                    for reference_prep in references_prep
+                )
+            ]
         )
+    distances = np.array(distances, dtype=np.float64).reshape(
+        -1, len(references_prep), len(positions)
+    )
+    distances = np.moveaxis(distances, 2, 0)
+    return distances[0] if isinstance(metrics, str) else distances
 
-    current = os.path.dirname(os.path.realpath(__file__))
-
-    with open(file, "r") as f:
-        trees = list(f.read().splitlines())
-        f.close()
-    distance_matrix = list()
-    if shutil.which("pypy3") is not None:
-        pckl = open("Trees.pckl", "wb")
-        pickle.dump(trees, pckl)
-        pckl.close()
-        workers = os.cpu_count()
-        if "sched_getaffinity" in dir(os):
-            workers = len(os.sched_getaffinity(0))
-        try:
-            with mp.Pool(workers) as pool:
-                arg_pool = list(range(len(trees)))
-                results = list(pool.imap(func_pool, arg_pool))
-            distance_matrix_upper = list(
-                map(lambda res: eval(res.split("\n")[1].strip()), results)
-            )
 
-            distance_matrix = np.zeros((n_trees, n_trees))
-            for i, line in enumerate(distance_matrix_upper):
-                distance_matrix[i, i + 1 :] = line
+# ─── RF WORKER POOL ───────────────────────────────────────────────────────────
+# trees and output buffer of the worker processes: the trees are parsed once,
+# by the parent, into a CompactTreeSet placed in shared memory; every worker
+# attaches to it in _init_pool and writes its rows into the condensed upper
+# triangles held in shared memory. Compact trees give the same results as
+# prepareTreeComparison and RobinsonFouldsWithDay1985.
+_pool_trees = None
+_pool_shm = None
+_pool_output = None
+_pool_positions = None
 
-            distance_matrix_lower = distance_matrix.transpose()
-        except:
-            print("Multiprocessing failed - trying on single core")
-            print(
-                "Suggestion: compute the distance matrix on a computing unit with more cores or analyze a smaller dataset"
+
+def _compact_tree():
+    """Imports compact_tree, which depends on this module, when it is first needed
+
+    Returns:
+        module: the compact_tree module
+    """
+    try:
+        from . import compact_tree
+    except ImportError:
+        import compact_tree
+    return compact_tree
+
+
+def _init_pool(descriptor, shm_name, n_trees, positions):
+    """Initializes a worker of the RF pool
+
+    Args:
+        descriptor (dict): descriptor of the shared CompactTreeSet, see CompactTreeSet.share
+        shm_name (str): name of the shared memory block holding the condensed output matrices
+        n_trees (int): number of trees
+        positions (list): positions of the metrics in the comparison tuple
+    """
+    global _pool_trees, _pool_shm, _pool_output, _pool_positions
+    _pool_trees = _compact_tree().CompactTreeSet.attach(descriptor)
+    _pool_positions = positions
+    _pool_shm = shared_memory.SharedMemory(name=shm_name)
+    _pool_output = np.ndarray(
+        (len(positions), condensed_size(n_trees)), dtype=np.float64, buffer=_pool_shm.buf
+    )
+
+
+def _pool_rows(rows):
+    """Computes a task of rows of the upper triangle directly into the shared output
+
+    Args:
+        rows (list): row indexes
+
+    Returns:
+        task summary (tuple) (pid, busy_time, n_comparisons): used to report worker utilisation
+    """
+    compact_tree = _compact_tree()
+    start = time.perf_counter()
+    n_comparisons = 0
+    n_trees = len(_pool_trees)
+    for i in rows:
+        tree1_prep = compact_tree.prepareTreeComparisonCompact(
+            _pool_trees[i], rooted=False
+        )
+        distances = [
+            [res[p] for p in _pool_positions]
+            for res in (
+                compact_tree.RobinsonFouldsWithDay1985Compact(
+                    _pool_trees[j], tree1_prep, rooted=False
+                )
+                for j in range(i + 1, n_trees)
             )
+        ]
+        if distances:
+            _pool_output[
+                :, row_start(i, n_trees) : row_start(i + 1, n_trees)
+            ] = np.transpose(distances)
+        n_comparisons += n_trees - i - 1
+    return os.getpid(), time.perf_counter() - start, n_comparisons
+
+
+def triangular_schedule(n_trees, n_tasks):
+    """Splits the rows of the upper triangle into tasks of (nearly) equal cost.
+    Row i costs n_trees-i-1 comparisons, so it is paired with row n_trees-1-i
+    and every pair costs n_trees-1; consecutive pairs are then grouped in n_tasks tasks.
+
+    Args:
+        n_trees (int): number of trees
+        n_tasks (int): number of tasks
+
+    Returns:
+        tasks (list): list of lists of row indexes
+    """
+    pairs = [
+        [i, n_trees - 1 - i] if i != n_trees - 1 - i else [i]
+        for i in range((n_trees + 1) // 2)
+    ]
+    n_tasks = max(1, min(n_tasks, len(pairs)))
+    bounds = np.linspace(0, len(pairs), n_tasks + 1).astype(int)
+    return [
+        [row for pair in pairs[bounds[t] : bounds[t + 1]] for row in pair]
+        for t in range(n_tasks)
+    ]
+
+
+def utilisation_report(task_summaries, wall_time):
+    """Summarizes the work done by every worker of the RF pool
+
+    Args:
+        task_summaries (list): (pid, busy_time, n_comparisons) of every task
+        wall_time (float): elapsed time of the whole computation
+
+    Returns:
+        report (pandas.DataFrame): tasks, comparisons, busy time and utilisation per worker
+    """
+    report = pd.DataFrame(task_summaries, columns=["worker", "busy_time", "comparisons"])
+    report["tasks"] = 1
+    report = report.groupby("worker").sum()
+    report["utilisation"] = report["busy_time"] / wall_time if wall_time > 0 else 1.0
+    return report[["tasks", "comparisons", "busy_time", "utilisation"]]
+
+
+def parallel_distances(
+    trees, n_trees, workers, tasks_per_worker=4, report=False, metrics="RF"
+):
+    """Computes the RF distance matrix with a pool of worker processes.
+    Trees are parsed only once, into a CompactTreeSet shared with the workers,
+    which write their rows into condensed upper triangles in shared memory;
+    rows are handed out in load-balanced tasks (see triangular_schedule). If the pool cannot be started, a warning is issued
+    and the distances are computed on a single core.
+
+    Args:
+        trees (list): list of trees in newick format
+        n_trees (int): number of trees
+        workers (int): number of worker processes
+        tasks_per_worker (int, optional): number of tasks per worker. Defaults to 4.
+        report (bool, optional): also return the per-worker utilisation. Defaults to False.
+        metrics (str or list, optional): metric or list of metrics among RF, nRF, RFL and KF. Defaults to "RF".
 
-            distance_matrix = np.zeros((n_trees, n_trees))
-            for i, tree in enumerate(trees):
-                # status.update(f"[bold red]{i+1}/{len(trees)} [bold blue]Computing Robison Foulds distances...")
-                inputTree = trees[i : i + 1]
-                inputRFtrees = trees[i + 1 :]
-                tree1 = readNewick(inputTree)[0]
-                tree1_prep = prepareTreeComparison(tree1, rooted=False)
-                otherTrees = readNewick(inputRFtrees)
-                RF_distances = list()
-                for tree in otherTrees:
-                    res = RobinsonFouldsWithDay1985(tree, tree1_prep, rooted=False)
-                    RF_distances.append(res[0])
-                distance_matrix[i, i + 1 :] = RF_distances
-
-            distance_matrix_lower = distance_matrix.transpose()
+    Returns:
+        distance_matrix (CondensedDistanceMatrix): distance matrix,
+            a list of distance matrices if a list of metrics is given
+        report (pandas.DataFrame): per-worker utilisation, only if report is True
+            (empty if the pool could not be started)
+    """
+    positions = _metric_positions(metrics)
+    shape = (len(positions), condensed_size(n_trees))
+    distance_matrices, task_summaries, wall_time = None, list(), 0.0
+    compact_trees = _compact_tree().CompactTreeSet.from_newick(trees)
+    try:
+        descriptor = compact_trees.share()
+        shm = shared_memory.SharedMemory(
+            create=True, size=max(int(np.prod(shape)) * 8, 1)
+        )
+    except OSError as error:
+        shm = None
+        warnings.warn(
+            f"RF pool could not be started ({error}) - running on a single core"
+        )
+    if shm is not None:
+        try:
+            output = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+            output[:] = 0
+            try:
+                pool = mp.get_context().Pool(
+                    workers,
+                    initializer=_init_pool,
+                    initargs=(descriptor, shm.name, n_trees, positions),
+                )
+            except (OSError, ImportError) as error:
+                pool = None
+                warnings.warn(
+                    f"RF pool could not be started ({error}) - running on a single core"
+                )
+            if pool is not None:
+                tasks = triangular_schedule(n_trees, workers * tasks_per_worker)
+                with pool:
+                    start = time.perf_counter()
+                    task_summaries = list(pool.imap_unordered(_pool_rows, tasks))
+                    wall_time = time.perf_counter() - start
+                # the float64 buffer is not copied: only its compact version is kept
+                distance_matrices = [
+                    CondensedDistanceMatrix(output[k], n_trees).astype(
+                        compact_dtype(output[k])
+                    )
+                    for k in range(len(positions))
+                ]
+            del output
+        finally:
+            shm.close()
+            shm.unlink()
+    compact_trees.release(unlink=True)
+
+    if distance_matrices is None:
+        distance_matrix = single_core_distances(
+            trees, n_trees, metrics=[metrics] if isinstance(metrics, str) else metrics
+        )
+        distance_matrices = [
+            CondensedDistanceMatrix.from_matrix(m) for m in distance_matrix
+        ]
+    distance_matrix = (
+        distance_matrices[0] if isinstance(metrics, str) else distance_matrices
+    )
+
+    if report:
+        return distance_matrix, utilisation_report(task_summaries, wall_time)
+    return distance_matrix
+
+
+def calculate_distance_matrix(file, n_trees, output_file, metrics="RF", verbose=False):
+    """Computes the whole pipeline that calculates the pairwise distances in a collection of trees
+
+    Args:
+        file (str): file containing the newick trees
+        n_trees (int): number of trees (or lines) in file
+        output_file (str): output file for distance matrix
+        metrics (str or list, optional): metric or list of metrics among RF, nRF, RFL and KF,
+            all collected in the same pass. Defaults to "RF".
+        verbose (bool, optional): print the utilisation of the worker pool. Defaults to False.
+
+    Returns:
+        distance_matrix (CondensedDistanceMatrix): distance matrix; if a list of metrics is given,
+            a dictionary metric -> distance matrix. The first metric is written
+            to output_file, the others to output_file suffixed with the metric name.
+    """
+    trees = [tree for _, tree in zip(range(n_trees), iter_trees(file))]
 
+    workers = os.cpu_count()
+    if "sched_getaffinity" in dir(os):
+        workers = len(os.sched_getaffinity(0))
+
+    if workers > 1 and n_trees > 2:
+        distance_matrix, report = parallel_distances(
+            trees, n_trees, workers, report=True, metrics=metrics
+        )
+        if verbose and len(report):
+            print(
+                f"RF pool: {len(report)} workers, utilisation {report['utilisation'].mean():.1%} (min {report['utilisation'].min():.1%})"
+            )
     else:
-        distance_matrix = np.zeros((n_trees, n_trees))
-        for i, tree in enumerate(trees):
-            # status.update(f"[bold red]{i+1}/{len(trees)} [bold blue]Computing Robison Foulds distances...")
-            inputTree = trees[i : i + 1]
-            inputRFtrees = trees[i + 1 :]
-            tree1 = readNewick(inputTree)[0]
-            tree1_prep = prepareTreeComparison(tree1, rooted=False)
-            otherTrees = readNewick(inputRFtrees)
-            RF_distances = list()
-            for tree in otherTrees:
-                res = RobinsonFouldsWithDay1985(tree, tree1_prep, rooted=False)
-                RF_distances.append(res[0])
-            distance_matrix[i, i + 1 :] = RF_distances
-
-        distance_matrix_lower = distance_matrix.transpose()
-
-    distance_matrix = pd.DataFrame(distance_matrix + distance_matrix_lower)
-    distance_matrix.to_csv(output_file, header=False, index=False)
-    return distance_matrix.values
+        distance_matrix = single_core_distances(trees, n_trees, metrics=metrics)
+
+    # the upper triangles are condensed directly, without symmetric copies
+    if isinstance(metrics, str):
+        distance_matrix = CondensedDistanceMatrix.from_matrix(distance_matrix)
+        save_matrix(distance_matrix, output_file)
+        return distance_matrix
+
+    root, ext = os.path.splitext(output_file)
+    distance_matrices = dict()
+    for k, metric in enumerate(metrics):
+        distance_matrices[metric] = CondensedDistanceMatrix.from_matrix(
+            distance_matrix[k]
+        )
+        save_matrix(
+            distance_matrices[metric], output_file if k == 0 else f"{root}_{metric}{ext}"
+        )
+    return distance_matrices
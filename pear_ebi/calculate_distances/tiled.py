@@ -0,0 +1,229 @@
+__author__ = "Andrea Rubbi"
+""" tiled computes distance matrices one tile of trees at a time, out of core.
+	The upper triangle is split into tiles of tile_size x tile_size trees: every
+	finished tile is written into a condensed (see condensed.py) memory-mapped .npy
+	output and recorded in a small json manifest next to it. The output takes the
+	compact dtype of the first tile, and is widened if a later tile does not fit in it.
+	If the computation is
+	interrupted, calling it again with the same file, method and tile size resumes
+	from the tiles already finished. Only the trees of the current tile are held in
+	memory, which is therefore bounded by the tile size instead of the number of trees."""
+
+import json
+import os
+from functools import partial
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+try:
+    from .condensed import compact_dtype, condensed_size, row_start
+    from .maple_RF import RobinsonFouldsWithDay1985, prepareTreeComparison, readNewick
+    from .tqdist import pairs_distances
+except ImportError:
+    from condensed import compact_dtype, condensed_size, row_start
+    from maple_RF import RobinsonFouldsWithDay1985, prepareTreeComparison, readNewick
+    from tqdist import pairs_distances
+
+try:
+    from ..tree_io.cache import file_hash
+    from ..tree_io.index import TreeIndex
+    from ..tree_io.matrix_io import load_matrix
+except ImportError:
+    from tree_io.cache import file_hash
+    from tree_io.index import TreeIndex
+    from tree_io.matrix_io import load_matrix
+
+# default number of trees per side of a tile
+TILE_SIZE = 1000
+
+# suffix of the manifest recording the finished tiles
+MANIFEST_SUFFIX = ".manifest.json"
+
+# distances copied at once when the output is widened
+WIDEN_CHUNK = 1 << 24
+
+
+def smart_RF_tile(rows, columns, diagonal=False):
+    """Computes RF distances between two blocks of trees with Day's algorithm
+
+    Args:
+        rows (list): trees in newick format
+        columns (list): trees in newick format
+        diagonal (bool, optional): rows and columns are the same block:
+            only the upper triangle is computed. Defaults to False.
+
+    Returns:
+        tile (np.array): len(rows) x len(columns) distances
+    """
+    rows = readNewick(rows)
+    columns = rows if diagonal else readNewick(columns)
+    tile = np.zeros((len(rows), len(columns)))
+    for a, tree1 in enumerate(rows):
+        tree1_prep = prepareTreeComparison(tree1, rooted=False)
+        start = a + 1 if diagonal else 0
+        tile[a, start:] = [
+            RobinsonFouldsWithDay1985(tree, tree1_prep, rooted=False)[0]
+            for tree in columns[start:]
+        ]
+    return tile
+
+
+# tile functions of the methods of tree_set that can be computed in tiles
+TILE_METHODS = {
+    "smart_RF": smart_RF_tile,
+    "tqdist_quartet": partial(pairs_distances, "pairs_quartet_dist"),
+    "tqdist_triplet": partial(pairs_distances, "pairs_triplet_dist"),
+}
+
+
+def read_manifest(manifest_file, expected):
+    """Reads the manifest of a previous run, if it refers to the same computation
+
+    Args:
+        manifest_file (str): manifest file
+        expected (dict): file hash, number of trees, method and tile size of the current run
+
+    Returns:
+        done (set): finished tiles (block_i, block_j), empty if there is nothing to resume
+    """
+    try:
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+            f.close()
+    except (OSError, ValueError):
+        return set()
+    if any(manifest.get(key) != value for key, value in expected.items()):
+        return set()
+    return {tuple(tile) for tile in manifest["done"]}
+
+
+def write_manifest(manifest_file, expected, done):
+    """Records the finished tiles; the manifest is replaced atomically"""
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump(dict(expected, done=sorted(done)), f)
+        f.close()
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def widen_output(output_file, output, dtype):
+    """Rewrites the memory-mapped output in a wider dtype; the file is replaced atomically
+
+    Args:
+        output_file (str): output .npy file
+        output (np.memmap): current output, memory mapped from output_file
+        dtype (np.dtype): new dtype
+
+    Returns:
+        output (np.memmap): output in the new dtype, memory mapped from output_file
+    """
+    widened = open_memmap(
+        output_file + ".tmp", mode="w+", dtype=dtype, shape=output.shape
+    )
+    for start in range(0, len(output), WIDEN_CHUNK):
+        widened[start : start + WIDEN_CHUNK] = output[start : start + WIDEN_CHUNK]
+    widened.flush()
+    os.replace(output_file + ".tmp", output_file)
+    return widened
+
+
+def rectangular_distance_matrix(rows, columns, method="smart_RF", tile_size=TILE_SIZE):
+    """Computes the distances between two sets of trees, one tile at a time,
+    without building the square matrix of their union
+
+    Args:
+        rows (str or TreeIndex): file (or index) of the first set of trees
+        columns (str or TreeIndex): file (or index) of the second set of trees
+        method (str, optional): one of TILE_METHODS. Defaults to "smart_RF".
+        tile_size (int, optional): number of trees per side of a tile. Defaults to 1000.
+
+    Returns:
+        distances (np.array): len(rows) x len(columns) distances, in a compact dtype
+    """
+    tile_function = TILE_METHODS[method]
+    rows = TreeIndex(rows, persist=False) if isinstance(rows, str) else rows
+    columns = TreeIndex(columns, persist=False) if isinstance(columns, str) else columns
+    distances = np.empty((len(rows), len(columns)))
+    for row_first in range(0, len(rows), tile_size):
+        row_trees = rows[row_first : row_first + tile_size]
+        for col_start in range(0, len(columns), tile_size):
+            column_trees = columns[col_start : col_start + tile_size]
+            distances[
+                row_first : row_first + len(row_trees),
+                col_start : col_start + len(column_trees),
+            ] = tile_function(row_trees, column_trees)
+    return distances.astype(compact_dtype(distances), copy=False)
+
+
+def calculate_distance_matrix(
+    file, n_trees, output_file, method="smart_RF", tile_size=TILE_SIZE
+):
+    """Computes the distance matrix tile by tile, resuming a previous interrupted run if possible
+
+    Args:
+        file (str): file containing the newick trees
+        n_trees (int): number of trees (or lines) in file
+        output_file (str): output file for distance matrix, stored as condensed .npy
+        method (str, optional): one of TILE_METHODS. Defaults to "smart_RF".
+        tile_size (int, optional): number of trees per side of a tile. Defaults to 1000.
+
+    Returns:
+        distance_matrix (CondensedDistanceMatrix): distance matrix, memory mapped from output_file
+    """
+    tile_function = TILE_METHODS[method]
+    output_file = os.path.splitext(output_file)[0] + ".npy"
+    manifest_file = output_file + MANIFEST_SUFFIX
+    expected = {
+        "file": file_hash(file),
+        "n_trees": n_trees,
+        "method": method,
+        "tile_size": tile_size,
+    }
+    done = (
+        read_manifest(manifest_file, expected) if os.path.exists(output_file) else set()
+    )
+    # a new output is created with the dtype of the first tile
+    output = open_memmap(output_file, mode="r+") if done else None
+    if not done:
+        write_manifest(manifest_file, expected, done)
+
+    index = TreeIndex(file)
+    blocks = [
+        (start, min(start + tile_size, n_trees)) for start in range(0, n_trees, tile_size)
+    ]
+    n_tiles, resumed = len(blocks) * (len(blocks) + 1) // 2, len(done)
+    for bi, (row_first, row_stop) in enumerate(blocks):
+        rows = None
+        for bj in range(bi, len(blocks)):
+            if (bi, bj) in done:
+                continue
+            col_start, col_stop = blocks[bj]
+            rows = rows if rows is not None else index[row_first:row_stop]
+            columns = rows if bi == bj else index[col_start:col_stop]
+            tile = tile_function(rows, columns, diagonal=bi == bj)
+            dtype = compact_dtype(tile)
+            if output is None:
+                output = open_memmap(
+                    output_file, mode="w+", dtype=dtype, shape=(condensed_size(n_trees),)
+                )
+            elif not np.can_cast(dtype, output.dtype, casting="safe"):
+                output = widen_output(
+                    output_file, output, np.promote_types(output.dtype, dtype)
+                )
+
+            for a, i in enumerate(range(row_first, row_stop)):
+                # only the columns j > i belong to the upper triangle
+                first = max(col_start, i + 1)
+                if first < col_stop:
+                    start = row_start(i, n_trees) + first - i - 1
+                    output[start : start + col_stop - first] = tile[
+                        a, first - col_start :
+                    ]
+            output.flush()
+            done.add((bi, bj))
+            write_manifest(manifest_file, expected, done)
+    del output
+    index.close()
+
+    print(f"Tiles: {n_tiles} ({resumed} resumed from {manifest_file})")
+    return load_matrix(output_file)
@@ -1,9 +1,33 @@
 import os
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import numpy as np
-import pandas as pd
+
+try:
+    from .condensed import (
+        CondensedDistanceMatrix,
+        compact_dtype,
+        condensed_size,
+        row_start,
+    )
+except ImportError:
+    from condensed import (
+        CondensedDistanceMatrix,
+        compact_dtype,
+        condensed_size,
+        row_start,
+    )
+
+try:
+    from ..tree_io.matrix_io import save_matrix
+    from ..tree_io.reader import iter_trees
+    from ..tree_io.scratch import scratch_dir
+except ImportError:
+    from tree_io.matrix_io import save_matrix
+    from tree_io.reader import iter_trees
+    from tree_io.scratch import scratch_dir
 
 # Set the value Display variable
 os.environ.setdefault("DISPLAY", ":0.0")
@@ -53,59 +77,168 @@ def bash_command(cmd):
 # ──────────────────────────────────────────────────────────────────────────────
 
 
-def quartet(file, n_trees, output_file):
-    """Computes quartet distances
+# directory of the tqDist binaries
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tqDist", "bin")
+
+# blocks smaller than this are not worth a process of their own
+MIN_BLOCK_SIZE = 50
+
+# pairs of trees written to disk for each run of a pairs_* binary
+PAIRS_PER_RUN = 2048
+
+
+def run_binary(binary, *args):
+    """Runs a tqDist binary, exiting with its error message if it fails
+
+    Args:
+        binary (str): name of the binary in BIN_DIR
+        *args (str): arguments of the binary
+    """
+    process = subprocess.run(
+        [os.path.join(BIN_DIR, binary)] + list(args),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    if process.returncode != 0 or len(process.stderr) > 0:
+        sys.exit(process.stderr or f"{binary} failed!")
+
+
+def all_pairs_distances(binary, trees):
+    """Computes the distances among a block of trees with an all_pairs_* binary,
+    in a temporary directory of its own
+
+    Args:
+        binary (str): all_pairs_quartet_dist or all_pairs_triplet_dist
+        trees (list): trees in newick format
+
+    Returns:
+        block (np.array): len(trees) x len(trees) distances, upper triangle only
+    """
+    block = np.zeros((len(trees), len(trees)))
+    with scratch_dir("pear_tqdist_") as scratch:
+        input_file, output = (os.path.join(scratch, name) for name in ("trees", "output"))
+        with open(input_file, "w") as f:
+            f.writelines(tree + "\n" for tree in trees)
+            f.close()
+        run_binary(binary, input_file, output)
+        # the output is lower triangular: line i holds the distances (i, :i+1)
+        with open(output, "r") as out:
+            for i, line in enumerate(out):
+                if i < len(trees):
+                    block[: i + 1, i] = np.fromstring(line, dtype=np.float64, sep=" ")
+            out.close()
+    return block
+
+
+def pairs_distances(binary, rows, columns, diagonal=False):
+    """Computes the distances between two blocks of trees with a pairs_* binary,
+    in a temporary directory of its own. The binary reads one pair of trees per line:
+    pairs are streamed in runs of PAIRS_PER_RUN, so that the scratch space is bounded
+    instead of growing with the number of pairs
+
+    Args:
+        binary (str): pairs_quartet_dist or pairs_triplet_dist
+        rows (list): trees in newick format
+        columns (list): trees in newick format
+        diagonal (bool, optional): rows and columns are the same block:
+            only the upper triangle is computed. Defaults to False.
+
+    Returns:
+        block (np.array): len(rows) x len(columns) distances
+    """
+    if diagonal:
+        a, b = np.triu_indices(len(rows), k=1, m=len(columns))
+    else:
+        a, b = np.divmod(np.arange(len(rows) * len(columns)), max(len(columns), 1))
+    block = np.zeros((len(rows), len(columns)))
+    if len(a) == 0:
+        return block
+
+    with scratch_dir("pear_tqdist_") as scratch:
+        files = [os.path.join(scratch, name) for name in ("rows", "columns", "output")]
+        for start in range(0, len(a), PAIRS_PER_RUN):
+            run = slice(start, start + PAIRS_PER_RUN)
+            for file, trees, side in zip(files, (rows, columns), (a[run], b[run])):
+                with open(file, "w") as f:
+                    f.writelines(trees[k] + "\n" for k in side)
+                    f.close()
+            run_binary(binary, *files)
+            block[a[run], b[run]] = np.loadtxt(files[2], ndmin=1)
+    return block
+
+
+def all_pairs(file, n_trees, output_file, kind="quartet", block_size=None, workers=None):
+    """Computes quartet or triplet distances in blocks of rows run concurrently:
+    the blocks on the diagonal by all_pairs_{kind}_dist, the others by pairs_{kind}_dist
 
     Args:
         file (str): name of input file with phylogenetic trees in newick format
         n_trees (int): number of trees in file
         output_file (str): name of output file that will contain the distance matrix
+        kind (str, optional): quartet or triplet. Defaults to "quartet".
+        block_size (int, optional): number of trees per block. Defaults to a size
+            giving every worker at least one block pair.
+        workers (int, optional): number of concurrent processes. Defaults to the available cores.
 
     Returns:
-        distance_matrix (pandas.DataFrame): computed distance matrix
+        distance_matrix (CondensedDistanceMatrix): computed distance matrix
     """
-    try:
-        path = os.path.dirname(os.path.abspath(__file__))
-    except:
-        path = "."
-    cmd = "{path}/tqDist/bin/all_pairs_quartet_dist {file} {output} 1> /dev/null 2> ./tqdist_err.txt".format(
-        path=path, file=file, output=output_file, verbose=1
-    )
+    if workers is None:
+        workers = os.cpu_count()
+        if "sched_getaffinity" in dir(os):
+            workers = len(os.sched_getaffinity(0))
+    if block_size is None:
+        # k blocks of rows give k * (k + 1) / 2 block pairs
+        k = int(np.ceil((np.sqrt(8 * workers + 1) - 1) / 2))
+        block_size = max(int(np.ceil(n_trees / k)), MIN_BLOCK_SIZE)
 
-    # Runs command
-    bash_command(cmd)
+    trees = [tree for _, tree in zip(range(n_trees), iter_trees(file))]
+    blocks = [
+        (start, min(start + block_size, n_trees))
+        for start in range(0, n_trees, block_size)
+    ]
 
-    with open("tqdist_err.txt", "r") as err_mess:
-        err = err_mess.read()
-        err_mess.close()
-        bash_command("rm tqdist_err.txt")
-        if len(err) > 0:
-            sys.exit(err)
+    condensed = np.empty(condensed_size(n_trees), dtype=np.float64)
+    with ThreadPoolExecutor(max(workers, 1)) as executor:
+        futures = dict()
+        for bi, (row_first, row_stop) in enumerate(blocks):
+            for col_start, col_stop in blocks[bi:]:
+                if col_start == row_first:
+                    future = executor.submit(
+                        all_pairs_distances,
+                        f"all_pairs_{kind}_dist",
+                        trees[row_first:row_stop],
+                    )
+                else:
+                    future = executor.submit(
+                        pairs_distances,
+                        f"pairs_{kind}_dist",
+                        trees[row_first:row_stop],
+                        trees[col_start:col_stop],
+                    )
+                futures[future] = (row_first, col_start)
 
-    bash_command(
-        f"tr -s \" \" < {output_file} | sed 's/\s/_/g' > ./tmp_file && cat ./tmp_file > {output_file} && rm ./tmp_file"
-    )
-
-    # Reads output file and creates numpy array
-    # which is used to create a pandas dataframe
-    try:
-        with open(output_file, "r") as out:
-            distance_matrix = np.zeros((n_trees, n_trees))
-            for i, line in enumerate(out.readlines()):
-                values = line.strip().split("_")[:-1]
-                distance_matrix[i, : i + 1] = values
-            out.close()
+        # blocks are stitched into the condensed upper triangle as they finish
+        for future in as_completed(futures):
+            row_first, col_start = futures[future]
+            block = future.result()
+            for a in range(block.shape[0]):
+                i = row_first + a
+                first = max(col_start, i + 1)
+                start = row_start(i, n_trees) + first - i - 1
+                condensed[start : start + col_start + block.shape[1] - first] = block[
+                    a, first - col_start :
+                ]
 
-        distance_matrix_upper = distance_matrix.transpose()
-        distance_matrix = pd.DataFrame(distance_matrix + distance_matrix_upper)
-        distance_matrix.to_csv(output_file, header=False, index=False)
-        return distance_matrix.values
-    except:
-        sys.exit("quartet failed!")
+    distance_matrix = CondensedDistanceMatrix(condensed, n_trees)
+    distance_matrix = distance_matrix.astype(compact_dtype(condensed))
+    save_matrix(distance_matrix, output_file)
+    return distance_matrix
 
 
-def triplet(file, n_trees, output_file):
-    """Computes triplet distances
+def quartet(file, n_trees, output_file):
+    """Computes quartet distances
 
     Args:
         file (str): name of input file with phylogenetic trees in newick format
@@ -113,43 +246,20 @@ def triplet(file, n_trees, output_file):
         output_file (str): name of output file that will contain the distance matrix
 
     Returns:
-        distance_matrix (pandas.DataFrame): computed distance matrix
+        distance_matrix (CondensedDistanceMatrix): computed distance matrix
     """
-    try:
-        path = os.path.dirname(__file__)
-    except:
-        path = "."
-    cmd = "{path}/tqDist/bin/all_pairs_quartet_dist {file} {output} 1> /dev/null 2> ./tqdist_err.txt".format(
-        path=path, file=file, output=output_file, verbose=1
-    )
+    return all_pairs(file, n_trees, output_file, kind="quartet")
 
-    # Runs command
-    bash_command(cmd)
 
-    with open("tqdist_err.txt", "r") as err_mess:
-        err = err_mess.read()
-        err_mess.close()
-        bash_command("rm tqdist_err.txt")
-        if len(err) > 0:
-            sys.exit(err)
-
-    bash_command(
-        f"tr -s \" \" < {output_file} | sed 's/\s/_/g' > ./tmp_file && cat ./tmp_file > {output_file} && rm ./tmp_file"
-    )
+def triplet(file, n_trees, output_file):
+    """Computes triplet distances
 
-    # Reads output file and creates numpy array
-    # which is rused to create a pandas dataframe
-    try:
-        with open(output_file, "r") as out:
-            distance_matrix = np.zeros((n_trees, n_trees))
-            for i, line in enumerate(out.readlines()):
-                values = line.strip().split("_")[:-1]
-                distance_matrix[i, : i + 1] = values
-            out.close()
+    Args:
+        file (str): name of input file with phylogenetic trees in newick format
+        n_trees (int): number of trees in file
+        output_file (str): name of output file that will contain the distance matrix
 
-        distance_matrix_upper = distance_matrix.transpose()
-        distance_matrix = pd.DataFrame(distance_matrix + distance_matrix_upper)
-        distance_matrix.to_csv(output_file, header=False, index=False)
-        return distance_matrix.values
-    except:
-        sys.exit("triplet failed!")
+    Returns:
+        distance_matrix (CondensedDistanceMatrix): computed distance matrix
+    """
+    return all_pairs(file, n_trees, output_file, kind="triplet")
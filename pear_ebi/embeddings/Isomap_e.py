@@ -2,6 +2,7 @@ __author__ = "Andrea Rubbi"
 # ──────────────────────────────────────────────────────────────────────────────
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.manifold import Isomap
 
 from .emb_quality import DRM, pear_correlation
@@ -9,20 +10,52 @@ from .emb_quality import DRM, pear_correlation
 
 # ──────────────────────────────────────────────────────────────────────────────
 # ─── ISOMAP N COMPONENTS ──────────────────────────────────────────────────────
-def isomap(distance_matrix, n_components, metadata=None, quality=False, report=False):
+def isomap(
+    distance_matrix,
+    n_components,
+    metadata=None,
+    quality=False,
+    report=False,
+    output_file=None,
+):
     """embed distance_matrix in n_components with Isomap
 
     Args:
-        distance_matrix (pandas.DataFrame): distance_matrix
+        distance_matrix (pandas.DataFrame or scipy.sparse.csr_matrix): distance_matrix,
+            or sparse k-nearest-neighbour graph (see tree_set.knn_graph)
         n_components (int): number of desired components
         metadata (pandas.DataFrame, optional): metadata of elements. Defaults to None.
+        output_file (str, optional): csv file the embedding is written to, if given. Defaults to None.
 
     Returns:
         components (numpy.array): embedding of distance matrix
     """
-    embedding = Isomap(n_components=n_components)
+    if sparse.issparse(distance_matrix):
+        # geodesic distances are computed on the given neighbours only; sklearn counts
+        # every tree among its own neighbours, so the zero diagonal is stored explicitly
+        # and the k of the graph is the minimum number of neighbours per row
+        graph = distance_matrix.tocoo()
+        n = graph.shape[0]
+        off_diagonal = graph.row != graph.col
+        rows = np.concatenate([graph.row[off_diagonal], np.arange(n)])
+        columns = np.concatenate([graph.col[off_diagonal], np.arange(n)])
+        data = np.concatenate([graph.data[off_diagonal], np.zeros(n)])
+        # neighbours are sorted by distance within every row, as sklearn expects
+        order = np.lexsort((data, rows))
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n))])
+        distance_matrix = sparse.csr_matrix(
+            (data[order], columns[order], indptr), shape=(n, n)
+        )
+        embedding = Isomap(
+            n_components=n_components,
+            n_neighbors=int(distance_matrix.getnnz(axis=1).min()) - 1,
+            metric="precomputed",
+        )
+    else:
+        embedding = Isomap(n_components=n_components)
     components = embedding.fit_transform(distance_matrix)
-    pd.DataFrame(components).to_csv("./ISOMAP_Embedding.csv", header=False, index=False)
+    if output_file is not None:
+        pd.DataFrame(components).to_csv(output_file, header=False, index=False)
 
     if report:
         Xr = None
@@ -9,13 +9,21 @@ from .emb_quality import DRM, pear_correlation
 
 # ──────────────────────────────────────────────────────────────────────────────
 # ─── LLE N COMPONENTS ─────────────────────────────────────────────────────────
-def lle(distance_matrix, n_components, metadata=None, quality=False, report=False):
+def lle(
+    distance_matrix,
+    n_components,
+    metadata=None,
+    quality=False,
+    report=False,
+    output_file=None,
+):
     """embed distance_matrix in n_components with Locally Linear Embedding
 
     Args:
         distance_matrix (pandas.DataFrame): distance_matrix
         n_components (int): number of desired components
         metadata (pandas.DataFrame, optional): metadata of elements. Defaults to None.
+        output_file (str, optional): csv file the embedding is written to, if given. Defaults to None.
 
     Returns:
         components (numpy.array): Embedding of distance matrix
@@ -23,7 +31,8 @@ def lle(distance_matrix, n_components, metadata=None, quality=False, report=Fals
     embedding, _err_ = locally_linear_embedding(
         distance_matrix, n_neighbors=5, n_components=n_components
     )
-    pd.DataFrame(embedding).to_csv("./ISOMAP_Embedding.csv", header=False, index=False)
+    if output_file is not None:
+        pd.DataFrame(embedding).to_csv(output_file, header=False, index=False)
 
     if report:
         Xr = None
@@ -1,32 +1,124 @@
 __author__ = "Andrea Rubbi"
 # ──────────────────────────────────────────────────────────────────────────────
+import sys
+
 import numpy as np
 import pandas as pd
-from sklearn.decomposition import PCA
+from scipy.sparse.linalg import eigsh
 
+from ..calculate_distances.condensed import CondensedDistanceMatrix
+from ..calculate_distances.maple_RF import distances_to_references
 from .emb_quality import DRM, pear_correlation
 
+# default number of landmark trees
+N_LANDMARKS = 200
+
+# rows of the distance matrix centred at once
+BLOCK_SIZE = 1024
+
 
 # ──────────────────────────────────────────────────────────────────────────────
 # ─── PCA N COMPONENTS ─────────────────────────────────────────────────────────
-def pca(distance_matrix, n_components, metadata=None, quality=False, report=False):
+def double_centre(distance_matrix, block_size=BLOCK_SIZE):
+    """Builds the Gram matrix B = -1/2 J D² J of classical MDS, with J = I - 11ᵀ/n.
+    Distances are expanded (if condensed), squared and centred in place, one block
+    of rows at a time, so that the only n x n array allocated is B itself
+
+    Args:
+        distance_matrix (np.array or CondensedDistanceMatrix): symmetric distance matrix
+        block_size (int, optional): number of rows processed at once. Defaults to 1024.
+
+    Returns:
+        gram (np.array): double-centred squared distances, float64
+    """
+    condensed = isinstance(distance_matrix, CondensedDistanceMatrix)
+    if condensed:
+        n = distance_matrix.n_trees
+        gram = np.empty((n, n))
+    else:
+        gram = np.array(distance_matrix, dtype=np.float64)
+        n = gram.shape[0]
+    means = np.empty(n)
+    for start in range(0, n, block_size):
+        block = gram[start : start + block_size]
+        if condensed:
+            # rows are expanded straight into the float64 buffer, without square copies
+            for i in range(start, start + len(block)):
+                block[i - start] = distance_matrix.row(i)
+        np.square(block, out=block)
+        means[start : start + block_size] = block.mean(axis=1)
+    # D² is symmetric: its row and column means coincide
+    grand_mean = means.mean()
+    for start in range(0, n, block_size):
+        block = gram[start : start + block_size]
+        block -= means[start : start + block_size, None]
+        block -= means[None, :]
+        block += grand_mean
+        block *= -0.5
+    return gram
+
+
+def principal_coordinates(distance_matrix, n_components):
+    """Classical MDS (PCoA): top eigenpairs of the double-centred squared distances,
+    extracted with a Lanczos solver instead of a full decomposition
+
+    Args:
+        distance_matrix (np.array or CondensedDistanceMatrix): symmetric distance matrix
+        n_components (int): number of desired components
+
+    Returns:
+        components (numpy.array): principal coordinates, in decreasing order of eigenvalue
+        explained (numpy.array): fraction of the total variance (trace of B) of every component
+    """
+    gram = double_centre(distance_matrix)
+    n = gram.shape[0]
+    if n_components < n - 1:
+        # seeded starting vector: the result does not change between runs
+        v0 = np.random.default_rng(0).uniform(size=n)
+        values, vectors = eigsh(gram, k=n_components, which="LA", v0=v0)
+    else:
+        # too few points for Lanczos
+        values, vectors = np.linalg.eigh(gram)
+    order = np.argsort(values)[::-1][:n_components]
+    values, vectors = values[order], vectors[:, order]
+    # eigenvectors have arbitrary signs: the largest entry of each is made positive
+    largest = np.abs(vectors).argmax(axis=0)
+    vectors = vectors * np.sign(vectors[largest, np.arange(vectors.shape[1])])
+    total = np.trace(gram)
+    # negative eigenvalues (non-euclidean distances) have no real coordinates
+    components = vectors * np.sqrt(np.maximum(values, 0))
+    explained = values / total if total > 0 else np.zeros_like(values)
+    return components, explained
+
+
+def pca(
+    distance_matrix,
+    n_components,
+    metadata=None,
+    quality=False,
+    report=False,
+    output_file=None,
+):
     """embed distance_matrix in n_components with Principal Coordinate Analysis
 
     Args:
-        distance_matrix (pandas.DataFrame): distance_matrix
+        distance_matrix (np.array or CondensedDistanceMatrix): distance_matrix
         n_components (int): number of desired components
         metadata (pandas.DataFrame, optional): metadata of elements. Defaults to None.
+        output_file (str, optional): csv file the embedding is written to, if given. Defaults to None.
 
     Returns:
         components (numpy.array): principal coordinates(components) of distance matrix
     """
-    pca = PCA(n_components=n_components)
-    components = pca.fit_transform(distance_matrix)
-    total_var = pca.explained_variance_ratio_.sum() * 100
-    pd.DataFrame(components).to_csv("./PCA_Embedding.csv", header=False, index=False)
+    components, explained = principal_coordinates(distance_matrix, n_components)
+    total_var = explained.sum() * 100
+    if output_file is not None:
+        pd.DataFrame(components).to_csv(output_file, header=False, index=False)
 
+    if report or quality:
+        distance_matrix = np.asarray(distance_matrix, dtype=np.float64)
     if report:
-        Xr = pca.inverse_transform(components)
+        Xr = None
         qu_re = DRM(distance_matrix, components, Xr)
     else:
         qu_re = None
@@ -40,3 +132,103 @@ def pca(distance_matrix, n_components, metadata=None, quality=False, report=Fals
         )
 
     return components
+
+
+# ─── LANDMARK MDS ─────────────────────────────────────────────────────────────
+def landmark_distances(trees, n_landmarks=N_LANDMARKS, selection="random", seed=0):
+    """Chooses landmark trees and computes the distances of all the trees to them only
+
+    Args:
+        trees (TreeIndex or list): trees in newick format
+        n_landmarks (int, optional): number of landmarks. Defaults to 200.
+        selection (str, optional): "random" landmarks, or "maxmin": every landmark is the tree
+            farthest from the landmarks already chosen. Defaults to "random".
+        seed (int, optional): seed of the random choices. Defaults to 0.
+
+    Returns:
+        landmarks (np.array): indices of the landmark trees
+        distances (np.array): n_trees x n_landmarks RF distances
+    """
+    n_trees = len(trees)
+    n_landmarks = min(n_landmarks, n_trees)
+    rng = np.random.default_rng(seed)
+    if selection == "random":
+        landmarks = np.sort(rng.choice(n_trees, size=n_landmarks, replace=False))
+        references = [trees[int(i)] for i in landmarks]
+        return landmarks, distances_to_references(iter(trees), references)
+
+    if selection != "maxmin":
+        sys.exit(f"Landmark selection {selection} not available (random, maxmin)")
+    # one pass through the trees per landmark
+    landmarks, columns = [int(rng.integers(n_trees))], list()
+    nearest = np.full(n_trees, np.inf)
+    while True:
+        columns.append(distances_to_references(iter(trees), [trees[landmarks[-1]]])[:, 0])
+        nearest = np.minimum(nearest, columns[-1])
+        # every tree is already at distance 0 from a landmark
+        if len(landmarks) == n_landmarks or nearest.max() == 0:
+            break
+        landmarks.append(int(np.argmax(nearest)))
+    return np.array(landmarks), np.column_stack(columns)
+
+
+def landmark_mds(distances, landmarks, n_components):
+    """Classical MDS of the landmarks; the other trees are triangulated into the same space
+    from their distances to the landmarks (de Silva & Tenenbaum, 2004)
+
+    Args:
+        distances (np.array): n_trees x n_landmarks distances
+        landmarks (np.array): index of the landmark trees, i.e. rows of distances
+        n_components (int): number of desired components
+
+    Returns:
+        components (numpy.array): n_trees x n_components coordinates
+    """
+    squared = np.asarray(distances, dtype=np.float64) ** 2
+    delta = squared[landmarks]
+    delta = (delta + delta.T) / 2
+    n_landmarks = len(landmarks)
+    centering = np.eye(n_landmarks) - 1 / n_landmarks
+    values, vectors = np.linalg.eigh(-0.5 * centering @ delta @ centering)
+    order = np.argsort(values)[::-1][:n_components]
+    values, vectors = values[order], vectors[:, order]
+
+    # only positive eigenvalues give real coordinates, the others are left at 0
+    positive = values > 1e-9 * max(values.max(initial=0), 1)
+    components = np.zeros((squared.shape[0], n_components))
+    components[:, : len(values)][:, positive] = (
+        -0.5
+        * (squared - delta.mean(axis=0))
+        @ (vectors[:, positive] / np.sqrt(values[positive]))
+    )
+    return components
+
+
+def landmark_pca(
+    trees,
+    n_components,
+    n_landmarks=N_LANDMARKS,
+    selection="random",
+    seed=0,
+    output_file=None,
+):
+    """embed trees in n_components with landmark MDS: only the distances between the trees
+    and n_landmarks landmark trees are computed, in O(n_trees * n_landmarks) time and memory
+
+    Args:
+        trees (TreeIndex or list): trees in newick format
+        n_components (int): number of desired components
+        n_landmarks (int, optional): number of landmarks. Defaults to 200.
+        selection (str, optional): landmark selection, "random" or "maxmin". Defaults to "random".
+        seed (int, optional): seed of the random choices. Defaults to 0.
+        output_file (str, optional): csv file the embedding is written to, if given. Defaults to None.
+
+    Returns:
+        components (numpy.array): principal coordinates of the trees
+        landmarks (np.array): indices of the landmark trees
+    """
+    landmarks, distances = landmark_distances(trees, n_landmarks, selection, seed)
+    components = landmark_mds(distances, landmarks, n_components)
+    if output_file is not None:
+        pd.DataFrame(components).to_csv(output_file, header=False, index=False)
+    return components, landmarks
@@ -2,52 +2,117 @@ __author__ = "Andrea Rubbi"
 # ──────────────────────────────────────────────────────────────────────────────
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.manifold import TSNE
 
 from .emb_quality import DRM, pear_correlation
+from .PCA_e import principal_coordinates
+
+# bounds of the automatic perplexity
+PERPLEXITY_RANGE = (5, 50)
 
 
 # ──────────────────────────────────────────────────────────────────────────────
 # ─── t-SNE ND ─────────────────────────────────────────────────────────────────
-def tsne(distance_matrix, n_dimensions, metadata=None, quality=False, report=False):
-    """embed distance_matrix in n_components with t-Stochastic Neighbor Embedding
+def auto_perplexity(n_trees, n_neighbours=None):
+    """Scales the perplexity with the number of trees (n / 100, between 5 and 50),
+    within the number of neighbours available: affinities need 3 * perplexity + 2 of them
+
+    Args:
+        n_trees (int): number of trees
+        n_neighbours (int, optional): neighbours of every tree, e.g. k of a k-nearest-neighbour graph.
+            Defaults to None (all the other trees).
+
+    Returns:
+        perplexity (float): perplexity
+    """
+    if n_neighbours is None:
+        n_neighbours = n_trees - 1
+    perplexity = min(PERPLEXITY_RANGE[1], max(PERPLEXITY_RANGE[0], n_trees / 100))
+    return max(min(perplexity, (n_neighbours - 2) / 3), 0.5)
+
+
+def tsne(
+    distance_matrix,
+    n_dimensions,
+    metadata=None,
+    quality=False,
+    report=False,
+    output_file=None,
+    perplexity=None,
+    n_jobs=-1,
+    seed=0,
+):
+    """embed distance_matrix in n_components with t-Stochastic Neighbor Embedding,
+    computing affinities directly from the (precomputed) tree distances
 
     Args:
-        distance_matrix (pandas.DataFrame): distance_matrix
+        distance_matrix (np.array or scipy.sparse.csr_matrix): distance_matrix,
+            or sparse k-nearest-neighbour graph (see tree_set.knn_graph)
         n_dimensions (int): number of desired dimensions
         metadata (pandas.DataFrame, optional): metadata of elements. Defaults to None.
+        quality (bool, optional): also return the correlation of distances and embedded distances. Defaults to False.
+        report (bool, optional): also return the DRM quality report. Defaults to False.
+        output_file (str, optional): csv file the embedding is written to, if given. Defaults to None.
+        perplexity (float, optional): perplexity. Defaults to None (auto_perplexity).
+        n_jobs (int, optional): number of parallel jobs of the neighbour search. Defaults to -1 (all cores).
+        seed (int, optional): random seed, for reproducible embeddings. Defaults to 0.
+
+    Raises:
+        ValueError: quality or report are requested for a sparse k-nearest-neighbour graph
 
     Returns:
         Distances_embedded_ND (numpy.array): distances embedded in n_dimensions
     """
+    if sparse.issparse(distance_matrix) and (quality or report):
+        raise ValueError(
+            "quality and report need the distance matrix, not a k-nearest-neighbour graph"
+        )
     method = "barnes_hut"
     if n_dimensions > 3:
         method = "exact"
 
+    if sparse.issparse(distance_matrix):
+        # affinities are computed on the given neighbours only
+        n_neighbours = distance_matrix.getnnz(axis=1).min()
+        distances, init = distance_matrix, "random"
+    else:
+        n_neighbours = None
+        distances = np.asarray(distance_matrix, dtype=np.float64)
+        # principal coordinates, scaled as sklearn does for init="pca"
+        # (which is not available with precomputed distances)
+        init, _ = principal_coordinates(distances, n_dimensions)
+        init = init / max(np.std(init[:, 0]), np.finfo(float).tiny) * 1e-4
+
     tsne = TSNE(
         n_components=n_dimensions,
         method=method,
-        init="random",
-        learning_rate=200.0,
-        perplexity=3,
-    )
-
-    Distances_embedded_ND = tsne.fit_transform(distance_matrix.values.astype(np.float32))
-    pd.DataFrame(Distances_embedded_ND).to_csv(
-        "./t-SNE_Embedding.csv", header=False, index=False
+        init=init,
+        learning_rate="auto",
+        perplexity=(
+            perplexity
+            if perplexity is not None
+            else auto_perplexity(distances.shape[0], n_neighbours)
+        ),
+        metric="precomputed",
+        n_jobs=n_jobs,
+        random_state=seed,
     )
+    Distances_embedded_ND = tsne.fit_transform(distances)
+    if output_file is not None:
+        pd.DataFrame(Distances_embedded_ND).to_csv(output_file, header=False, index=False)
 
     if report:
         # Xr = tsne.inverse_transform(Distances_embedded_ND)
         Xr = None
-        qu_re = DRM(distance_matrix, Distances_embedded_ND, Xr)
+        qu_re = DRM(distances, Distances_embedded_ND, Xr)
     else:
         qu_re = None
 
     if quality:
         return (
             Distances_embedded_ND,
-            pear_correlation(distance_matrix, Distances_embedded_ND),
+            pear_correlation(distances, Distances_embedded_ND),
             qu_re,
         )
 
@@ -6,15 +6,50 @@ import sys
 import numpy as np
 
 try:
-    from ..calculate_distances import maple_RF
+    from ..calculate_distances import compact_tree
+    from ..tree_io.index import TreeIndex
 except:
     currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
     parentdir = os.path.dirname(currentdir)
     sys.path.insert(0, parentdir)
-    from calculate_distances import maple_RF
+    from calculate_distances import compact_tree
+    from tree_io.index import TreeIndex
 
 
-def subsample(file, n_trees, n_required, subp=True):
+def draw(remaining, keep=True):
+    """Draws a random tree index among the remaining ones in O(1)
+
+    Args:
+        remaining (list): indexes of the trees not sampled yet
+        keep (bool, optional): leave the index among the remaining ones. Defaults to True.
+
+    Returns:
+        idx (int): index of the tree drawn
+    """
+    position = random.randrange(len(remaining))
+    remaining[position], remaining[-1] = remaining[-1], remaining[position]
+    return remaining[-1] if keep else remaining.pop()
+
+
+class LazyCompactTrees:
+    def __init__(self, trees):
+        """Parses the trees of an index into CompactTree instances on access
+
+        trees: TreeIndex (or list) of newick strings
+        """
+        self.trees = trees
+        self.taxa = dict()
+
+    def __len__(self):
+        return len(self.trees)
+
+    def __getitem__(self, i):
+        return compact_tree.CompactTree(
+            **compact_tree.compact_from_newick(self.trees[i], self.taxa), taxa=self.taxa
+        )
+
+
+def subsample(file, n_trees, n_required, subp=True, index=None):
     """subsample a set of trees considering their
        distribution in the n_trees dimensional space.
        It tries to maximize the distance between the
@@ -31,60 +66,78 @@ def subsample(file, n_trees, n_required, subp=True):
         file (str): name of file containing the set of trees in newick format.
         n_trees (int): number of trees in set.
         n_required (int): number of trees in subsample.
+        index (tree_io.index.TreeIndex, optional): index of file, built if not given;
+            a CollectionIndex reads the trees of several files, which are not cached.
 
     Returns:
         interesting points (list): list of trees subsampled.
         idxs (list): list of indexes of the trees subsampled.
     """
-    with open(file, "r") as f:
-        trees = {tree: idx for idx, tree in enumerate(list(f.readlines()))}
-        f.close()
-
-    MD1_tree = random.sample(trees.keys(), 1)[0]
-    MD1_idx = trees[MD1_tree]
-    MD1 = maple_RF.readNewick(MD1_tree)[0]
-    MD1_prep = maple_RF.prepareTreeComparison(MD1, rooted=False)
-    trees.pop(MD1_tree)
-
-    MD2_tree = random.sample(trees.keys(), 1)[0]
-    MD2_idx = trees[MD2_tree]
-    MD2 = maple_RF.readNewick(MD2_tree)[0]
-    MD2_prep = maple_RF.prepareTreeComparison(MD2, rooted=False)
-    trees.pop(MD2_tree)
+    # trees are read on demand through the offset index
+    trees = index if index is not None else TreeIndex(file)
+    remaining = list(range(len(trees)))
+    # parsed trees are loaded from the on-disk cache if file was already parsed,
+    # otherwise only the trees drawn are parsed
+    compact_trees = (
+        compact_tree.CompactTreeSet.from_cache(file) if trees.file is not None else None
+    )
+    if compact_trees is None:
+        compact_trees = LazyCompactTrees(trees)
+
+    MD1_idx = draw(remaining, keep=False)
+    MD1_tree = trees[MD1_idx]
+    MD1 = compact_trees[MD1_idx]
+    MD1_prep = compact_tree.prepareTreeComparisonCompact(MD1, rooted=False)
+
+    MD2_idx = draw(remaining, keep=False)
+    MD2_tree = trees[MD2_idx]
+    MD2 = compact_trees[MD2_idx]
+    MD2_prep = compact_tree.prepareTreeComparisonCompact(MD2, rooted=False)
     print(MD1)
     print(MD2)
 
     interesting_points, idxs = [MD1_tree, MD2_tree], [MD1_idx, MD2_idx]
-    d_MD1_MD2 = maple_RF.RobinsonFouldsWithDay1985(MD2, MD1_prep, rooted=False)[0]
+    d_MD1_MD2 = compact_tree.RobinsonFouldsWithDay1985Compact(
+        MD2, MD1_prep, rooted=False
+    )[0]
 
     # def sample_points(trees, MD1_prep, MD2_prep, alpha = 100):
     # global trees, intersting_points, idxs
     while len(interesting_points) < n_required:
-        P_tree = random.sample(trees.keys(), 1)[0]
-        P_idx = trees[P_tree]
-        P = maple_RF.readNewick(P_tree)[0]
-        d_MD1_P = maple_RF.RobinsonFouldsWithDay1985(P, MD1_prep, rooted=False)[0]
-        d_MD2_P = maple_RF.RobinsonFouldsWithDay1985(P, MD2_prep, rooted=False)[0]
+        # P_idx is moved to the end of remaining: pop() discards it once sampled
+        P_idx = draw(remaining)
+        P_tree = trees[P_idx]
+        P = compact_trees[P_idx]
+        d_MD1_P = compact_tree.RobinsonFouldsWithDay1985Compact(
+            P, MD1_prep, rooted=False
+        )[0]
+        d_MD2_P = compact_tree.RobinsonFouldsWithDay1985Compact(
+            P, MD2_prep, rooted=False
+        )[0]
         if d_MD1_P > d_MD1_MD2:
             d_MD1_MD2 = d_MD1_P
-            trees.pop(P_tree)
-            MD2, MD2_prep = P, maple_RF.prepareTreeComparison(P, rooted=False)
+            remaining.pop()
+            MD2, MD2_prep = P, compact_tree.prepareTreeComparisonCompact(P, rooted=False)
             interesting_points.append(P_tree)
             idxs.append(P_idx)
         elif d_MD2_P > d_MD1_MD2:
             d_MD1_MD2 = d_MD2_P
-            trees.pop(P_tree)
-            MD1, MD1_prep = P, maple_RF.prepareTreeComparison(P, rooted=False)
+            remaining.pop()
+            MD1, MD1_prep = P, compact_tree.prepareTreeComparisonCompact(P, rooted=False)
             interesting_points.append(P_tree)
             idxs.append(P_idx)
         elif random.randint(0, 100) > 50:  # alpha:
-            trees.pop(P_tree)
+            remaining.pop()
             if random.randint(0, 10) > 5:
                 d_MD1_MD2 = d_MD1_P
-                MD2, MD2_prep = P, maple_RF.prepareTreeComparison(P, rooted=False)
+                MD2, MD2_prep = P, compact_tree.prepareTreeComparisonCompact(
+                    P, rooted=False
+                )
             else:
                 d_MD1_MD2 = d_MD2_P
-                MD1, MD1_prep = P, maple_RF.prepareTreeComparison(P, rooted=False)
+                MD1, MD1_prep = P, compact_tree.prepareTreeComparisonCompact(
+                    P, rooted=False
+                )
             interesting_points.append(P_tree)
             idxs.append(P_idx)
     return interesting_points, idxs
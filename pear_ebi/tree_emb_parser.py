@@ -37,7 +37,7 @@ def parser():
         type=str,
         dest="output",
         metavar="output",
-        help="output file : storage of distance matrix",
+        help="output file : storage of distance matrix (.npy by default, .csv for a text export)",
         required=False,
     )
     parser.add_argument(
@@ -54,7 +54,7 @@ def parser():
         type=str,
         dest="distance_matrix",
         metavar="distance_matrix",
-        help="distance matrix : file of the distance matrix",
+        help="distance matrix : file of the distance matrix (.npy or .csv)",
         required=False,
     )
     parser.add_argument(
@@ -70,7 +70,7 @@ def parser():
         "--m",
         dest="method",
         type=str,
-        help="calculates tree distances using specified method (hashrf_RF, hashrf_wRF, smart_RF, tqdist_quartet, tqdist_triplet)",
+        help="calculates tree distances using specified method (hashrf_RF, hashrf_wRF, smart_RF, bitset_RF, approx_RF, tqdist_quartet, tqdist_triplet)",
         required=False,
     )
     parser.add_argument(
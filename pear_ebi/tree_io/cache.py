@@ -0,0 +1,128 @@
+__author__ = "Andrea Rubbi"
+""" cache stores parsed representations of tree files on disk, so that repeated
+	analyses of the same file skip parsing. Entries are keyed by a hash of the file
+	content and of the options used to parse it; the content is hashed at most once
+	per process while the file is unchanged. Entries are saved as one .npy file per
+	array, which is memory mapped when loaded. The cache directory is taken from the
+	PEAR_CACHE_DIR environment variable and defaults to ~/.cache/pear_ebi;
+	setting PEAR_CACHE_DIR to an empty string disables caching."""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+# environment variable pointing to the cache directory
+CACHE_DIR_ENV = "PEAR_CACHE_DIR"
+
+# bytes hashed at once
+CHUNK_SIZE = 1 << 24
+
+# digests of the files hashed by this process, keyed by path, size and modification time
+_file_hashes = dict()
+
+
+def cache_dir():
+    """Returns the cache directory, or None if caching is disabled
+
+    Returns:
+        directory (str): path of the cache directory
+    """
+    directory = os.environ.get(
+        CACHE_DIR_ENV, os.path.join(os.path.expanduser("~"), ".cache", "pear_ebi")
+    )
+    return directory if directory else None
+
+
+def file_hash(file):
+    """Hashes the content of file, streaming through it.
+    The digest is reused while path, size and modification time of file are unchanged.
+
+    Args:
+        file (str): path of the file
+
+    Returns:
+        digest (str): blake2b hex digest of the content
+    """
+    stat = os.stat(file)
+    signature = (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+    if signature not in _file_hashes:
+        digest = hashlib.blake2b(digest_size=20)
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+            f.close()
+        _file_hashes[signature] = digest.hexdigest()
+    return _file_hashes[signature]
+
+
+def cache_key(file, kind, **options):
+    """Builds the cache key of a representation of file
+
+    Args:
+        file (str): tree file
+        kind (str): name of the representation (e.g. "compact", "splits")
+        **options: parse options the representation depends on
+
+    Returns:
+        key (str): cache key
+    """
+    options = json.dumps(options, sort_keys=True, default=str)
+    options = hashlib.blake2b(options.encode(), digest_size=8).hexdigest()
+    return f"{kind}-{file_hash(file)}-{options}"
+
+
+def load(key):
+    """Loads a cache entry
+
+    Args:
+        key (str): cache key returned by cache_key
+
+    Returns:
+        arrays (dict): name -> read-only memory-mapped array, or None if the entry is missing
+    """
+    directory = cache_dir()
+    if directory is None or not os.path.isdir(os.path.join(directory, key)):
+        return None
+    entry = os.path.join(directory, key)
+    try:
+        return {
+            os.path.splitext(name)[0]: np.load(os.path.join(entry, name), mmap_mode="r")
+            for name in os.listdir(entry)
+            if name.endswith(".npy")
+        }
+    except (OSError, ValueError):
+        return None
+
+
+def store(key, arrays):
+    """Stores a cache entry; failures (e.g. read-only cache) are ignored
+
+    Args:
+        key (str): cache key returned by cache_key
+        arrays (dict): name -> numpy array
+    """
+    directory = cache_dir()
+    if directory is None:
+        return
+    # the entry is written aside and renamed, so that readers never see it partially
+    staging = os.path.join(directory, f".{key}-{uuid.uuid4()}")
+    try:
+        os.makedirs(staging)
+        for name, array in arrays.items():
+            np.save(os.path.join(staging, name + ".npy"), np.asarray(array))
+        os.replace(staging, os.path.join(directory, key))
+    except OSError:
+        pass
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def clear():
+    """Removes every entry of the cache directory"""
+    directory = cache_dir()
+    if directory is not None:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,176 @@
+__author__ = "Andrea Rubbi"
+""" index gives random access to the trees of a file storing one newick string per line.
+	The file is memory mapped and the byte offset of the start of every non-empty
+	line is stored in a uint64 array, which is built once with numpy and persisted
+	in the cache directory (see cache), keyed by the hash of the file. Counting the
+	trees is then O(1) and any tree, slice or selection of trees is read directly
+	from the mapped file. As in reader, lines holding only whitespace are skipped.
+	CollectionIndex chains the indexes of several files, as if they were concatenated."""
+
+import mmap
+import os
+
+import numpy as np
+
+try:
+    from . import cache
+except ImportError:
+    import cache
+
+# bytes stripped from the lines, as by bytes.strip
+WHITESPACE = np.frombuffer(b" \t\n\r\x0b\x0c", dtype=np.uint8)
+
+# bytes scanned at once while building the index
+CHUNK_SIZE = 1 << 26
+
+
+def line_offsets(buffer, chunk_size=CHUNK_SIZE):
+    """Finds the byte offsets of the non-blank lines of a buffer
+
+    Args:
+        buffer (mmap.mmap or bytes): content of the tree file
+        chunk_size (int, optional): bytes scanned at once. Defaults to 64 MB.
+
+    Returns:
+        offsets (np.array): uint64 offsets of the first byte of every non-blank line
+    """
+    size = len(buffer)
+    data = np.frombuffer(buffer, dtype=np.uint8) if size else np.zeros(0, np.uint8)
+    newlines = [
+        np.flatnonzero(data[start : start + chunk_size] == 10).astype(np.uint64) + start
+        for start in range(0, size, chunk_size)
+    ]
+    ends = np.concatenate(newlines + [np.array([size], dtype=np.uint64)])
+    starts = np.concatenate([np.zeros(1, dtype=np.uint64), ends[:-1] + 1])
+    # lines starting or ending with a non-whitespace byte hold a tree;
+    # the (rare) others are stripped one by one, like in reader
+    lengths = ends.astype(np.int64) - starts.astype(np.int64)
+    filled = np.flatnonzero(lengths > 0)
+    first = data[starts[filled].astype(np.int64)]
+    last = data[ends[filled].astype(np.int64) - 1]
+    blank = np.isin(first, WHITESPACE) & np.isin(last, WHITESPACE)
+    for line in filled[blank]:
+        lengths[line] = len(bytes(buffer[int(starts[line]) : int(ends[line])]).strip())
+    del data
+    return starts[lengths > 0]
+
+
+class TreeIndex:
+    """Random access to the trees of a file through a persisted index of line offsets"""
+
+    def __init__(self, file, persist=True):
+        """Loads the index of file, building (and persisting) it if missing
+
+        Args:
+            file (str): file containing one tree in newick format per line
+            persist (bool, optional): store the index in the cache directory. Defaults to True.
+        """
+        self.file = file
+        self._map = None
+
+        key = cache.cache_key(file, "index") if persist else None
+        stored = cache.load(key) if persist else None
+        if stored is not None and "offsets" in stored:
+            self.offsets = stored["offsets"]
+        else:
+            self.offsets = (
+                line_offsets(self.buffer)
+                if os.path.getsize(file)
+                else np.zeros(0, np.uint64)
+            )
+            if persist:
+                cache.store(key, {"offsets": self.offsets})
+
+    @property
+    def buffer(self):
+        """read-only memory map of the file, opened on first use"""
+        if self._map is None:
+            with open(self.file, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                f.close()
+        return self._map
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def tree(self, i):
+        """Reads the i-th tree
+
+        Args:
+            i (int): index of the tree
+
+        Returns:
+            tree (str): newick string
+        """
+        start = int(self.offsets[i])
+        end = self.buffer.find(b"\n", start)
+        return self.buffer[start : end if end >= 0 else len(self.buffer)].strip().decode()
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.tree(key)
+        if isinstance(key, slice):
+            key = range(*key.indices(len(self)))
+        return [self.tree(i) for i in key]
+
+    def __iter__(self):
+        return (self.tree(i) for i in range(len(self)))
+
+    def batches(self, batch_size):
+        """Yields consecutive slices of trees, e.g. for block-wise distance jobs
+
+        Args:
+            batch_size (int): number of trees per slice
+
+        Yields:
+            (start, trees) (tuple): index of the first tree and list of newick strings
+        """
+        for start in range(0, len(self), batch_size):
+            yield start, self[start : start + batch_size]
+
+    def close(self):
+        """Closes the memory map (it is reopened if the index is accessed again)"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_map"] = None
+        return state
+
+
+class CollectionIndex(TreeIndex):
+    """Random access to the trees of several files, as if they were concatenated"""
+
+    def __init__(self, indexes):
+        """Chains the indexes of the files, without reading or concatenating them
+
+        Args:
+            indexes (list): TreeIndex of every file, in order
+        """
+        self.file = None
+        self._map = None
+        self.indexes = list(indexes)
+        self.starts = np.cumsum([0] + [len(tree_index) for tree_index in self.indexes])
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def tree(self, i):
+        """Reads the i-th tree of the concatenated files
+
+        Args:
+            i (int): index of the tree
+
+        Returns:
+            tree (str): newick string
+        """
+        i = range(len(self))[i]
+        k = int(np.searchsorted(self.starts, i, side="right")) - 1
+        return self.indexes[k].tree(i - int(self.starts[k]))
+
+    def close(self):
+        """Closes the memory maps of every file"""
+        for tree_index in self.indexes:
+            tree_index.close()
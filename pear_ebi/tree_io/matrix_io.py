@@ -0,0 +1,61 @@
+__author__ = "Andrea Rubbi"
+""" matrix_io writes and reads distance matrices. The format is chosen from the
+	extension of the file: .npy (default) stores the binary array, which is read
+	back as a lazy, read-only memory map, while .csv keeps the plain-text export
+	(one row per line, no header nor index) for use in other tools.
+	Condensed matrices are stored as their 1D upper triangle in .npy files."""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    from ..calculate_distances.condensed import CondensedDistanceMatrix
+except ImportError:
+    from calculate_distances.condensed import CondensedDistanceMatrix
+
+# supported extensions
+FORMATS = (".npy", ".csv")
+
+
+def save_matrix(distance_matrix, output_file):
+    """Writes a distance matrix, as .npy unless output_file ends with .csv
+
+    Args:
+        distance_matrix (np.array, pandas.DataFrame or CondensedDistanceMatrix): distance matrix
+        output_file (str): output file
+    """
+    if os.path.splitext(output_file)[1].lower() == ".csv":
+        pd.DataFrame(np.asarray(distance_matrix)).to_csv(
+            output_file, header=False, index=False
+        )
+    else:
+        if isinstance(distance_matrix, CondensedDistanceMatrix):
+            distance_matrix = distance_matrix.condensed
+        # np.save appends .npy to other names: write through a file object instead
+        with open(output_file, "wb") as f:
+            np.save(f, np.asarray(distance_matrix))
+            f.close()
+
+
+def load_matrix(file, mmap=True):
+    """Reads a distance matrix written by save_matrix (or any headerless csv)
+
+    Args:
+        file (str): distance matrix file
+        mmap (bool, optional): memory map .npy files instead of reading them. Defaults to True.
+
+    Returns:
+        distance_matrix (np.array or CondensedDistanceMatrix): distance matrix,
+            backed by a read-only np.memmap for mapped .npy files
+    """
+    with open(file, "rb") as f:
+        binary = f.read(6) == b"\x93NUMPY"
+        f.close()
+    if binary:
+        distance_matrix = np.load(file, mmap_mode="r" if mmap else None)
+        if distance_matrix.ndim == 1:
+            return CondensedDistanceMatrix(distance_matrix)
+        return distance_matrix
+    return pd.read_csv(file, header=None, index_col=None).values
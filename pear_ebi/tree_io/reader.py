@@ -0,0 +1,95 @@
+__author__ = "Andrea Rubbi"
+""" reader streams sets of phylogenetic trees stored one newick string per line.
+	Files are read lazily, in batches of configurable size, so that tree files
+	larger than the available memory can be consumed by the distance engines
+	without being loaded at once. Empty lines are skipped, so that the i-th tree
+	is the i-th non-empty line of the file."""
+
+
+# default number of trees per batch
+BATCH_SIZE = 1000
+
+
+def stream_trees(file, batch_size=BATCH_SIZE, parse=None, offsets=False):
+    """Yields the trees in file lazily, in batches
+
+    Args:
+        file (str): file containing one tree in newick format per line
+        batch_size (int, optional): number of trees per batch. Defaults to 1000.
+        parse (callable, optional): function applied to each batch of newick strings,
+            e.g. maple_RF.readNewick. Defaults to None (newick strings are yielded).
+        offsets (bool, optional): also yield the byte offset of each tree in file. Defaults to False.
+
+    Yields:
+        batch (list): newick strings or parsed trees; (offsets, batch) if offsets is True
+    """
+    batch, batch_offsets = list(), list()
+    with open(file, "rb") as f:
+        position = 0
+        for line in f:
+            start, position = position, position + len(line)
+            tree = line.strip()
+            if not tree:
+                continue
+            batch.append(tree.decode())
+            batch_offsets.append(start)
+            if len(batch) == batch_size:
+                batch = parse(batch) if parse is not None else batch
+                yield (batch_offsets, batch) if offsets else batch
+                batch, batch_offsets = list(), list()
+        f.close()
+
+    if batch:
+        batch = parse(batch) if parse is not None else batch
+        yield (batch_offsets, batch) if offsets else batch
+
+
+def iter_trees(file, parse=None, batch_size=BATCH_SIZE):
+    """Yields the trees in file lazily, one at a time
+
+    Args:
+        file (str): file containing one tree in newick format per line
+        parse (callable, optional): function applied to each batch of newick strings. Defaults to None.
+        batch_size (int, optional): number of trees read (and parsed) at once. Defaults to 1000.
+
+    Yields:
+        tree: newick string or parsed tree
+    """
+    for batch in stream_trees(file, batch_size=batch_size, parse=parse):
+        yield from batch
+
+
+def select_trees(file, idxs, batch_size=BATCH_SIZE):
+    """Returns the trees at the given indexes, streaming through file once
+
+    Args:
+        file (str): file containing one tree in newick format per line
+        idxs (list): indexes of the trees to select
+        batch_size (int, optional): number of trees read at once. Defaults to 1000.
+
+    Returns:
+        trees (list): newick strings of the selected trees, in the order of idxs
+    """
+    wanted = set(idxs)
+    selected = dict()
+    for i, tree in enumerate(iter_trees(file, batch_size=batch_size)):
+        if i in wanted:
+            selected[i] = tree
+            if len(selected) == len(wanted):
+                break
+    return [selected[i] for i in idxs]
+
+
+def count_trees(file):
+    """Counts the trees (non-empty lines) in file, streaming through it
+
+    Args:
+        file (str): file containing one tree in newick format per line
+
+    Returns:
+        n_trees (int): number of trees
+    """
+    with open(file, "rb") as f:
+        n_trees = sum(1 for line in f if line.strip())
+        f.close()
+    return n_trees
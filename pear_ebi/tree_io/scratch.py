@@ -0,0 +1,43 @@
+__author__ = "Andrea Rubbi"
+""" scratch provides the temporary working directories of PEAR. Every operation
+	needing intermediate files gets a directory of its own, with a unique name,
+	removed when the operation ends: concurrent analyses started from the same
+	directory never share files. Scratch directories are created under the
+	PEAR_SCRATCH_DIR environment variable (e.g. a local SSD or tmpfs) and
+	default to the system temporary directory."""
+
+import contextlib
+import os
+import shutil
+import tempfile
+
+# environment variable pointing to the root of the scratch directories
+SCRATCH_DIR_ENV = "PEAR_SCRATCH_DIR"
+
+
+def scratch_root():
+    """Returns the directory in which scratch directories are created
+
+    Returns:
+        directory (str): PEAR_SCRATCH_DIR if set, the system temporary directory otherwise
+    """
+    directory = os.environ.get(SCRATCH_DIR_ENV) or tempfile.gettempdir()
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+@contextlib.contextmanager
+def scratch_dir(prefix="pear_"):
+    """Creates a unique scratch directory, removed with its content on exit
+
+    Args:
+        prefix (str, optional): prefix of the directory name. Defaults to "pear_".
+
+    Yields:
+        directory (str): path of the scratch directory
+    """
+    directory = tempfile.mkdtemp(prefix=prefix, dir=scratch_root())
+    try:
+        yield directory
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
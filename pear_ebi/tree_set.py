@@ -57,11 +57,23 @@ from scipy.sparse import SparseEfficiencyWarning
 
 # importing other modules
 # try:
-from .calculate_distances import hashrf, maple_RF, tqdist
+from .calculate_distances import (
+    approx_RF,
+    bitset_RF,
+    condensed,
+    dedup,
+    hashrf,
+    knn,
+    maple_RF,
+    tiled,
+    tqdist,
+)
+from .calculate_distances.condensed import CondensedDistanceMatrix
 from .embeddings import Isomap_e, LLE_e, PCA_e, tSNE_e
 from .embeddings.graph import graph
 from .interactive_mode import interactive
 from .subsample import subsample
+from .tree_io import cache, index, matrix_io, reader, scratch
 
 # except:
 #    sys.exit("Error")
@@ -93,6 +105,12 @@ class tree_set:
         self.file = file
         self.output_file = output_file
         self.distance_matrix = distance_matrix
+        self.distance_matrices = dict()
+        self.topologies = None
+        self.distance_method = None
+        self.distance_metric = None
+        self.knn = None
+        self.landmarks = None
         self.metadata = metadata
         self.embedding_pca2D = None
         self.embedding_tsne2D = None
@@ -100,34 +118,29 @@ class tree_set:
         self.embedding_tsne3D = None
 
         if self.output_file == None:
-            self.output_file = "./{file}_distance_matrix.csv".format(
+            self.output_file = "./{file}_distance_matrix.npy".format(
                 file=os.path.splitext(os.path.basename(self.file))[0]
             )
 
         self.size = int(f"{os.path.getsize(file)/(1<<30):,.0f}")
         # if self.size > 3: sys.exit(f'File is too large: {self.size} GB')
 
-        try:
-            self.n_trees = int(
-                subprocess.check_output(["wc", "-l", self.file]).decode().split(" ")[0]
-            )
-        except:
-            with open(file, "r") as f:
-                self.n_trees = len(f.readlines())
-                f.close()
+        # offsets of the trees in file: O(1) counting and random access
+        self.index = index.TreeIndex(file)
+        self.n_trees = len(self.index)
 
         if type(self.distance_matrix) != type(None):
             try:
-                self.distance_matrix = pd.read_csv(
-                    self.distance_matrix, header=None, index_col=None
-                ).values
+                self.distance_matrix = CondensedDistanceMatrix.from_matrix(
+                    matrix_io.load_matrix(self.distance_matrix)
+                )
                 #    header=0,
                 #    index_col=0,
                 #    dtype=np.float32,
                 # self.distance_matrix.columns = list(range(self.distance_matrix.shape[1]))
             except:
                 sys.exit(
-                    "There's an error with the Distance Matrix file - please check the correct location and name of the .csv file"
+                    "There's an error with the Distance Matrix file - please check the correct location and name of the .npy or .csv file"
                 )
 
         if type(self.metadata) != type(None):
@@ -160,35 +173,212 @@ class tree_set:
         return f"─────────────────────────────\n Tree set containing {self.n_trees} trees;\n File: {self.file};\n Distance matrix: {computed}.\n───────────────────────────── \n"
 
     # ─── CALCULATE DISTANCES ───────────────────────────────────────────────────
-    def calculate_distances(self, method):
+    def calculate_distances(
+        self,
+        method,
+        metrics=None,
+        deduplicate=None,
+        tile_size=None,
+        signature_length=None,
+    ):
         """Computes tree_set distance matrix with method of choice
 
         Args:
             method (str): method/algorithm used to compute distance matrix
+            metrics (list, optional): with smart_RF, metrics (RF, nRF, RFL, KF) collected in a single pass
+                and stored in self.distance_matrices; the first one becomes the distance matrix. Defaults to None.
+            deduplicate (bool, optional): compute topological distances among unique topologies only
+                and expand them to all the trees; self.topologies maps every tree to its topology.
+                Defaults to None (tqdist methods only, see dedup.OPT_IN_METHODS).
+            tile_size (int, optional): with smart_RF, tqdist_quartet and tqdist_triplet, compute the matrix
+                out of core in tiles of tile_size trees, resuming an interrupted run. Defaults to None.
+            signature_length (int, optional): with approx_RF, length of the MinHash signatures
+                trading accuracy for speed. Defaults to None (approx_RF.SIGNATURE_LENGTH).
         """
         methods = {
             "hashrf_RF": hashrf.hashrf,
             "hashrf_wRF": hashrf.hashrf_weighted,
             "smart_RF": maple_RF.calculate_distance_matrix,
+            "bitset_RF": bitset_RF.calculate_distance_matrix,
+            "approx_RF": approx_RF.calculate_distance_matrix,
             "tqdist_quartet": tqdist.quartet,
             "tqdist_triplet": tqdist.triplet,
             "None": None,
         }
 
         with self.console.status("[bold green]Calculating distances...") as status:
-            self.distance_matrix = methods[method](
-                self.file, self.n_trees, self.output_file
+            self.compute_distance_matrix(
+                methods[method],
+                method,
+                metrics,
+                deduplicate,
+                tile_size,
+                signature_length,
             )
         print(f"[bold blue]{method} | Done!")
 
+    def compute_distance_matrix(
+        self,
+        function,
+        method,
+        metrics=None,
+        deduplicate=None,
+        tile_size=None,
+        signature_length=None,
+        file=None,
+    ):
+        """Runs a distance method on self.file, deduplicating topologies if required
+
+        Args:
+            function (callable): distance method with signature (file, n_trees, output_file)
+            method (str): name of the method
+            metrics (list, optional): smart_RF metrics. Defaults to None.
+            deduplicate (bool, optional): compute distances among unique topologies only.
+                Defaults to None (see dedup.use_deduplication).
+            tile_size (int, optional): compute the matrix in resumable tiles (see calculate_distances.tiled);
+                tiles are computed on the whole set, without deduplication. Defaults to None.
+            signature_length (int, optional): approx_RF signature length. Defaults to None.
+            file (str, optional): file holding the trees, e.g. the concatenated sets of a collection.
+                Defaults to None (self.file).
+
+        Raises:
+            ValueError: tile_size is given with a method (or metrics) that cannot be computed in tiles
+        """
+        file = self.file if file is None else file
+        kwargs = dict()
+        if metrics is not None and method == "smart_RF":
+            kwargs["metrics"] = list(metrics)
+        if signature_length is not None and method == "approx_RF":
+            kwargs["signature_length"] = signature_length
+
+        if tile_size is not None and (method not in tiled.TILE_METHODS or kwargs):
+            raise ValueError(
+                f"tile_size can be used with {', '.join(tiled.TILE_METHODS)} without metrics, not with {method}"
+                + (f" and {', '.join(kwargs)}" if kwargs else "")
+            )
+        if tile_size is not None:
+            distances = tiled.calculate_distance_matrix(
+                file,
+                self.n_trees,
+                self.output_file,
+                method=method,
+                tile_size=tile_size,
+            )
+            self.topologies = None
+        elif dedup.use_deduplication(method, deduplicate) and all(
+            metric in dedup.TOPOLOGY_METRICS for metric in kwargs.get("metrics", [])
+        ):
+            rooted, minimumBLen = dedup.TOPOLOGY_OPTIONS[method]
+            distances, self.topologies = dedup.calculate_distance_matrix(
+                function,
+                file,
+                self.n_trees,
+                self.output_file,
+                rooted=rooted,
+                minimumBLen=minimumBLen,
+                **kwargs,
+            )
+        else:
+            distances = function(file, self.n_trees, self.output_file, **kwargs)
+            self.topologies = None
+
+        # distances are held as condensed upper triangles with a compact dtype;
+        # distance_metric is the metric of self.distance_matrix, None for the default of the method
+        self.distance_method = method
+        self.distance_metric = kwargs["metrics"][0] if "metrics" in kwargs else None
+        if "metrics" in kwargs:
+            self.distance_matrices = {
+                metric: CondensedDistanceMatrix.from_matrix(distance_matrix)
+                for metric, distance_matrix in distances.items()
+            }
+            self.distance_matrix = self.distance_matrices[kwargs["metrics"][0]]
+        else:
+            self.distance_matrix = CondensedDistanceMatrix.from_matrix(distances)
+
+    # ─── DISTANCES TO REFERENCES ───────────────────────────────────────────────
+    def distances_to(self, reference_trees, metric="RF"):
+        """Computes the distances between every tree of the set and a few reference trees,
+        streaming through the set once (see maple_RF.distances_to_references)
+
+        Args:
+            reference_trees (tree_set, str or list): tree_set, file or newick string of the
+                reference trees, or list of newick strings
+            metric (str or list, optional): metric or list of metrics among RF, nRF, RFL and KF. Defaults to "RF".
+
+        Returns:
+            distances (np.array): n_trees x n_references distances;
+                dictionary metric -> distances if a list of metrics is given
+        """
+        if isinstance(reference_trees, tree_set):
+            reference_trees = reference_trees.index[:]
+        elif isinstance(reference_trees, str) and os.path.isfile(reference_trees):
+            reference_trees = index.TreeIndex(reference_trees, persist=False)[:]
+        elif isinstance(reference_trees, str):
+            reference_trees = [reference_trees]
+        distances = maple_RF.distances_to_references(
+            iter(self.index), list(reference_trees), metrics=metric
+        )
+        if isinstance(metric, str):
+            return distances
+        return {name: distances[k] for k, name in enumerate(metric)}
+
+    # ─── NEAREST NEIGHBOURS ────────────────────────────────────────────────────
+    def knn_graph(self, k=10, metric="RF", signature_length=None, bands=None):
+        """Finds the k nearest trees of every tree without computing the distance matrix:
+        candidates are generated by LSH of split-set signatures and verified with exact distances
+        (see calculate_distances.knn). The graph is stored in self.knn
+
+        Args:
+            k (int, optional): number of neighbours. Defaults to 10.
+            metric (str, optional): distance, only RF is supported. Defaults to "RF".
+            signature_length (int, optional): length of the MinHash signatures. Defaults to None (knn default).
+            bands (int, optional): number of LSH bands. Defaults to None (knn default).
+
+        Returns:
+            graph (scipy.sparse.csr_matrix): n_trees x n_trees sparse graph of the RF distances
+                between every tree and its k nearest trees
+        """
+        if metric != "RF":
+            sys.exit(f"Nearest neighbours can be computed with RF, not {metric}")
+        options = dict()
+        if signature_length is not None:
+            options["signature_length"] = signature_length
+        if bands is not None:
+            options["bands"] = bands
+        incidence, taxa = bitset_RF.file_split_incidence(self.file, self.n_trees)
+        self.knn = knn.knn_graph(incidence, k, **options)
+        return self.knn
+
+    # ─── EXPORT DISTANCES ──────────────────────────────────────────────────────
+    def export_distance_matrix(self, file=None):
+        """Exports the distance matrix (and the matrices of other metrics) as text
+
+        Args:
+            file (str, optional): output .csv file. Defaults to output_file with the .csv extension.
+        """
+        if file is None:
+            file = os.path.splitext(self.output_file)[0] + ".csv"
+        matrix_io.save_matrix(self.distance_matrix, file)
+        root, ext = os.path.splitext(file)
+        for metric, distance_matrix in list(self.distance_matrices.items())[1:]:
+            matrix_io.save_matrix(distance_matrix, f"{root}_{metric}{ext}")
+
     # ─── EMBED ─────────────────────────────────────────────────────────────────
-    def embed(self, method, dimensions, quality=False, report=False):
+    def embed(
+        self, method, dimensions, quality=False, report=False, knn=None, landmarks=None
+    ):
         """Compute embedding with n-dimensions and method of choice
 
         Args:
             method (str): method of choice to embed data
             dimensions (_type_): number of dimensions/components
             quality (bool, optional): returns quality report and self.emb_quality. Defaults to False.
+            knn (int, optional): with tsne and isomap, embed the sparse graph of the knn nearest trees
+                (see knn_graph) instead of the distance matrix, which is not computed;
+                quality and report are not available in this case. Defaults to None.
+            landmarks (int, optional): with pca, landmark MDS computing only the distances to
+                landmarks trees (see PCA_e.landmark_pca) instead of the distance matrix;
+                quality and report are not available in this case. Defaults to None.
         """
         methods = {
             "pca": PCA_e.pca,
@@ -198,19 +388,49 @@ class tree_set:
             "None": None,
         }
 
-        if type(self.distance_matrix) == type(None):
-            self.calculate_distances("hashrf_RF")
+        sparse_input = (knn is not None and method in ("tsne", "isomap")) or (
+            landmarks is not None and method == "pca"
+        )
+        if sparse_input and (quality or report):
+            warnings.warn("quality and report need the distance matrix: not computed")
+            quality, report = False, False
+        if knn is not None and method in ("tsne", "isomap"):
+            distances = self.knn_graph(knn)
+        elif landmarks is not None and method == "pca":
+            distances = None
+        else:
+            if type(self.distance_matrix) == type(None):
+                self.calculate_distances("hashrf_RF")
+            # pca builds the square matrix it needs from the condensed one
+            distances = (
+                self.distance_matrix
+                if method == "pca"
+                else np.asarray(self.distance_matrix, dtype=np.float64)
+            )
 
         dim = dimensions if dimensions > 2 else 3
+        # named after the trees, next to the distance matrix
+        embedding_file = os.path.join(
+            os.path.dirname(self.output_file),
+            "{file}_{method}_Embedding.csv".format(
+                file=os.path.splitext(os.path.basename(self.file))[0], method=method
+            ),
+        )
 
         with self.console.status("[bold green]Embedding distances...") as status:
-            embedding = methods[method](
-                self.distance_matrix,
-                dim,
-                self.metadata,
-                quality=quality if not report else True,
-                report=report,
-            )
+            if distances is None:
+                embedding, self.landmarks = PCA_e.landmark_pca(
+                    self.index, dim, n_landmarks=landmarks, output_file=embedding_file
+                )
+            else:
+                embedding = methods[method](
+                    distances,
+                    dim,
+                    self.metadata,
+                    quality=quality if not report else True,
+                    report=report,
+                    output_file=embedding_file,
+                )
         print(f"[bold blue]{method} | Done!")
 
         if quality:
@@ -492,10 +712,12 @@ class tree_set:
         Returns:
             subset plots: 2D and 3D embedding plots of subset
         """
+        # trees are read through the index: collections chain the indexes of their sets
         console = Console()
         with console.status("[bold blue]Extracting subsample...") as status:
             if method == "syst":
-                if shutil.which("pypy3") is not None:
+                # the pypy3 subprocess reads a single file, which collections do not have
+                if shutil.which("pypy3") is not None and self.index.file is not None:
                     command = [
                         "pypy3",
                         f"{current}/subsample/subsample.py",
@@ -508,39 +730,33 @@ class tree_set:
                     )
                     subsample_trees, idxs = eval(res[3]), eval(res[4])
                 else:
-                    console.log(
-                        "[bold red]Could not find pypy3 on your sytem PATH - using python3..."
-                    )
+                    if shutil.which("pypy3") is None:
+                        console.log(
+                            "[bold red]Could not find pypy3 on your sytem PATH - using python3..."
+                        )
                     subsample_trees, idxs = subsample.subsample(
-                        self.file, self.n_trees, n_required, subp=False
+                        self.file, self.n_trees, n_required, subp=False, index=self.index
                     )
 
             else:
-                with open(self.file, "r") as f:
-                    trees = list(enumerate(f.readlines()))
-                    f.close()
-
                 if method == "random":
-                    selection = random.sample(trees, n_required)
-                    subsample_trees, idxs = list(
-                        map(lambda elem: elem[1], selection)
-                    ), list(map(lambda elem: elem[0], selection))
+                    idxs = random.sample(range(self.n_trees), n_required)
                 elif method == "sequence":
                     step = self.metadata.shape[0] // n_required
                     idxs = [step * (i + 1) - 1 for i in range(n_required)]
-                    subsample_trees = [trees[i][1] for i in idxs]
-
                 else:
                     sys.exit(f"Method {method} not available for subsampling")
+                subsample_trees = self.index[idxs]
 
-            file_sub = f"SUBSAMPLE"
-            with open(file_sub, "w") as f:
-                for i in subsample_trees:
-                    f.write(i)
-                f.close()
-            # print(len(subsample_trees), len(idxs))
             status.update("[bold green]Calculating distances...")
-            dM = hashrf.hashrf(file_sub, n_required, file_sub + "_distances.csv")
+            with scratch.scratch_dir("pear_subset_") as directory:
+                file_sub = os.path.join(directory, "SUBSAMPLE")
+                with open(file_sub, "w") as f:
+                    for i in subsample_trees:
+                        f.write(i.strip() + "\n")
+                    f.close()
+                # print(len(subsample_trees), len(idxs))
+                dM = hashrf.run_hashrf(file_sub, n_required)
             components = PCA_e.pca(dM, 3)
             status.update(f"[bold blue] Done!")
             time.sleep(0.2)
@@ -583,26 +799,36 @@ class set_collection(tree_set):
         self.id = uuid.uuid4()
         self.file = file + str(self.id)
         self.distance_matrix = (
-            pd.read_csv(distance_matrix, header=None, index_col=None).values  #
+            CondensedDistanceMatrix.from_matrix(matrix_io.load_matrix(distance_matrix))  #
             if distance_matrix
             else distance_matrix
         )
+        self.distance_matrices = dict()
+        self.topologies = None
+        self.distance_method = None
+        self.distance_metric = None
+        self.knn = None
+        self.landmarks = None
+        # distance blocks between (and within) the sets of the collection, reused when it grows
+        self.blocks = dict()
+        self.index = None
         self.embedding_pca2D = None
         self.embedding_tsne2D = None
         self.embedding_pca3D = None
         self.embedding_tsne3D = None
 
         if self.file != "Set_collection_" + str(self.id) and output_file is None:
-            self.output_file = "{file}_distance_matrix.csv".format(
+            self.output_file = "{file}_distance_matrix.npy".format(
                 file=os.path.splitext(os.path.basename(self.file))[0]
             )
         elif output_file is None:
-            self.output_file = "Set_collection_distance_matrix_" + str(self.id) + ".csv"
+            self.output_file = "Set_collection_distance_matrix_" + str(self.id) + ".npy"
         else:
-            if output_file[-4:] == ".csv":
-                self.output_file = output_file[:-4] + "_" + str(self.id) + ".csv"
+            root, ext = os.path.splitext(output_file)
+            if ext.lower() in matrix_io.FORMATS:
+                self.output_file = root + "_" + str(self.id) + ext
             else:
-                self.output_file = output_file + "_" + str(self.id) + ".csv"
+                self.output_file = output_file + "_" + str(self.id) + ".npy"
 
         if isinstance(collection, tree_set):
             self.collection = [collection]
@@ -661,40 +887,235 @@ class set_collection(tree_set):
         self.metadata.reset_index(drop=True, inplace=True)
 
         self.sets = np.unique(self.metadata["SET-ID"])
+        # the trees of the collection are read from the files of its sets
+        self.index = index.CollectionIndex([set.index for set in self.collection])
 
     # ─── CALCULATE DISTANCES ───────────────────────────────────────────────────
-    def calculate_distances(self, method):
+    def calculate_distances(
+        self,
+        method,
+        metrics=None,
+        deduplicate=None,
+        tile_size=None,
+        signature_length=None,
+        incremental=True,
+    ):
         """Computes tree_set distance matrix with method of choice
 
         Args:
             method (str): method/algorithm used to compute distance matrix
+            metrics (list, optional): with smart_RF, metrics (RF, nRF, RFL, KF) collected in a single pass
+                and stored in self.distance_matrices; the first one becomes the distance matrix. Defaults to None.
+            deduplicate (bool, optional): compute topological distances among unique topologies only
+                and expand them to all the trees; self.topologies maps every tree to its topology.
+                Defaults to None (tqdist methods only, see dedup.OPT_IN_METHODS).
+            tile_size (int, optional): with smart_RF, tqdist_quartet and tqdist_triplet, compute the matrix
+                out of core in tiles of tile_size trees, resuming an interrupted run. Defaults to None.
+            signature_length (int, optional): with approx_RF, length of the MinHash signatures
+                trading accuracy for speed. Defaults to None (approx_RF.SIGNATURE_LENGTH).
+            incremental (bool, optional): with smart_RF, tqdist_quartet and tqdist_triplet, assemble the matrix
+                from per-set and cross-set blocks, computing only the blocks not available yet
+                (e.g. those of a set just added to the collection). Defaults to True.
         """
         methods = {
             "hashrf_RF": hashrf.hashrf,
             "hashrf_wRF": hashrf.hashrf_weighted,
             "smart_RF": maple_RF.calculate_distance_matrix,
+            "bitset_RF": bitset_RF.calculate_distance_matrix,
+            "approx_RF": approx_RF.calculate_distance_matrix,
             "tqdist_quartet": tqdist.quartet,
             "tqdist_triplet": tqdist.triplet,
             "None": None,
         }
 
-        if method in ("hashrf_RF", "hashrf_wRF", "tqdist_quartet", "tqdist_triplet"):
-            with open(self.file, "w") as trees:
-                for set in self.collection:
-                    with open(set.file, "r") as file:
-                        trees.write(file.read())
-                        file.close()
-                trees.close()
+        if (
+            incremental
+            and method in tiled.TILE_METHODS
+            and metrics is None
+            and tile_size is None
+            and len(self.collection) > 1
+        ):
+            with self.console.status("[bold green]Calculating distances...") as status:
+                self.assemble_blocks(methods[method], method)
+            print(f"[bold blue]{method} | Done!")
+            return
+
+        # the sets are concatenated in a scratch directory of their own
+        with self.console.status(
+            "[bold green]Calculating distances..."
+        ) as status, scratch.scratch_dir("pear_collection_") as directory:
+            file = os.path.join(directory, "trees")
+            if methods[method] is not None:
+                with open(file, "w") as trees:
+                    for set in self.collection:
+                        trees.writelines(
+                            tree + "\n" for tree in reader.iter_trees(set.file)
+                        )
+                    trees.close()
+            self.compute_distance_matrix(
+                methods[method],
+                method,
+                metrics,
+                deduplicate,
+                tile_size,
+                signature_length,
+                file=file,
+            )
 
-        with self.console.status("[bold green]Calculating distances...") as status:
-            self.distance_matrix = methods[method](
-                self.file, self.n_trees, self.output_file
+        print(f"[bold blue]{method} | Done!")
+
+    def assemble_blocks(self, function, method):
+        """Assembles the distance matrix from the distance blocks of the sets.
+        The blocks of every set come from its own distance matrix, if computed with method,
+        and the blocks between two sets are computed by tiled.TILE_METHODS;
+        blocks already in self.blocks (e.g. inherited from the collections
+        concatenated into this one) are not computed again.
+
+        Args:
+            function (callable): distance method used for the blocks of single sets
+            method (str): name of the method
+        """
+        keys = self.block_keys()
+
+        def block(a, b):
+            # blocks computed with the sets in the opposite order are transposed
+            if (method, keys[a], keys[b]) in self.blocks:
+                return self.blocks[(method, keys[a], keys[b])]
+            return np.asarray(self.blocks[(method, keys[b], keys[a])]).T
+
+        computed, reused = 0, 0
+        for a, set_a in enumerate(self.collection):
+            for b in range(a, len(self.collection)):
+                block_ab = (method, keys[a], keys[b])
+                if block_ab in self.blocks or (method, keys[b], keys[a]) in self.blocks:
+                    reused += 1
+                    continue
+                computed += 1
+                if a == b:
+                    # a matrix computed with metrics holds the first of them:
+                    # only RF, the metric of the blocks, can be reused
+                    if set_a.distance_method != method or set_a.distance_metric not in (
+                        None,
+                        "RF",
+                    ):
+                        set_a.compute_distance_matrix(function, method)
+                    self.blocks[block_ab] = set_a.distance_matrix
+                else:
+                    self.blocks[block_ab] = self.distance_between(
+                        set_a, self.collection[b], method
+                    )
+        print(f"Distance blocks: {computed} computed, {reused} reused")
+
+        # the upper triangle of row i of set a spans its own block and the blocks of the following sets
+        rows = (
+            np.concatenate(
+                [block(a, a).row(i)[i + 1 :]]
+                + [block(a, b)[i] for b in range(a + 1, len(self.collection))]
             )
+            for a, set_a in enumerate(self.collection)
+            for i in range(set_a.n_trees)
+        )
+        distance_matrix = CondensedDistanceMatrix.from_rows(rows, self.n_trees)
+        self.distance_matrix = distance_matrix.astype(
+            condensed.compact_dtype(distance_matrix.condensed)
+        )
+        self.distance_method, self.distance_metric, self.topologies = method, None, None
+        matrix_io.save_matrix(self.distance_matrix, self.output_file)
 
-        if method in ("hashrf_RF", "hashrf_wRF", "tqdist_quartet", "tqdist_triplet"):
-            hashrf.bash_command(f"rm {self.file}")
+    @staticmethod
+    def block_key(set):
+        """Identifies the trees of a set in the distance blocks
 
-        print(f"[bold blue]{method} | Done!")
+        Args:
+            set (tree_set): set of trees
+
+        Returns:
+            key (tuple): absolute path and content hash of the file of set;
+                the hash is computed once per file (see cache.file_hash), then only stat is called
+        """
+        return os.path.abspath(set.file), cache.file_hash(set.file)
+
+    def block_keys(self):
+        """Returns the block keys of the sets of the collection
+
+        Raises:
+            ValueError: two sets of the collection have the same key (e.g. the same file)
+
+        Returns:
+            keys (list): block key of every set
+        """
+        keys = [self.block_key(set) for set in self.collection]
+        if len(set(keys)) < len(keys):
+            duplicates = sorted({key[0] for key in keys if keys.count(key) > 1})
+            raise ValueError(
+                f"The collection holds the same trees more than once: {', '.join(duplicates)}"
+            )
+        return keys
+
+    def distance_between(self, set_a, set_b, method="smart_RF", tile_size=None):
+        """Computes the rectangular block of distances between two sets of the collection,
+        reading both files tile by tile instead of building the matrix of the whole collection.
+        Blocks are kept in self.blocks and reused by calculate_distances
+
+        Args:
+            set_a (tree_set, str or int): set of the collection, its SET-ID or its position
+            set_b (tree_set, str or int): set of the collection, its SET-ID or its position
+            method (str, optional): one of smart_RF, tqdist_quartet, tqdist_triplet. Defaults to "smart_RF".
+            tile_size (int, optional): number of trees per side of a tile. Defaults to tiled.TILE_SIZE.
+
+        Returns:
+            distances (np.array): set_a.n_trees x set_b.n_trees distance matrix
+        """
+        if method not in tiled.TILE_METHODS:
+            sys.exit(
+                f"Distances between sets can be computed with {', '.join(tiled.TILE_METHODS)}, not {method}"
+            )
+        names = [
+            os.path.splitext(os.path.basename(set.file))[0] for set in self.collection
+        ]
+
+        def member(set):
+            if isinstance(set, tree_set):
+                return set
+            if isinstance(set, str) and set in names:
+                return self.collection[names.index(set)]
+            if isinstance(set, int) and -len(names) <= set < len(names):
+                return self.collection[set]
+            sys.exit(f"{set} is not a set of the collection")
+
+        set_a, set_b = member(set_a), member(set_b)
+        key_a, key_b = self.block_key(set_a), self.block_key(set_b)
+        if (method, key_a, key_b) in self.blocks:
+            return np.asarray(self.blocks[(method, key_a, key_b)])
+        if (method, key_b, key_a) in self.blocks:
+            return np.asarray(self.blocks[(method, key_b, key_a)]).T
+
+        distances = tiled.rectangular_distance_matrix(
+            set_a.index if set_a.index is not None else set_a.file,
+            set_b.index if set_b.index is not None else set_b.file,
+            method,
+            tile_size if tile_size is not None else tiled.TILE_SIZE,
+        )
+        if key_a != key_b:
+            self.blocks[(method, key_a, key_b)] = distances
+        return distances
+
+    def extended(self, collection, other=None):
+        """Builds a set_collection inheriting the distance blocks of self (and other),
+        so that only the blocks involving new sets are computed
+
+        Args:
+            collection (list): list of tree_sets
+            other (set_collection, optional): collection concatenated to self. Defaults to None.
+
+        Returns:
+            set_collection: concatenated set_collection
+        """
+        extended = set_collection(collection)
+        extended.blocks.update(self.blocks)
+        if isinstance(other, set_collection):
+            extended.blocks.update(other.blocks)
+        return extended
 
     # the result of addition between two collections
     # is the concatenation of the two collections
@@ -708,9 +1129,9 @@ class set_collection(tree_set):
             set_collection: concatenated set_collection
         """
         if isinstance(other, set_collection):
-            return set_collection(self.collection + other.collection)
+            return self.extended(self.collection + other.collection, other)
         elif isinstance(other, tree_set):
-            return set_collection(self.collection + [other])
+            return self.extended(self.collection + [other])
         else:
             remove = list()
             for i, element in enumerate(other):
@@ -740,7 +1161,7 @@ class set_collection(tree_set):
             for i in remove[::-1]:
                 other.pop(i)
 
-            return set_collection(self.collection + other)
+            return self.extended(self.collection + other)
 
     def __str__(self):
         computed = "not computed"
@@ -768,9 +1189,9 @@ class set_collection(tree_set):
             set_collection: concatenated set_collection
         """
         if isinstance(other, set_collection):
-            return set_collection(self.collection + other.collection)
+            return self.extended(self.collection + other.collection, other)
         elif isinstance(other, tree_set):
-            return set_collection(self.collection + [other])
+            return self.extended(self.collection + [other])
         else:
             remove = list()
             for i, element in enumerate(other):
@@ -800,4 +1221,4 @@ class set_collection(tree_set):
             for i in remove[::-1]:
                 other.pop(i)
 
-            return set_collection(self.collection + other)
+            return self.extended(self.collection + other)
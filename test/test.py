@@ -1,10 +1,36 @@
 import os
 import sys
+import tempfile
 import unittest
+from unittest import mock
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial.distance import pdist, squareform
+from sklearn.manifold import Isomap
 
 import pear_ebi
+from pear_ebi.calculate_distances import (
+    approx_RF,
+    bitset_RF,
+    compact_tree,
+    condensed,
+    dedup,
+    hashrf,
+    knn,
+    maple_RF,
+    tiled,
+    tqdist,
+)
+from pear_ebi.embeddings import Isomap_e, PCA_e, tSNE_e
+from pear_ebi.subsample import subsample
+from pear_ebi.tree_io import cache, index, matrix_io, reader, scratch
+from pear_ebi.tree_set import set_collection, tree_set
 
 DIR = "../examples_tree_sets/beast_trees/"
+EXAMPLES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "examples_tree_sets"
+)
 
 FILE1 = "beast_run1.trees"
 FILE2 = "beast_run2.trees"
@@ -39,5 +65,640 @@ class TestPEAR(unittest.TestCase):
     pass
 
 
+class TestDistances(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(EXAMPLES, "bootstrap_mammals", "bootstrap_105")) as f:
+            self.trees = f.read().splitlines()[:30]
+        self.n_trees = len(self.trees)
+        distance_matrix = maple_RF.single_core_distances(self.trees, self.n_trees)
+        self.RF = distance_matrix + distance_matrix.transpose()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        os.environ[cache.CACHE_DIR_ENV] = self.cache_dir.name
+
+    def tearDown(self):
+        del os.environ[cache.CACHE_DIR_ENV]
+        self.cache_dir.cleanup()
+
+    def test_bitset_RF(self):
+        incidence, taxa = bitset_RF.split_incidence(self.trees)
+        self.assertEqual(incidence.shape[0], self.n_trees)
+        distance_matrix = bitset_RF.rf_from_incidence(incidence, block_size=7)
+        np.testing.assert_array_equal(distance_matrix, self.RF)
+
+    def test_metrics(self):
+        distance_matrices = maple_RF.single_core_distances(
+            self.trees, self.n_trees, metrics=["RF", "nRF", "RFL", "KF"]
+        )
+        self.assertEqual(distance_matrices.shape, (4, self.n_trees, self.n_trees))
+        np.testing.assert_array_equal(
+            distance_matrices[0] + distance_matrices[0].transpose(), self.RF
+        )
+
+    def test_parse_newick(self):
+        # parents, names and dists given by the original character by character parser
+        # on ((A:1,B:2):0.5,C:3); (quoted labels replaced by plain ones)
+        parents, names = [-1, 0, 1, 1, 0], ["", "", "A", "B", "C"]
+        dists = [0.000033, 0.5, 1.0, 2.0, 3.0]
+        cases = {
+            "comments": (
+                "((A:1[&rate=0.5],B[x]:2)[&posterior=1]:0.5,C:3);",
+                names,
+                dists,
+            ),
+            "quoted labels": (
+                "(('A (x), y:z;':1,'B''s':2):0.5,C:3);",
+                ["", "", "A (x), y:z;", "B's", "C"],
+                dists,
+            ),
+            "whitespace": ("(\n (A : 1,\tB:2) : 0.5 ,\n C:3 ) ;", names, dists),
+            "missing lengths": (
+                "((A,B):0.5,C);",
+                names,
+                [0.000033, 0.5, 0.000033, 0.000033, 0.000033],
+            ),
+        }
+        for case, (newick, expected_names, expected_dists) in cases.items():
+            with self.subTest(case):
+                parsed = maple_RF.parseNewick(newick)
+                self.assertEqual(parsed[0], parents)
+                self.assertEqual(parsed[1], expected_names)
+                np.testing.assert_allclose(parsed[2], expected_dists)
+        with self.assertWarns(UserWarning):
+            parsed = maple_RF.parseNewick("((A:-1e-3,B:2.5E+1):0.5,C:3);")
+        self.assertEqual(parsed[:2], (parents, names))
+        np.testing.assert_allclose(parsed[2], [0.000033, 0.5, 0.001, 25.0, 3.0])
+        with self.assertRaises(AssertionError):
+            maple_RF.parseNewick("((A,B),C)")
+
+    def test_parallel_distances(self):
+        metrics = ["RF", "nRF", "KF"]
+        single = maple_RF.single_core_distances(self.trees, self.n_trees, metrics=metrics)
+        parallel, report = maple_RF.parallel_distances(
+            self.trees, self.n_trees, 2, report=True, metrics=metrics
+        )
+        for k in range(len(metrics)):
+            self.assertIsInstance(parallel[k], condensed.CondensedDistanceMatrix)
+            np.testing.assert_allclose(
+                np.asarray(parallel[k]),
+                single[k] + single[k].transpose(),
+                rtol=1e-6,
+            )
+        self.assertEqual(report["comparisons"].sum(), len(parallel[0].condensed))
+        distance_matrix = maple_RF.parallel_distances(self.trees, self.n_trees, 2)
+        np.testing.assert_array_equal(distance_matrix, self.RF)
+
+    def test_triangular_schedule(self):
+        for n_trees, n_tasks in ((10, 3), (11, 4), (5, 20), (1, 2)):
+            tasks = maple_RF.triangular_schedule(n_trees, n_tasks)
+            self.assertEqual(
+                sorted(row for task in tasks for row in task), list(range(n_trees))
+            )
+            self.assertLessEqual(len(tasks), n_tasks)
+            # every pair of rows i, n-1-i costs n-1 comparisons
+            costs = [sum(n_trees - i - 1 for i in task) for task in tasks]
+            self.assertLessEqual(max(costs) - min(costs), 2 * (n_trees - 1))
+        report = maple_RF.utilisation_report(
+            [(1, 2.0, 10), (2, 1.0, 5), (1, 1.0, 5)], wall_time=4.0
+        )
+        self.assertEqual(list(report["tasks"]), [2, 1])
+        self.assertEqual(list(report["comparisons"]), [15, 5])
+        np.testing.assert_allclose(report["utilisation"], [0.75, 0.25])
+
+    def test_hashrf_output(self):
+        # stdout of HashRF on the first 5 trees of bootstrap_105
+        stdout = """
+*** Collecting the taxon labels ***
+    Number of taxa = 90
+
+*** Reading tree file and collecting bipartitions ***
+    Number of trees = 5
+
+*** Compute distance ***
+    # of unique BIDs = 407
+
+Robinson-Foulds distance (matrix format):
+0 73 85 85 82 
+73 0 87 85 85 
+85 87 0 83 85 
+85 85 83 0 85 
+82 85 85 85 0 
+
+
+    Total CPU time: 0 sec and 1267 usec.
+"""
+        lines = stdout.splitlines(keepends=True)
+        distance_matrix, messages = hashrf.parse_matrix(lines, 5)
+        self.assertEqual(distance_matrix.dtype, np.uint8)
+        np.testing.assert_array_equal(
+            distance_matrix.condensed, [73, 85, 85, 82, 87, 85, 85, 83, 85, 85]
+        )
+        self.assertEqual(messages[2], "    Number of taxa = 90\n")
+        # HashRF counts every split difference once: half of the RF of Day's algorithm
+        np.testing.assert_array_equal(2 * np.asarray(distance_matrix), self.RF[:5, :5])
+
+        self.assertIsNone(hashrf.parse_matrix(lines[:14], 5)[0])
+        lines[13] = "85 87 0 83\n"
+        with self.assertRaises(ValueError):
+            hashrf.parse_matrix(lines, 5)
+
+    def test_tqdist_binaries(self):
+        calls = list()
+
+        def all_pairs_distances(binary, trees):
+            calls.append(binary)
+            return np.zeros((len(trees), len(trees)))
+
+        def pairs_distances(binary, rows, columns, diagonal=False):
+            calls.append(binary)
+            return np.zeros((len(rows), len(columns)))
+
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(
+            tqdist, "all_pairs_distances", all_pairs_distances
+        ), mock.patch.object(tqdist, "pairs_distances", pairs_distances):
+            file = os.path.join(directory, "trees.nwk")
+            with open(file, "w") as f:
+                f.write("\n".join(self.trees))
+                f.close()
+            for kind, function in (
+                ("triplet", tqdist.triplet),
+                ("quartet", tqdist.quartet),
+            ):
+                calls.clear()
+                function(file, self.n_trees, os.path.join(directory, "distances.npy"))
+                self.assertTrue(calls)
+                self.assertTrue(all(binary.endswith(f"_{kind}_dist") for binary in calls))
+
+    @unittest.skipUnless(
+        os.access(os.path.join(tqdist.BIN_DIR, "all_pairs_quartet_dist"), os.X_OK),
+        "tqDist binaries not built",
+    )
+    def test_tqdist_blocks(self):
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(
+            tqdist, "PAIRS_PER_RUN", 7
+        ):
+            file = os.path.join(directory, "trees.nwk")
+            with open(file, "w") as f:
+                f.write("\n".join(self.trees[:23]))
+                f.close()
+            for kind in ("quartet", "triplet"):
+                single = tqdist.all_pairs_distances(
+                    f"all_pairs_{kind}_dist", self.trees[:23]
+                )
+                blocked = tqdist.all_pairs(
+                    file,
+                    23,
+                    os.path.join(directory, "distances.npy"),
+                    kind=kind,
+                    block_size=5,
+                    workers=4,
+                )
+                np.testing.assert_allclose(np.asarray(blocked), single + single.T)
+
+    def test_approx_RF(self):
+        incidence, _ = bitset_RF.split_incidence(self.trees)
+        signatures = approx_RF.minhash_signatures(incidence, 512)
+        self.assertEqual(signatures.shape, (self.n_trees, 512))
+        estimated = approx_RF.estimate_rf(signatures, np.diff(incidence.indptr))
+        exact = bitset_RF.rf_from_incidence(incidence)
+        self.assertEqual(estimated.shape, exact.shape)
+        # identical trees have identical signatures
+        np.testing.assert_array_equal(np.asarray(estimated)[np.asarray(exact) == 0], 0)
+        self.assertLess(np.abs(np.asarray(estimated) - exact).mean(), 0.1 * exact.mean())
+        error = approx_RF.sample_error(incidence, estimated)
+        self.assertLess(error["mean"], 0.1 * error["exact_mean"])
+
+    def test_knn(self):
+        incidence, _ = bitset_RF.split_incidence(self.trees + self.trees[:5])
+        graph = knn.knn_graph(incidence, 5)
+        n_trees = self.n_trees + 5
+        self.assertEqual(graph.shape, (n_trees, n_trees))
+        np.testing.assert_array_equal(graph.getnnz(axis=1), 5)
+        exact = np.asarray(bitset_RF.rf_from_incidence(incidence), dtype=np.float64)
+        rows, columns = np.repeat(np.arange(n_trees), 5), graph.indices
+        np.testing.assert_array_equal(graph.data, exact[rows, columns])
+        self.assertFalse(np.any(rows == columns))
+        # repeated trees are each other's nearest neighbour, at distance 0
+        self.assertEqual(graph[0, self.n_trees], 0)
+        self.assertIn(self.n_trees, graph.indices[: graph.indptr[1]])
+        np.fill_diagonal(exact, np.inf)
+        np.testing.assert_array_equal(
+            graph.data.reshape(n_trees, 5), np.sort(exact, axis=1)[:, :5]
+        )
+
+    def test_pcoa(self):
+        centering = np.eye(self.n_trees) - 1 / self.n_trees
+        gram = -0.5 * centering @ self.RF.astype(np.float64) ** 2 @ centering
+        matrix = condensed.CondensedDistanceMatrix.from_matrix(self.RF)
+        np.testing.assert_allclose(PCA_e.double_centre(matrix, block_size=7), gram)
+        values = np.linalg.eigvalsh(gram)[::-1]
+        components, explained = PCA_e.principal_coordinates(matrix, 3)
+        np.testing.assert_allclose((components**2).sum(axis=0), values[:3])
+        np.testing.assert_allclose(explained, values[:3] / values.sum())
+        # classical MDS preserves euclidean distances
+        points = np.random.default_rng(0).normal(size=(20, 3))
+        components, explained = PCA_e.principal_coordinates(squareform(pdist(points)), 3)
+        np.testing.assert_allclose(pdist(components), pdist(points))
+        np.testing.assert_allclose(explained.sum(), 1)
+
+    def test_isomap(self):
+        # on the graph of the k nearest points, Isomap uses all the k neighbours
+        points = np.random.default_rng(0).normal(size=(40, 3))
+        distances = squareform(pdist(points))
+        neighbours = np.argsort(distances, axis=1)[:, 1:7]
+        rows = np.repeat(np.arange(40), 6)
+        graph = sparse.csr_matrix(
+            (distances[rows, neighbours.ravel()], (rows, neighbours.ravel())),
+            shape=(40, 40),
+        )
+        np.testing.assert_allclose(
+            pdist(Isomap_e.isomap(graph, 2)),
+            pdist(Isomap(n_components=2, n_neighbors=6).fit_transform(points)),
+        )
+
+    def test_tsne(self):
+        self.assertEqual(tSNE_e.auto_perplexity(100000), 50)
+        self.assertEqual(tSNE_e.auto_perplexity(100000, 20), 6)
+        self.assertEqual(tSNE_e.auto_perplexity(600), 6)
+        matrix = condensed.CondensedDistanceMatrix.from_matrix(self.RF)
+        embedding = tSNE_e.tsne(matrix, 2, seed=1)
+        self.assertEqual(embedding.shape, (self.n_trees, 2))
+        np.testing.assert_array_equal(embedding, tSNE_e.tsne(self.RF, 2, seed=1))
+        # quality is measured on the densified distances, not on the condensed input
+        embedding, correlation, _ = tSNE_e.tsne(matrix, 2, quality=True, seed=1)
+        self.assertEqual(correlation.shape, (2, 2))
+        graph = knn.knn_graph(bitset_RF.split_incidence(self.trees)[0], 20)
+        self.assertEqual(tSNE_e.tsne(graph, 2).shape, (self.n_trees, 2))
+        with self.assertRaises(ValueError):
+            tSNE_e.tsne(graph, 2, quality=True)
+
+    def test_landmark_mds(self):
+        # with every tree as a landmark, landmark MDS is classical MDS
+        landmarks, distances = PCA_e.landmark_distances(self.trees, self.n_trees)
+        self.assertEqual(sorted(landmarks), list(range(self.n_trees)))
+        np.testing.assert_array_equal(distances, self.RF[:, landmarks])
+        components = PCA_e.landmark_mds(distances, landmarks, 3)
+        centering = np.eye(self.n_trees) - 1 / self.n_trees
+        values = np.linalg.eigvalsh(-0.5 * centering @ self.RF**2 @ centering)[::-1][:3]
+        np.testing.assert_allclose(np.sort((components**2).sum(axis=0))[::-1], values)
+
+        components, landmarks = PCA_e.landmark_pca(self.trees, 2, 8, selection="maxmin")
+        self.assertEqual(components.shape, (self.n_trees, 2))
+        self.assertEqual(len(landmarks), 8)
+
+    def test_compact_tree(self):
+        trees = compact_tree.CompactTreeSet.from_newick(self.trees)
+        self.assertEqual(len(trees), self.n_trees)
+        for i in range(0, self.n_trees, 7):
+            tree1_prep = compact_tree.prepareTreeComparisonCompact(trees[i])
+            distances = [
+                compact_tree.RobinsonFouldsWithDay1985Compact(tree, tree1_prep)[0]
+                for tree in trees
+            ]
+            np.testing.assert_array_equal(distances, self.RF[i])
+
+    def test_compact_tree_degenerate(self):
+        # unary nodes and (leaf, subtree) roots count as branches in maple_RF
+        trees = [
+            "(A:1,(B:1,C:1,(D:1,E:1):1):1);",
+            "((A:1,B:1):1,C:1,(D:1,E:1):1);",
+            "((A:1,(B:1):1):1,(C:1,(D:1,E:1):1):1);",
+            "(((A:1,B:1):1):1,C:1,(D:1,E:2):2);",
+            "((A:1,B:1):1,(C:1,(D:1):0.5):1,E:1);",
+            "(((B:0.5):1):1,(A:1,C:1,(D:1,E:1):1):1);",
+        ]
+        parsed = maple_RF.readNewick(trees)
+        compact = compact_tree.CompactTreeSet.from_newick(trees)
+        for rooted in (False, True):
+            for i in range(len(trees)):
+                tree1_prep = maple_RF.prepareTreeComparison(parsed[i], rooted=rooted)
+                compact_prep = compact_tree.prepareTreeComparisonCompact(
+                    compact[i], rooted=rooted
+                )
+                for j in range(len(trees)):
+                    np.testing.assert_allclose(
+                        compact_tree.RobinsonFouldsWithDay1985Compact(
+                            compact[j], compact_prep, rooted=rooted
+                        ),
+                        maple_RF.RobinsonFouldsWithDay1985(
+                            parsed[j], tree1_prep, rooted=rooted
+                        ),
+                    )
+
+    def test_reader(self):
+        file = os.path.join(EXAMPLES, "bootstrap_mammals", "bootstrap_105")
+        batches = list(reader.stream_trees(file, batch_size=7))
+        self.assertTrue(all(len(batch) == 7 for batch in batches[:-1]))
+        trees = [tree for batch in batches for tree in batch]
+        self.assertEqual(len(trees), reader.count_trees(file))
+        self.assertEqual(trees[: self.n_trees], self.trees)
+        self.assertEqual(reader.select_trees(file, [12, 3]), [trees[12], trees[3]])
+        incidence, taxa = bitset_RF.split_incidence(iter(self.trees))
+        np.testing.assert_array_equal(bitset_RF.rf_from_incidence(incidence), self.RF)
+
+    def test_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "trees.nwk")
+            with open(file, "w") as f:
+                f.write(
+                    "\n".join(self.trees[:10])
+                    + "\r\n\n  \t\r\n"
+                    + "\n".join(self.trees[10:])
+                    + "\n \n\n"
+                )
+                f.close()
+            tree_index = index.TreeIndex(file)
+            # persisted in the cache, not next to the trees
+            self.assertEqual(os.listdir(directory), ["trees.nwk"])
+            self.assertEqual(len(os.listdir(self.cache_dir.name)), 1)
+            self.assertEqual(len(tree_index), self.n_trees)
+            self.assertEqual(list(tree_index), self.trees)
+            self.assertEqual(list(tree_index), list(reader.iter_trees(file)))
+            self.assertEqual(tree_index[[21, 4]], [self.trees[21], self.trees[4]])
+            np.testing.assert_array_equal(
+                index.TreeIndex(file).offsets, tree_index.offsets
+            )
+
+            trees, idxs = subsample.subsample(file, self.n_trees, 5, index=tree_index)
+            self.assertEqual(len(set(idxs)), 5)
+            self.assertEqual(trees, tree_index[idxs])
+            # only the drawn trees are parsed: the file is not cached whole
+            self.assertEqual(len(os.listdir(self.cache_dir.name)), 1)
+            compact_tree.CompactTreeSet.from_file(file)
+            trees, idxs = subsample.subsample(file, self.n_trees, 5, index=tree_index)
+            self.assertEqual(trees, tree_index[idxs])
+            tree_index.close()
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "trees.nwk")
+            with open(file, "w") as f:
+                f.write("\n".join(self.trees))
+                f.close()
+            for hit in (False, True):
+                self.assertEqual(len(os.listdir(self.cache_dir.name)), 2 * hit)
+                incidence, taxa = bitset_RF.file_split_incidence(file, self.n_trees)
+                np.testing.assert_array_equal(
+                    bitset_RF.rf_from_incidence(incidence), self.RF
+                )
+                trees = compact_tree.CompactTreeSet.from_file(file)
+                tree1_prep = compact_tree.prepareTreeComparisonCompact(trees[3])
+                distances = [
+                    compact_tree.RobinsonFouldsWithDay1985Compact(tree, tree1_prep)[0]
+                    for tree in trees
+                ]
+                np.testing.assert_array_equal(distances, self.RF[3])
+
+    def test_file_hash(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "trees.nwk")
+            with open(file, "w") as f:
+                f.write("\n".join(self.trees))
+                f.close()
+            digest = cache.file_hash(file)
+            # unchanged files are not read again
+            with mock.patch("builtins.open", side_effect=OSError):
+                self.assertEqual(cache.file_hash(file), digest)
+            with open(file, "a") as f:
+                f.write("\n" + self.trees[0])
+                f.close()
+            self.assertNotEqual(cache.file_hash(file), digest)
+
+    def test_scratch(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.environ[scratch.SCRATCH_DIR_ENV] = root
+            try:
+                with scratch.scratch_dir() as first, scratch.scratch_dir() as second:
+                    self.assertNotEqual(first, second)
+                    self.assertEqual(os.path.dirname(first), root)
+                    open(os.path.join(first, "SUBSAMPLE"), "w").close()
+                self.assertEqual(os.listdir(root), [])
+            finally:
+                del os.environ[scratch.SCRATCH_DIR_ENV]
+
+    def test_dedup(self):
+        order = [3, 0, 3, 7, 0, 3, 12]
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "trees.nwk")
+            with open(file, "w") as f:
+                f.write("\n".join(self.trees[i] for i in order))
+                f.close()
+            unique, inverse = dedup.unique_topologies(file, len(order))
+            np.testing.assert_array_equal(unique, [0, 1, 3, 6])
+            np.testing.assert_array_equal(inverse, [0, 1, 0, 2, 1, 0, 3])
+
+            distance_matrices, inverse = dedup.calculate_distance_matrix(
+                maple_RF.calculate_distance_matrix,
+                file,
+                len(order),
+                os.path.join(directory, "distances.csv"),
+                metrics=["RF", "nRF"],
+            )
+            np.testing.assert_array_equal(
+                distance_matrices["RF"], self.RF[np.ix_(order, order)]
+            )
+            self.assertTrue(os.path.exists(os.path.join(directory, "distances_nRF.csv")))
+        # HashRF and smart_RF are deduplicated only on request, weighted methods never
+        self.assertTrue(dedup.use_deduplication("tqdist_quartet"))
+        self.assertFalse(dedup.use_deduplication("tqdist_quartet", False))
+        self.assertFalse(dedup.use_deduplication("smart_RF"))
+        self.assertTrue(dedup.use_deduplication("smart_RF", True))
+        self.assertFalse(dedup.use_deduplication("hashrf_RF"))
+        self.assertTrue(dedup.use_deduplication("hashrf_RF", True))
+        self.assertFalse(dedup.use_deduplication("hashrf_wRF", True))
+
+    def test_matrix_io(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ("distances.npy", "distances.csv", "distances"):
+                file = os.path.join(directory, name)
+                matrix_io.save_matrix(self.RF, file)
+                self.assertTrue(os.path.exists(file))
+                distance_matrix = matrix_io.load_matrix(file)
+                np.testing.assert_array_equal(distance_matrix, self.RF)
+            self.assertIsInstance(distance_matrix, np.memmap)
+            del distance_matrix
+
+    def test_condensed(self):
+        distance_matrix = condensed.CondensedDistanceMatrix.from_matrix(self.RF)
+        self.assertEqual(distance_matrix.dtype, np.uint8)
+        np.testing.assert_array_equal(distance_matrix.condensed, squareform(self.RF))
+        np.testing.assert_array_equal(np.asarray(distance_matrix), self.RF)
+        np.testing.assert_array_equal(distance_matrix[5], self.RF[5])
+        self.assertEqual(distance_matrix[9, 2], self.RF[9, 2])
+
+        incidence, taxa = bitset_RF.split_incidence(self.trees)
+        distance_matrix = bitset_RF.rf_from_incidence(
+            incidence, block_size=4, condensed=True
+        )
+        np.testing.assert_array_equal(distance_matrix.condensed, squareform(self.RF))
+        self.assertEqual(
+            condensed.compact_dtype(np.array([0.5, 1.0])), np.dtype(np.float32)
+        )
+
+    def test_tiled(self):
+        def interrupted(rows, columns, diagonal=False):
+            if len(calls) == limit:
+                raise KeyboardInterrupt
+            calls.append((len(rows), len(columns)))
+            return tiled.smart_RF_tile(rows, columns, diagonal)
+
+        calls, limit = list(), 4
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "trees.nwk")
+            output_file = os.path.join(directory, "distances.npy")
+            with open(file, "w") as f:
+                f.write("\n".join(self.trees))
+                f.close()
+            tiled.TILE_METHODS["interrupted"] = interrupted
+            try:
+                with self.assertRaises(KeyboardInterrupt):
+                    tiled.calculate_distance_matrix(
+                        file, self.n_trees, output_file, "interrupted", tile_size=7
+                    )
+                # the 4 tiles finished before the interruption are not computed again
+                limit = None
+                distance_matrix = tiled.calculate_distance_matrix(
+                    file, self.n_trees, output_file, "interrupted", tile_size=7
+                )
+                self.assertEqual(len(calls), 5 * 6 // 2)
+                self.assertEqual(distance_matrix.dtype, np.uint8)
+                np.testing.assert_array_equal(np.asarray(distance_matrix), self.RF)
+                del distance_matrix
+
+                # tiles that do not fit in the dtype of the first one widen the output
+                tiled.TILE_METHODS["widened"] = lambda rows, columns, diagonal=False: (
+                    tiled.smart_RF_tile(rows, columns, diagonal)
+                    * (1 if diagonal else 100)
+                )
+                distance_matrix = tiled.calculate_distance_matrix(
+                    file,
+                    self.n_trees,
+                    os.path.join(directory, "widened.npy"),
+                    "widened",
+                    tile_size=7,
+                )
+                self.assertEqual(distance_matrix.dtype, np.uint16)
+                blocks = np.arange(self.n_trees) // 7
+                np.testing.assert_array_equal(
+                    np.asarray(distance_matrix),
+                    np.where(blocks[:, None] == blocks[None, :], 1, 100) * self.RF,
+                )
+            finally:
+                del tiled.TILE_METHODS["interrupted"]
+                tiled.TILE_METHODS.pop("widened", None)
+            del distance_matrix
+
+            # tile_size is never silently ignored
+            trees = tree_set(file)
+            with self.assertRaises(ValueError):
+                trees.calculate_distances("bitset_RF", tile_size=7)
+            with self.assertRaises(ValueError):
+                trees.calculate_distances("smart_RF", metrics=["RF", "KF"], tile_size=7)
+
+    def test_incremental_collection(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                sets = list()
+                for k in range(3):
+                    with open(f"run{k}.nwk", "w") as f:
+                        f.write("\n".join(self.trees[10 * k : 10 * (k + 1)]) + "\n")
+                        f.close()
+                    sets.append(tree_set(f"run{k}.nwk"))
+                collection = set_collection(sets[:2])
+                collection.calculate_distances("smart_RF")
+                self.assertEqual(len(collection.blocks), 3)
+                np.testing.assert_array_equal(
+                    np.asarray(collection.distance_matrix), self.RF[:20, :20]
+                )
+
+                collection = collection + sets[2]
+                self.assertEqual(len(collection.blocks), 3)
+                collection.calculate_distances("smart_RF")
+                self.assertEqual(len(collection.blocks), 6)
+                np.testing.assert_array_equal(
+                    np.asarray(collection.distance_matrix), self.RF
+                )
+
+                # blocks of sets in the opposite order are reused transposed
+                reversed_collection = collection.extended(sets[::-1])
+                with mock.patch.object(
+                    tiled, "rectangular_distance_matrix", side_effect=AssertionError
+                ):
+                    reversed_collection.calculate_distances("smart_RF")
+                order = [i for k in (2, 1, 0) for i in range(10 * k, 10 * (k + 1))]
+                np.testing.assert_array_equal(
+                    np.asarray(reversed_collection.distance_matrix),
+                    self.RF[np.ix_(order, order)],
+                )
+
+                distances = set_collection(sets).distance_between(
+                    "run2", sets[0], tile_size=4
+                )
+                np.testing.assert_array_equal(distances, self.RF[20:, :10])
+                np.testing.assert_array_equal(
+                    collection.distance_between(0, 2), self.RF[:10, 20:]
+                )
+
+                # sets with the same name in different directories, and sets whose
+                # matrix holds another metric, do not share blocks
+                os.mkdir("other")
+                with open(os.path.join("other", "run0.nwk"), "w") as f:
+                    f.write("\n".join(self.trees[20:]) + "\n")
+                    f.close()
+                other = tree_set(os.path.join("other", "run0.nwk"))
+                other.calculate_distances("smart_RF", metrics=["nRF", "KF"])
+                collection = collection + other
+                collection.calculate_distances("smart_RF")
+                order = list(range(30)) + list(range(20, 30))
+                np.testing.assert_array_equal(
+                    np.asarray(collection.distance_matrix), self.RF[np.ix_(order, order)]
+                )
+                with self.assertRaises(ValueError):
+                    set_collection([sets[0], tree_set("run0.nwk")]).calculate_distances(
+                        "smart_RF"
+                    )
+
+                # concatenated sets are written in a scratch directory, not in the cwd
+                files = set(os.listdir("."))
+                collection = set_collection(sets)
+                collection.calculate_distances("bitset_RF")
+                np.testing.assert_array_equal(
+                    np.asarray(collection.distance_matrix), self.RF
+                )
+                self.assertEqual(
+                    set(os.listdir(".")) - files,
+                    {os.path.basename(collection.output_file)},
+                )
+
+                # collections read their trees from the files of their sets
+                self.assertEqual(len(collection.index), self.n_trees)
+                self.assertEqual(collection.index[8:12], self.trees[8:12])
+                self.assertEqual(collection.index[-1], self.trees[-1])
+                np.testing.assert_array_equal(
+                    collection.distances_to(self.trees[4]), self.RF[:, [4]]
+                )
+                subsample_trees, idxs = subsample.subsample(
+                    collection.file, self.n_trees, 5, subp=False, index=collection.index
+                )
+                self.assertEqual(subsample_trees, [self.trees[i] for i in idxs])
+            finally:
+                os.chdir(cwd)
+
+    def test_distances_to(self):
+        distances = maple_RF.distances_to_references(
+            iter(self.trees), [self.trees[4], self.trees[17]], metrics=["RF", "KF"]
+        )
+        self.assertEqual(distances.shape, (2, self.n_trees, 2))
+        np.testing.assert_array_equal(distances[0], self.RF[:, [4, 17]])
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "trees.nwk")
+            with open(file, "w") as f:
+                f.write("\n".join(self.trees))
+                f.close()
+            distances = tree_set(file).distances_to(self.trees[9])
+            np.testing.assert_array_equal(distances, self.RF[:, [9]])
+
+
 if __name__ == "__main__":
     unittest.main()